@@ -1,9 +1,21 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-from ..services.rag_service import rag_service
-from ..services.audio_service import audio_service
+from typing import List, Optional
+from ..services.rag_service import rag_service_loader, snapshot_switcher
+from ..services.collection_cache import collection_cache
+from ..services.knowledge_bases import UnknownCollection, list_collections
+from ..services.audio_service import audio_service_loader, TranscriptionQueueFull
+from ..services.lazy_service import ServiceUnavailable, READY
+from ..services.stream_stt import StreamingTranscriber, create_decoder
+from ..ingestion.watcher import knowledge_base_watcher
+from ..core import metrics
+from ..core.config import settings
 import traceback
 import logging
+import json
+import time
+import asyncio
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,17 +26,80 @@ class ChatResponse(BaseModel):
     answer: str
     sources: str
 
+class PrefetchRequest(BaseModel):
+    text: str
+    session_id: str = "default"
+    collection: Optional[str] = None
+
+class SnapshotActivateRequest(BaseModel):
+    version: str
+    collection: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+    model_provider: str = "gemini"
+    max_concurrency: Optional[int] = None
+    collection: Optional[str] = None
+
+def _sse(event: str, data) -> str:
+    """编码一条 Server-Sent Event，data 以 JSON 编码以便安全传输换行符。"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _get_service(loader):
+    """Returns a lazily loaded service, waiting for it if it is still warming up (503 if disabled or failed)."""
+    try:
+        return await loader.aget()
+    except ServiceUnavailable as e:
+        logger.error(f"Service unavailable: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def _get_rag_service(collection: Optional[str], record: bool = True):
+    """Returns the RAG service of a knowledge-base collection (the default one when omitted), opening it if needed (404 if unknown)."""
+    try:
+        return await collection_cache.aget(collection, record)
+    except UnknownCollection as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ServiceUnavailable as e:
+        logger.error(f"Service unavailable: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def _stream_answer(rag_service, question: str, model_provider: str):
+    async for item in rag_service.stream_chain(question, model_provider):
+        yield _sse(item["event"], item["data"])
+
+async def _transcribe(audio_file: UploadFile) -> str:
+    """Transcribes an upload on the STT worker pool, mapping a full queue to 429."""
+    audio_service = await _get_service(audio_service_loader)
+    try:
+        return await audio_service.transcribe_upload(audio_file)
+    except TranscriptionQueueFull as e:
+        logger.warning(f"Rejecting audio request: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+def _event_stream_response(body) -> StreamingResponse:
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        # 禁止代理缓冲，保证 token 立即送达客户端
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/chat/text", response_model=ChatResponse)
 async def chat_with_text(
     question: str = Form(...),
-    model_provider: str = Form("gemini") # 'gemini', 'qwen'
+    model_provider: str = Form("gemini"), # 'gemini', 'qwen'
+    collection: Optional[str] = Form(None) # 知识库集合，默认为 DEFAULT_COLLECTION
 ):
     """Handles text-based questions."""
+    metrics.set_model_provider(model_provider)
     try:
         logger.info(f"Received text question: '{question}' with model: '{model_provider}'")
+        rag_service = await _get_rag_service(collection)
         result = await rag_service.invoke_chain(question, model_provider)
         logger.info(f"Successfully processed text question. Answer length: {len(result.get('answer', ''))}")
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing text question: {e}")
         traceback.print_exc()
@@ -33,31 +108,338 @@ async def chat_with_text(
 @router.post("/chat/audio", response_model=ChatResponse)
 async def chat_with_audio(
     audio_file: UploadFile = File(...),
-    model_provider: str = Form("gemini")
+    model_provider: str = Form("gemini"),
+    collection: Optional[str] = Form(None)
 ):
     """Handles audio-based questions."""
+    metrics.set_model_provider(model_provider)
     logger.info(f"Received audio request with model: '{model_provider}' and file type: {audio_file.content_type}")
     if not audio_file.content_type.startswith("audio/"):
         logger.warning(f"Invalid audio file type received: {audio_file.content_type}")
         raise HTTPException(status_code=400, detail="Invalid audio file.")
 
     try:
-        # Transcribe audio to text
-        transcribed_text = audio_service.transcribe_audio(audio_file.file)
+        # Transcribe audio to text (429 when the transcription queue is full)
+        transcribed_text = await _transcribe(audio_file)
         logger.info(f"Audio transcribed to text: '{transcribed_text}'")
         if not transcribed_text.strip():
             logger.warning("Transcribed text is empty or whitespace.")
             return ChatResponse(answer="Could not understand the audio. Please try again.", sources="")
 
         # Use the transcribed text to query RAG service
+        rag_service = await _get_rag_service(collection)
         result = await rag_service.invoke_chain(transcribed_text, model_provider)
         logger.info(f"Successfully processed audio question. Answer length: {len(result.get('answer', ''))}")
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing audio question: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Backend processing error: {str(e)}")
 
+@router.post("/chat/text/stream")
+async def chat_with_text_stream(
+    question: str = Form(...),
+    model_provider: str = Form("gemini"),
+    collection: Optional[str] = Form(None)
+):
+    """Streams the answer to a text question as Server-Sent Events: 'sources' first, then 'token' events, then 'done'."""
+    metrics.set_model_provider(model_provider)
+    logger.info(f"Received streaming text question: '{question}' with model: '{model_provider}'")
+    rag_service = await _get_rag_service(collection)
+    return _event_stream_response(_stream_answer(rag_service, question, model_provider))
+
+@router.post("/chat/audio/stream")
+async def chat_with_audio_stream(
+    audio_file: UploadFile = File(...),
+    model_provider: str = Form("gemini"),
+    collection: Optional[str] = Form(None)
+):
+    """Transcribes the audio, then streams the answer as Server-Sent Events ('transcript', 'sources', 'token', 'done')."""
+    metrics.set_model_provider(model_provider)
+    logger.info(f"Received streaming audio request with model: '{model_provider}' and file type: {audio_file.content_type}")
+    if not audio_file.content_type.startswith("audio/"):
+        logger.warning(f"Invalid audio file type received: {audio_file.content_type}")
+        raise HTTPException(status_code=400, detail="Invalid audio file.")
+
+    try:
+        transcribed_text = await _transcribe(audio_file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error transcribing audio: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Backend processing error: {str(e)}")
+    logger.info(f"Audio transcribed to text: '{transcribed_text}'")
+    rag_service = await _get_rag_service(collection)
+
+    async def body():
+        yield _sse("transcript", transcribed_text)
+        if not transcribed_text.strip():
+            logger.warning("Transcribed text is empty or whitespace.")
+            yield _sse("sources", "")
+            yield _sse("token", "Could not understand the audio. Please try again.")
+            yield _sse("done", "")
+            return
+        async for chunk in _stream_answer(rag_service, transcribed_text, model_provider):
+            yield chunk
+
+    return _event_stream_response(body())
+
+_SERVICE_LOADERS = (rag_service_loader, audio_service_loader)
+
+@router.post("/chat/batch")
+async def chat_batch(request: BatchRequest):
+    """
+    Answers a list of questions as Server-Sent Events: one 'result' event per question as soon as it completes
+    (in completion order, carrying its 'index'), then 'done' with batch statistics.
+    """
+    metrics.set_model_provider(request.model_provider)
+    questions = request.questions
+    if not questions or any(not q.strip() for q in questions):
+        raise HTTPException(status_code=400, detail="Questions must be a non-empty list of non-empty strings.")
+    if len(questions) > settings.batch_max_questions:
+        raise HTTPException(status_code=400, detail=f"Too many questions (max {settings.batch_max_questions}).")
+    max_concurrency = min(request.max_concurrency or settings.batch_max_concurrency, settings.batch_max_concurrency)
+    logger.info(f"Received batch of {len(questions)} questions with model: '{request.model_provider}'")
+    rag_service = await _get_rag_service(request.collection)
+
+    async def body():
+        started = time.perf_counter()
+        completed = 0
+        try:
+            async for result in rag_service.batch_chain(questions, request.model_provider, max_concurrency):
+                completed += 1
+                yield _sse("result", result)
+        except Exception as e:
+            logger.error(f"Error processing question batch: {e}", exc_info=True)
+            yield _sse("error", f"Backend processing error: {str(e)}")
+            return
+        elapsed = time.perf_counter() - started
+        yield _sse("done", {
+            "questions": completed,
+            "seconds": round(elapsed, 3),
+            "questions_per_sec": round(completed / elapsed, 3) if elapsed else None,
+        })
+
+    return _event_stream_response(body())
+
+@router.post("/prefetch", status_code=202)
+async def prefetch_context(request: PrefetchRequest):
+    """
+    Accepts a rolling window of the live transcript and retrieves context for its latest sentences in the background,
+    so that a question the user picks from it later skips embedding and retrieval.
+    Returns immediately; 429 (with Retry-After) when the session sends too often or prefetch capacity is busy.
+    A new window cancels the session's unfinished prefetch.
+    """
+    if not settings.prefetch_enabled:
+        raise HTTPException(status_code=503, detail="Prefetch is disabled by configuration.")
+    rag_service = await _get_rag_service(request.collection, record=False)
+    if not rag_service.collection_count:
+        return {"accepted": False, "reason": "empty_knowledge_base"}
+    result = rag_service.prefetcher.submit(request.session_id, request.text[-settings.prefetch_max_chars:])
+    if not result["accepted"]:
+        return JSONResponse(
+            status_code=429, content=result, headers={"Retry-After": str(max(1, round(result["retry_after"])))},
+        )
+    return result
+
+@router.websocket("/ws/audio")
+async def audio_stream(
+    websocket: WebSocket,
+    format: str = "pcm_s16le",
+    sample_rate: int = 16000,
+    channels: int = 1,
+    model_provider: str = "gemini",
+    collection: Optional[str] = None,
+):
+    """
+    Streaming speech-to-text over a WebSocket.
+
+    Binary frames carry audio (pcm_s16le / pcm_f32le at any sample rate, or opus in a WebM/Ogg container).
+    The server pushes {"type": "partial"|"final", "segment_id", "text"} as it transcribes.
+    Text frames are JSON commands:
+      {"type": "mark"}  end the current segment now (the server answers with its final transcript)
+      {"type": "ask", "segment_ids": [...], "model_provider": "...", "collection": "..."}  run a RAG query on the given segments
+          (default: the latest final segment) and stream {"type": "answer", "event", "data", "question"} back
+      {"type": "stop"}  finish the current segment and close
+    """
+    await websocket.accept()
+    try:
+        audio_service = await audio_service_loader.aget()
+    except ServiceUnavailable as e:
+        await websocket.send_json({"type": "error", "data": str(e)})
+        await websocket.close(code=1011)
+        return
+
+    send_lock = asyncio.Lock()
+
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    # 解码后的音频与控制命令进入同一个队列，保证命令在其之前收到的音频处理完之后执行。
+    # 队列有界: 转录跟不上时不无限积压，而是关闭连接
+    inbox = asyncio.Queue(maxsize=max(1, settings.stt_stream_max_inbox))
+    try:
+        decoder = create_decoder(inbox, format, sample_rate, channels)
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "data": str(e)})
+        await websocket.close(code=1003)
+        return
+    transcriber = StreamingTranscriber(
+        audio_service, send,
+        step_sec=settings.stt_stream_step_sec,
+        window_sec=settings.stt_stream_window_sec,
+        silence_sec=settings.stt_stream_silence_sec,
+        silence_rms=settings.stt_stream_silence_rms,
+    )
+    answer_tasks = set()
+
+    async def answer(question: str, provider: str, collection_name: Optional[str]):
+        try:
+            rag_service = await collection_cache.aget(collection_name)
+            async for item in rag_service.stream_chain(question, provider):
+                await send({"type": "answer", "event": item["event"], "data": item["data"], "question": question})
+        except Exception as e:
+            logger.error(f"Error answering streamed question: {e}", exc_info=True)
+            await send({"type": "answer", "event": "error", "data": f"Backend processing error: {str(e)}", "question": question})
+
+    async def pump():
+        while True:
+            item = await inbox.get()
+            if item is None:
+                if transcriber.pending_audio():
+                    await transcriber.finalize()
+                return
+            if not isinstance(item, dict):
+                await transcriber.feed(item)
+            elif item["type"] == "mark":
+                segment_id = await transcriber.finalize()
+                if segment_id is None:
+                    await send({"type": "final", "segment_id": None, "text": ""})
+            elif item["type"] == "ask":
+                if transcriber.pending_audio():
+                    await transcriber.finalize()
+                question = transcriber.text_for(item.get("segment_ids"))
+                if not question:
+                    await send({"type": "error", "data": "No transcribed speech to ask about."})
+                    continue
+                logger.info(f"Streaming audio question: '{question}'")
+                task = asyncio.create_task(answer(question, item.get("model_provider") or model_provider, item.get("collection") or collection))
+                answer_tasks.add(task)
+                task.add_done_callback(answer_tasks.discard)
+
+    pump_task = asyncio.create_task(pump())
+    await send({"type": "ready", "format": format, "sample_rate": sample_rate})
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                await decoder.feed(message["bytes"])
+                if decoder.overflowed:
+                    break
+                continue
+            try:
+                command = json.loads(message.get("text") or "{}")
+            except ValueError:
+                await send({"type": "error", "data": "Text frames must be JSON commands."})
+                continue
+            if command.get("type") == "stop":
+                await decoder.close()
+                await pump_task
+                await asyncio.gather(*answer_tasks, return_exceptions=True)
+                await websocket.close()
+                return
+            if command.get("type") in ("mark", "ask"):
+                decoder.deliver(command)
+                if decoder.overflowed:
+                    break
+            else:
+                await send({"type": "error", "data": f"Unknown command: {command.get('type')}"})
+        if decoder.overflowed:
+            logger.warning(f"Closing audio stream: more than {inbox.maxsize} audio chunks waiting for transcription.")
+            await send({"type": "error", "data": "Transcription cannot keep up with the audio stream; closing the connection."})
+            await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in audio stream: {e}", exc_info=True)
+    finally:
+        for task in [pump_task, *answer_tasks]:
+            task.cancel()
+        # 结束 ffmpeg 进程 (可重复调用)
+        await decoder.close()
+
+def _component_status() -> dict:
+    return {loader.name: loader.status() for loader in _SERVICE_LOADERS}
+
 @router.get("/status")
 def get_status():
-    return {"status": "ok", "message": "Backend is running"}
\ No newline at end of file
+    audio_service = audio_service_loader.instance
+    rag_service = rag_service_loader.instance
+    return {
+        "status": "ok",
+        "message": "Backend is running",
+        "components": _component_status(),
+        "stt_queue": audio_service.queue_stats() if audio_service is not None else None,
+        "single_flight": rag_service.single_flight_stats() if rag_service is not None else None,
+        "kb_watcher": knowledge_base_watcher.stats() if settings.kb_watch_enabled else None,
+        "snapshots": snapshot_switcher.status(),
+        "collections": collection_cache.stats(),
+        "prefetch": rag_service.prefetcher.stats() if rag_service is not None and rag_service.prefetcher is not None else None,
+    }
+
+@router.get("/collections")
+def get_collections():
+    """Lists the ingested knowledge-base collections with their load state and per-collection cache hit/miss statistics."""
+    stats = collection_cache.stats()
+    return {
+        "default": settings.default_collection,
+        "available": list_collections(),
+        "cache": stats,
+    }
+
+@router.get("/status/live")
+def get_liveness():
+    """Liveness: the process is up and serving requests (never touches the models)."""
+    return {"status": "ok"}
+
+@router.get("/status/ready")
+def get_readiness():
+    """Readiness: every enabled component has finished loading. Returns 503 while warming up or after a load failure."""
+    components = _component_status()
+    ready = all(loader.state == READY for loader in _SERVICE_LOADERS if loader.enabled)
+    content = {"status": "ready" if ready else "not_ready", "components": components}
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+def _check_admin_token(token: Optional[str]):
+    # 未配置 ADMIN_TOKEN 时不做校验 (后端默认只监听本机)
+    if settings.admin_token and token != settings.admin_token:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+@router.get("/admin/snapshots")
+async def list_index_snapshots(collection: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Lists the index snapshots on disk, the one CURRENT points to and the one the backend is serving."""
+    _check_admin_token(x_admin_token)
+    rag_service = await _get_rag_service(collection)
+    return snapshot_switcher.status(rag_service.collection_name)
+
+@router.post("/admin/snapshots/activate")
+async def activate_index_snapshot(request: SnapshotActivateRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Points CURRENT at a retained snapshot (e.g. to roll back) and swaps the backend over to it.
+    The new snapshot is opened and verified before the swap; queries keep using the old one meanwhile.
+    """
+    _check_admin_token(x_admin_token)
+    rag_service = await _get_rag_service(request.collection)
+    try:
+        return await asyncio.to_thread(snapshot_switcher.switch, request.version, True, rag_service.collection_name)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to activate snapshot '{request.version}': {e}", exc_info=True)
+        raise HTTPException(status_code=409, detail=f"Snapshot activation failed: {str(e)}")
@@ -10,12 +10,110 @@ class Settings(BaseSettings):
 
     # Ollama
     ollama_base_url: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+    ollama_keep_alive: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m") # 模型在 Ollama 中保持加载的时间
+    ollama_max_concurrency: int = int(os.getenv("OLLAMA_MAX_CONCURRENCY", 2))
+
+    # LLM
+    gemini_max_concurrency: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", 16))
+    llm_warmup_providers: str = os.getenv("LLM_WARMUP_PROVIDERS", "qwen") # 启动时预热的提供者，逗号分隔，留空则不预热
+    llm_warmup_ping: bool = os.getenv("LLM_WARMUP_PING", "false").lower() == "true" # 预热 Gemini 等付费 API 时是否发送一次真实请求 (会产生费用)，默认只创建客户端
 
     # ChromaDB
     chroma_server_host: str = os.getenv("CHROMA_SERVER_HOST", "localhost")
     chroma_server_http_port: int = int(os.getenv("CHROMA_SERVER_HTTP_PORT", 8000))
 
+    # Embeddings
+    embedding_model_name: str = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+    embedding_device: str = os.getenv("EMBEDDING_DEVICE", "auto") # 'auto', 'cpu', 'cuda'
+    embedding_num_threads: int = int(os.getenv("EMBEDDING_NUM_THREADS", 0)) # 0 表示自动: 后端为 CPU 核心数 / RETRIEVAL_WORKERS，ingest.py 使用全部核心
+    embedding_max_tokens_per_batch: int = int(os.getenv("EMBEDDING_MAX_TOKENS_PER_BATCH", 16384))
+    embedding_max_batch_size: int = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 256))
+    embedding_write_batch_size: int = int(os.getenv("EMBEDDING_WRITE_BATCH_SIZE", 1024))
+
+    # Retrieval
+    retrieval_workers: int = int(os.getenv("RETRIEVAL_WORKERS", 4)) # 查询嵌入与向量检索线程池大小
+    collection_count_refresh_sec: float = float(os.getenv("COLLECTION_COUNT_REFRESH_SEC", 10))
+    index_version_poll_sec: float = float(os.getenv("INDEX_VERSION_POLL_SEC", 1.0)) # 检查 index_version 的间隔，变化时立即使语义缓存和预取失效
+    hybrid_candidate_k: int = int(os.getenv("HYBRID_CANDIDATE_K", 20)) # 向量与 BM25 各自取回的候选数
+    hybrid_rrf_k: int = int(os.getenv("HYBRID_RRF_K", 60))
+    vector_store: str = os.getenv("VECTOR_STORE", "chroma").lower() # chroma，或 mmap: 使用 ingest.py 导出的 float16 向量索引做精确检索
+
+    # Single-flight
+    single_flight_enabled: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true" # 合并相同问题的在途请求
+
+    # Speculative prefetch (/prefetch: 根据实时转录提前检索)
+    prefetch_enabled: bool = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+    prefetch_min_interval_sec: float = float(os.getenv("PREFETCH_MIN_INTERVAL_SEC", 1.0)) # 每个会话两次预取之间的最短间隔
+    prefetch_max_concurrency: int = int(os.getenv("PREFETCH_MAX_CONCURRENCY", 1)) # 同时占用检索线程的预取数，避免挤占真实请求
+    prefetch_max_candidates: int = int(os.getenv("PREFETCH_MAX_CANDIDATES", 3)) # 每个转录窗口取最近几句作为候选问题
+    prefetch_min_chars: int = int(os.getenv("PREFETCH_MIN_CHARS", 6)) # 过短的句子不作为候选
+    prefetch_max_chars: int = int(os.getenv("PREFETCH_MAX_CHARS", 2000)) # 转录窗口只保留末尾这么多字符
+    prefetch_ttl_sec: float = float(os.getenv("PREFETCH_TTL_SEC", 120))
+    prefetch_max_entries: int = int(os.getenv("PREFETCH_MAX_ENTRIES", 64))
+    prefetch_match_threshold: float = float(os.getenv("PREFETCH_MATCH_THRESHOLD", 0.9)) # 问题与候选的余弦相似度达到该值即复用预取结果
+
+    # Batch questions (/chat/batch)
+    batch_max_questions: int = int(os.getenv("BATCH_MAX_QUESTIONS", 100))
+    batch_max_concurrency: int = int(os.getenv("BATCH_MAX_CONCURRENCY", 4)) # 同一批次内同时进行的 LLM 生成数 (仍受各提供者的并发上限约束)
+
+    # Context packing
+    context_max_chunks: int = int(os.getenv("CONTEXT_MAX_CHUNKS", 8)) # 预算未用完时最多取回的候选块数
+    context_token_budget_default: int = int(os.getenv("CONTEXT_TOKEN_BUDGET_DEFAULT", 1500))
+    context_token_budget_gemini: int = int(os.getenv("CONTEXT_TOKEN_BUDGET_GEMINI", 3000))
+    context_token_budget_qwen: int = int(os.getenv("CONTEXT_TOKEN_BUDGET_QWEN", 1200)) # 本地小模型的 prefill 较慢，预算更小
+
+    # Speech-to-text
+    stt_enabled: bool = os.getenv("STT_ENABLED", "true").lower() == "true" # 纯文本部署设为 false，不加载 whisper
+    stt_max_concurrency: int = int(os.getenv("STT_MAX_CONCURRENCY", 1)) # 并发转录数 (每个并发槽位加载一个 whisper 模型副本)
+    stt_max_queue: int = int(os.getenv("STT_MAX_QUEUE", 4)) # 排队上限，超出时返回 429
+    stt_batch_window_ms: float = float(os.getenv("STT_BATCH_WINDOW_MS", 50)) # 收集并发请求组成一个批次的等待窗口
+    stt_max_batch_size: int = int(os.getenv("STT_MAX_BATCH_SIZE", 8))
+    # Streaming STT (/ws/audio)
+    stt_stream_step_sec: float = float(os.getenv("STT_STREAM_STEP_SEC", 1.0)) # 每新增多少秒音频推送一次 partial
+    stt_stream_window_sec: float = float(os.getenv("STT_STREAM_WINDOW_SEC", 20.0)) # 单个片段的最长时长 (不超过 whisper 的 30 秒窗口)
+    stt_stream_silence_sec: float = float(os.getenv("STT_STREAM_SILENCE_SEC", 0.8)) # 片段末尾静音达到该时长即结束片段
+    stt_stream_silence_rms: float = float(os.getenv("STT_STREAM_SILENCE_RMS", 0.01))
+    stt_stream_max_inbox: int = int(os.getenv("STT_STREAM_MAX_INBOX", 256)) # 每个连接积压的音频块和命令上限，超出 (转录跟不上) 时关闭连接
+
+    # Semantic answer cache
+    semantic_cache_enabled: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    semantic_cache_threshold: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95)) # 余弦相似度阈值
+    semantic_cache_ttl_sec: float = float(os.getenv("SEMANTIC_CACHE_TTL_SEC", 24 * 3600))
+    semantic_cache_max_entries: int = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000)) # 每个 model_provider
+    semantic_cache_persist: bool = os.getenv("SEMANTIC_CACHE_PERSIST", "false").lower() == "true"
+
+    # Ingest
+    ingest_parse_workers: int = int(os.getenv("INGEST_PARSE_WORKERS", 0)) # 0 表示使用全部 CPU 核心
+    ingest_parse_timeout_sec: float = float(os.getenv("INGEST_PARSE_TIMEOUT_SEC", 120))
+    ingest_queue_size: int = int(os.getenv("INGEST_QUEUE_SIZE", 4)) # 流式管线各阶段之间的队列容量
+    ingest_dedup_enabled: bool = os.getenv("INGEST_DEDUP_ENABLED", "true").lower() == "true" # 嵌入前合并近重复块 (MinHash/LSH)
+    ingest_dedup_threshold: float = float(os.getenv("INGEST_DEDUP_THRESHOLD", 0.85)) # 估计的 Jaccard 相似度阈值
+    ingest_dedup_num_perm: int = int(os.getenv("INGEST_DEDUP_NUM_PERM", 128))
+    ingest_dedup_bands: int = int(os.getenv("INGEST_DEDUP_BANDS", 16)) # LSH 分段数，须整除 num_perm
+    knowledge_base_dir: str = os.getenv("KNOWLEDGE_BASE_DIR", "knowledge_base") # 相对路径相对于启动目录 (与 ingest.py 一致)
+    ingest_snapshots: bool = os.getenv("INGEST_SNAPSHOTS", "true").lower() == "true" # ingest.py 在新快照中构建，校验后切换
+
+    # Collections (命名知识库)
+    default_collection: str = os.getenv("DEFAULT_COLLECTION", "interview_assistant") # 未指定 collection 时使用，数据位于 chroma_data
+    knowledge_bases_dir: str = os.getenv("KNOWLEDGE_BASES_DIR", "knowledge_bases") # 命名集合的源文档目录: <dir>/<name>
+    collection_cache_max_mb: float = float(os.getenv("COLLECTION_CACHE_MAX_MB", 2048)) # 已打开集合的估算内存上限，超出时淘汰最久未用的
+    collection_cache_max_loaded: int = int(os.getenv("COLLECTION_CACHE_MAX_LOADED", 8)) # 同时打开的集合数上限 (含默认集合)
+    collection_warm_count: int = int(os.getenv("COLLECTION_WARM_COUNT", 2)) # 启动时预热使用次数最多的几个命名集合
+
+    # Index snapshots
+    snapshot_poll_sec: float = float(os.getenv("SNAPSHOT_POLL_SEC", 5.0)) # 后端检查 CURRENT 指针的间隔
+    snapshot_retention: int = int(os.getenv("SNAPSHOT_RETENTION", 3)) # 保留的快照数 (含当前快照)，用于回滚
+    snapshot_grace_sec: float = float(os.getenv("SNAPSHOT_GRACE_SEC", 30.0)) # 切换后旧快照继续服务在途请求的时间
+    admin_token: str = os.getenv("ADMIN_TOKEN", "") # 非空时管理接口需要 X-Admin-Token 请求头
+
+    # Knowledge-base watcher (后端运行时热更新索引)
+    kb_watch_enabled: bool = os.getenv("KB_WATCH_ENABLED", "false").lower() == "true"
+    kb_watch_interval_sec: float = float(os.getenv("KB_WATCH_INTERVAL_SEC", 2.0)) # 扫描目录的间隔
+    kb_watch_debounce_sec: float = float(os.getenv("KB_WATCH_DEBOUNCE_SEC", 3.0)) # 最后一次变化后静默多久才开始摄取
+    kb_watch_max_delay_sec: float = float(os.getenv("KB_WATCH_MAX_DELAY_SEC", 30.0)) # 持续变化时最多推迟多久
+    kb_watch_parse_workers: int = int(os.getenv("KB_WATCH_PARSE_WORKERS", 2)) # 解析进程数 (与查询共享 CPU，默认较小)
+
     class Config:
         case_sensitive = True
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
@@ -0,0 +1,286 @@
+# backend/app/core/metrics.py
+"""
+进程内的延迟指标，以 Prometheus 文本格式在 /metrics 暴露。
+
+每个请求阶段 (音频解码、STT、查询嵌入、检索、构建提示、LLM 首 token、LLM 总耗时)
+记录到按 stage / endpoint / model_provider 打标签的直方图中，用于区分 p99 回退来自
+Chroma、嵌入模型还是 LLM。endpoint 由 MetricsMiddleware 写入上下文变量，
+model_provider 由接口函数调用 set_model_provider 写入，阶段计时处无需逐层传递标签。
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from starlette.routing import compile_path
+
+# 默认桶覆盖毫秒级的检索到分钟级的本地 LLM 生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+current_endpoint = contextvars.ContextVar("current_endpoint", default="")
+current_model_provider = contextvars.ContextVar("current_model_provider", default="")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # 每个桶的 (非累计) 计数 + 溢出桶，渲染时再累加
+                series = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            else:
+                series["counts"][-1] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series["counts"]))) for key, series in self._values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "interview_stage_duration_seconds",
+    "Latency of each request stage (audio_decode, stt_queue, stt, query_embedding, vector_search, prompt_build, llm_ttft, llm_total).",
+    ("stage", "endpoint", "model_provider"),
+))
+REQUESTS_TOTAL = registry.register(Counter(
+    "interview_http_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status"),
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "interview_http_request_duration_seconds",
+    "End-to-end request latency including streamed response bodies.",
+    ("endpoint",),
+))
+IN_FLIGHT = registry.register(Gauge(
+    "interview_http_requests_in_flight", "Requests currently being processed.", ("endpoint",),
+))
+LLM_IN_FLIGHT = registry.register(Gauge(
+    "interview_llm_requests_in_flight", "LLM calls currently running (after the per-provider concurrency limit).", ("model_provider",),
+))
+CONTEXT_TOKENS = registry.register(Histogram(
+    "interview_context_tokens",
+    "Estimated tokens of the packed retrieval context sent to the LLM.",
+    ("model_provider",),
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192),
+))
+CONTEXT_TOKENS_SAVED = registry.register(Counter(
+    "interview_context_tokens_saved_total",
+    "Estimated context tokens removed by overlap dedup and chunk merging.",
+    ("model_provider",),
+))
+SINGLE_FLIGHT = registry.register(Counter(
+    "interview_single_flight_total",
+    "Calls that started a generation (leader) or joined an identical in-flight one (coalesced).",
+    ("group", "kind", "result"),
+))
+KB_INGEST_QUEUE_DEPTH = registry.register(Gauge(
+    "interview_kb_ingest_queue_depth", "Changed knowledge-base files detected by the watcher and not yet ingested.",
+))
+KB_INGEST_LAG_SECONDS = registry.register(Gauge(
+    "interview_kb_ingest_lag_seconds", "Age of the oldest knowledge-base change not yet applied to the index (0 when up to date).",
+))
+KB_INGEST_RUNS = registry.register(Counter(
+    "interview_kb_ingest_runs_total", "Live ingest runs triggered by the knowledge-base watcher, by result.", ("result",),
+))
+PREFETCH_REQUESTS = registry.register(Counter(
+    "interview_prefetch_requests_total",
+    "Transcript windows sent to /prefetch by outcome (accepted, rate_limited, busy, cancelled, completed).",
+    ("result",),
+))
+PREFETCH_LOOKUPS = registry.register(Counter(
+    "interview_prefetch_lookups_total", "Questions that reused a prefetched retrieval (hit) or had to retrieve (miss).", ("result",),
+))
+COLLECTION_LOOKUPS = registry.register(Counter(
+    "interview_collection_cache_lookups_total",
+    "Requests for a knowledge-base collection that found it loaded (hit) or had to open it (miss).",
+    ("collection", "result"),
+))
+COLLECTION_EVICTIONS = registry.register(Counter(
+    "interview_collection_cache_evictions_total", "Collections closed to stay within the memory budget.", ("collection",),
+))
+COLLECTION_MEMORY_BYTES = registry.register(Gauge(
+    "interview_collection_memory_bytes", "Estimated resident memory of each loaded collection (0 after eviction).", ("collection",),
+))
+CACHE_LOOKUPS = registry.register(Counter(
+    "interview_semantic_cache_lookups_total", "Semantic answer cache lookups by result.", ("model_provider", "result"),
+))
+
+
+def set_model_provider(model_provider: str):
+    current_model_provider.set(model_provider)
+
+
+def observe_stage(stage: str, seconds: float, model_provider: str = None):
+    STAGE_SECONDS.observe(
+        seconds,
+        stage=stage,
+        endpoint=current_endpoint.get(),
+        model_provider=model_provider if model_provider is not None else current_model_provider.get(),
+    )
+
+
+@contextmanager
+def time_stage(stage: str, model_provider: str = None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, model_provider)
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件: 设置 endpoint 上下文变量，统计请求数、在途请求数和端到端耗时。
+    与 BaseHTTPMiddleware 不同，它在流式响应体发送完毕后才结束计时。
+    endpoint 标签使用路由模板，未匹配的路径统一记为 "unmatched"，避免扫描请求撑爆标签基数。
+    routes 为 (前缀, 路由列表) 对: 新版 FastAPI 的 app.routes 不再展开 include_router 挂载的路由
+    (挂载条目没有 path)，因此子路由器的路由连同其前缀单独传入。模板在第一个请求时编译，
+    之后注册的路由同样生效。
+    """
+
+    def __init__(self, app, routes=(), excluded_paths=("/metrics",)):
+        self.app = app
+        self.routes = routes
+        self.excluded_paths = set(excluded_paths)
+        self._templates = None
+
+    def _compile_templates(self) -> list:
+        templates = []
+        for prefix, routes in self.routes:
+            for route in routes:
+                path = getattr(route, "path", None)
+                if path is None:
+                    continue
+                regex, path_format, _ = compile_path(prefix + path)
+                templates.append((regex, path_format))
+        return templates
+
+    def _endpoint(self, scope) -> str:
+        if self._templates is None:
+            self._templates = self._compile_templates()
+        for regex, path_format in self._templates:
+            if regex.match(scope["path"]):
+                return path_format
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        token = current_endpoint.set(endpoint)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc(endpoint=endpoint)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec(endpoint=endpoint)
+            REQUESTS_TOTAL.inc(endpoint=endpoint, status=status["code"])
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            current_endpoint.reset(token)
@@ -0,0 +1,250 @@
+# backend/app/ingestion/dedup.py
+"""
+摄取时的近重复块消除 (MinHash + LSH)。
+
+知识库中经常有同一份笔记的多个修订版本，分割后会产生大量几乎相同的块。
+嵌入之前为每个块计算 MinHash 签名 (字符 5-gram)，通过 LSH 分桶找到候选，
+估计的 Jaccard 相似度达到阈值的块不再嵌入和写入，只在代表块的元数据中记录其来源，
+检索时引用列表仍然完整。
+
+代表块的签名和被合并的重复来源持久化在 chroma_data/dedup_index.npz，增量摄取时新块也会与已有代表块比较。
+某个文件被修改或删除时，其代表块吸收过的其他文件需要重新摄取 (见 expand_diff)。
+"""
+import os
+import json
+import zlib
+import threading
+
+import numpy as np
+
+DEDUP_INDEX_FILENAME = "dedup_index.npz"
+FORMAT_VERSION = 1
+SHINGLE_SIZE = 5
+# 大于 2^32 的素数: 哈希值和系数都小于 2^32，a * h + b 不会溢出 uint64
+_PRIME = np.uint64(4294967311)
+_SEED = 1
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    normalized = " ".join(text.lower().split())
+    if not normalized:
+        return np.zeros(0, dtype=np.uint64)
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+class MinHasher:
+    def __init__(self, num_perm: int):
+        rng = np.random.RandomState(_SEED)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str):
+        """返回 uint32 签名；没有可用字符的文本返回 None。"""
+        hashes = _shingle_hashes(text)
+        if not len(hashes):
+            return None
+        values = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return values.min(axis=1).astype(np.uint32)
+
+
+class DedupIndex:
+    """
+    代表块的 MinHash 签名及其吸收的重复块来源。
+    所有方法都是线程安全的 (分割线程写入，主线程保存)。
+    """
+
+    def __init__(self, path: str, threshold: float, num_perm: int, bands: int):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+
+        self._ids = []
+        self._owners = []
+        self._signatures = []
+        self._alive = []
+        self._positions = {}
+        self._buckets = {}
+        # 代表块 ID -> [{"path", "source", "page"}, ...]
+        self.duplicates = {}
+        # 重复来源列表有变化、需要更新元数据的代表块
+        self.dirty = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, threshold: float, num_perm: int, bands: int):
+        """读取持久化的索引。文件不存在、损坏或签名参数不同时返回空索引。"""
+        index = cls(path, threshold, num_perm, bands)
+        if not os.path.exists(path):
+            return index
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("format_version") != FORMAT_VERSION or meta.get("num_perm") != num_perm or meta.get("bands") != bands:
+                    print("ℹ️ 去重索引的签名参数已变化，已有的块不参与本次去重 (使用 --rebuild 可完整去重)。")
+                    return index
+                signatures = data["signatures"]
+                for chunk_id, owner, signature in zip(meta["ids"], meta["owners"], signatures):
+                    index._add(chunk_id, owner, np.array(signature, dtype=np.uint32))
+                index.duplicates = {
+                    chunk_id: entries for chunk_id, entries in meta["duplicates"].items()
+                    if entries and chunk_id in index._positions
+                }
+                # 上次运行中断时可能还有未写入集合的元数据变更
+                index.dirty = set(meta.get("dirty", []))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ 警告: 无法读取去重索引 {path}: {e}")
+            return cls(path, threshold, num_perm, bands)
+        return index
+
+    def save(self):
+        with self._lock:
+            live = [i for i, alive in enumerate(self._alive) if alive]
+            meta = {
+                "format_version": FORMAT_VERSION,
+                "num_perm": self.num_perm,
+                "bands": self.bands,
+                "ids": [self._ids[i] for i in live],
+                "owners": [self._owners[i] for i in live],
+                "duplicates": self.duplicates,
+                "dirty": sorted(self.dirty),
+            }
+            signatures = np.stack([self._signatures[i] for i in live]) if live else np.zeros((0, self.num_perm), np.uint32)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, meta=np.array(json.dumps(meta, ensure_ascii=False)), signatures=signatures)
+        os.replace(tmp_path, self.path)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _add(self, chunk_id: str, owner: str, signature: np.ndarray):
+        position = self._positions.get(chunk_id)
+        if position is not None and self._alive[position]:
+            return
+        position = len(self._ids)
+        self._ids.append(chunk_id)
+        self._owners.append(owner)
+        self._signatures.append(signature)
+        self._alive.append(True)
+        self._positions[chunk_id] = position
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(position)
+
+    def _best_match(self, signature: np.ndarray):
+        best, best_similarity = None, 0.0
+        seen = set()
+        for key in self._band_keys(signature):
+            for position in self._buckets.get(key, ()):
+                if position in seen or not self._alive[position]:
+                    continue
+                seen.add(position)
+                similarity = float(np.mean(self._signatures[position] == signature))
+                if similarity >= self.threshold and similarity > best_similarity:
+                    best, best_similarity = position, similarity
+        return best
+
+    def add(self, chunk_id: str, owner: str, text: str):
+        """无条件登记为代表块 (用于上次中断前已提交的块)。"""
+        signature = self.hasher.signature(text)
+        if signature is not None:
+            with self._lock:
+                self._add(chunk_id, owner, signature)
+
+    def match_or_add(self, chunk_id: str, owner: str, text: str, metadata: dict):
+        """
+        与已有代表块比较: 是近重复时记录其来源并返回代表块 ID (调用方应丢弃该块)，
+        否则登记为新的代表块并返回 None。
+        """
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return None
+        with self._lock:
+            position = self._best_match(signature)
+            if position is None:
+                self._add(chunk_id, owner, signature)
+                return None
+            representative = self._ids[position]
+            self.duplicates.setdefault(representative, []).append({
+                "path": owner,
+                "source": metadata.get("source", owner),
+                "page": metadata.get("page", "N/A"),
+            })
+            self.dirty.add(representative)
+            return representative
+
+    def dependents(self, rel_paths) -> set:
+        """被 rel_paths 中文件的代表块吸收过重复块的其他文件。"""
+        rel_paths = set(rel_paths)
+        with self._lock:
+            return {
+                entry["path"]
+                for chunk_id, entries in self.duplicates.items()
+                if self._owners[self._positions[chunk_id]] in rel_paths
+                for entry in entries
+                if entry["path"] not in rel_paths
+            }
+
+    def remove_files(self, rel_paths):
+        """移除这些文件的代表块，并从其他代表块的重复来源中删除这些文件。"""
+        rel_paths = set(rel_paths)
+        if not rel_paths:
+            return
+        with self._lock:
+            for position, owner in enumerate(self._owners):
+                if self._alive[position] and owner in rel_paths:
+                    self._alive[position] = False
+                    self.duplicates.pop(self._ids[position], None)
+                    self.dirty.discard(self._ids[position])
+            for chunk_id, entries in list(self.duplicates.items()):
+                remaining = [entry for entry in entries if entry["path"] not in rel_paths]
+                if len(remaining) != len(entries):
+                    self.duplicates[chunk_id] = remaining
+                    self.dirty.add(chunk_id)
+
+    def expand_diff(self, diff, manifest) -> list:
+        """
+        修改或删除的文件若是某些代表块的所有者，被它们吸收的 (未变化的) 文件也要重新摄取，
+        否则这些文件的内容会随代表块一起从索引中消失。把这些文件移入 diff.modified 并返回。
+        """
+        affected = set(diff.removed) | set(diff.modified) | set(diff.added)
+        expanded = []
+        pending = set(affected)
+        while pending:
+            dependents = self.dependents(pending) - affected
+            dependents = {path for path in dependents if path in manifest.records and path in diff.file_stats}
+            affected |= dependents
+            expanded.extend(sorted(dependents))
+            pending = dependents
+        for rel_path in expanded:
+            for group in (diff.unchanged, diff.touched):
+                if rel_path in group:
+                    group.remove(rel_path)
+            diff.modified.append(rel_path)
+        diff.modified.sort()
+        self.remove_files(affected)
+        return expanded
+
+    def duplicate_metadata(self, chunk_id: str) -> dict:
+        """代表块需要写入的元数据: duplicate_sources 为 [[source, page], ...] 的 JSON 字符串。"""
+        with self._lock:
+            entries = self.duplicates.get(chunk_id, [])
+        pairs = sorted({(str(entry["source"]), str(entry["page"])) for entry in entries})
+        return {"duplicate_sources": json.dumps(pairs, ensure_ascii=False), "duplicate_count": len(entries)}
+
+    def take_dirty(self) -> list:
+        with self._lock:
+            dirty, self.dirty = sorted(self.dirty), set()
+        return dirty
+
+    def __len__(self):
+        return sum(self._alive)
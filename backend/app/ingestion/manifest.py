@@ -0,0 +1,214 @@
+# backend/app/ingestion/manifest.py
+"""
+知识库摄取清单 (manifest)。
+
+记录每个已摄取文件的路径、大小、修改时间、内容哈希以及写入 ChromaDB 的块 ID，
+使 ingest.py 只需处理新增或修改过的文件，并能删除已移除文件对应的块。
+"""
+import os
+import json
+import time
+import hashlib
+from dataclasses import dataclass, field, asdict
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+# 每次摄取改变了集合内容后更新，供后端缓存判断知识库是否变化
+INDEX_VERSION_FILENAME = "index_version"
+MANIFEST_VERSION = 1
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".docx")
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """分块计算文件内容的 SHA-256，避免一次性读入大文件。"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_id(rel_path: str, index: int) -> str:
+    """根据文件相对路径和块序号生成确定性的块 ID，重复摄取同一文件时 ID 不变。"""
+    path_digest = hashlib.sha1(rel_path.encode("utf-8")).hexdigest()[:16]
+    return f"{path_digest}-{index:05d}"
+
+
+def read_index_version(data_dir: str) -> str:
+    try:
+        with open(os.path.join(data_dir, INDEX_VERSION_FILENAME), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def bump_index_version(data_dir: str) -> str:
+    version = f"{time.time():.6f}"
+    path = os.path.join(data_dir, INDEX_VERSION_FILENAME)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{path}.tmp", path)
+    return version
+
+
+@dataclass
+class FileRecord:
+    path: str  # 相对于知识库目录的 POSIX 风格路径
+    size: int
+    mtime: float
+    sha256: str
+    chunk_ids: list = field(default_factory=list)
+
+
+@dataclass
+class ManifestDiff:
+    added: list = field(default_factory=list)
+    modified: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    unchanged: list = field(default_factory=list)
+    # 修改时间变了但内容哈希未变的文件，只需刷新清单，不必重新嵌入
+    touched: list = field(default_factory=list)
+    # 之前解析失败或超时且内容未变的文件，默认跳过
+    quarantined: list = field(default_factory=list)
+    # 本次扫描得到的 (size, mtime, sha256)，sha256 仅在计算过哈希时存在
+    file_stats: dict = field(default_factory=dict)
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.modified or self.removed or self.touched)
+
+    @property
+    def to_ingest(self) -> list:
+        return sorted(self.added + self.modified)
+
+    def summary(self) -> str:
+        return (
+            f"新增 {len(self.added)}, 修改 {len(self.modified)}, 删除 {len(self.removed)}, "
+            f"未变化 {len(self.unchanged) + len(self.touched)}, 已隔离 {len(self.quarantined)}"
+        )
+
+
+class IngestManifest:
+    def __init__(self, manifest_path: str, knowledge_base_dir: str, embedding_model: str, collection_name: str):
+        self.manifest_path = manifest_path
+        self.knowledge_base_dir = knowledge_base_dir
+        self.embedding_model = embedding_model
+        self.collection_name = collection_name
+        self.records = {}
+        # 解析失败或超时的文件: rel_path -> {"sha256", "reason", "time"}
+        self.quarantine = {}
+        self.updated_at = None
+
+    @classmethod
+    def load(cls, manifest_path: str, knowledge_base_dir: str, embedding_model: str, collection_name: str):
+        """
+        读取清单文件。清单不存在、损坏或与当前嵌入模型/集合不一致时返回 (空清单, False)，
+        调用方应据此进行一次完整重建。
+        """
+        manifest = cls(manifest_path, knowledge_base_dir, embedding_model, collection_name)
+        if not os.path.exists(manifest_path):
+            return manifest, False
+
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 警告: 无法读取摄取清单 {manifest_path}: {e}")
+            return manifest, False
+
+        if (
+            data.get("version") != MANIFEST_VERSION
+            or data.get("embedding_model") != embedding_model
+            or data.get("collection_name") != collection_name
+        ):
+            return manifest, False
+
+        manifest.records = {
+            rel_path: FileRecord(**record) for rel_path, record in data.get("files", {}).items()
+        }
+        manifest.quarantine = data.get("quarantine", {})
+        manifest.updated_at = data.get("updated_at")
+        return manifest, True
+
+    def save(self):
+        """原子地写入清单 (先写临时文件再替换)，避免中断时留下半个 JSON。"""
+        self.updated_at = time.time()
+        data = {
+            "version": MANIFEST_VERSION,
+            "embedding_model": self.embedding_model,
+            "collection_name": self.collection_name,
+            "updated_at": self.updated_at,
+            "files": {rel_path: asdict(record) for rel_path, record in sorted(self.records.items())},
+            "quarantine": self.quarantine,
+        }
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def iter_knowledge_base(self):
+        """遍历知识库目录，返回受支持文件的相对路径 (POSIX 风格)。"""
+        for root, _dirs, files in os.walk(self.knowledge_base_dir):
+            for name in files:
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    abs_path = os.path.join(root, name)
+                    rel_path = os.path.relpath(abs_path, self.knowledge_base_dir)
+                    yield rel_path.replace(os.sep, "/")
+
+    def abs_path(self, rel_path: str) -> str:
+        return os.path.join(self.knowledge_base_dir, *rel_path.split("/"))
+
+    def scan(self, retry_quarantined: bool = False) -> ManifestDiff:
+        """
+        对比知识库目录与清单。大小和修改时间都未变的文件直接视为未变化，
+        只有可疑文件才计算内容哈希，因此无变化时的重复运行只需 stat 每个文件。
+        内容未变的隔离文件会被跳过，除非 retry_quarantined 为 True。
+        """
+        diff = ManifestDiff()
+        seen = set()
+
+        for rel_path in self.iter_knowledge_base():
+            seen.add(rel_path)
+            try:
+                st = os.stat(self.abs_path(rel_path))
+            except OSError as e:
+                print(f"⚠️ 警告: 无法读取文件信息 {rel_path}: {e}")
+                continue
+
+            record = self.records.get(rel_path)
+            if record and record.size == st.st_size and record.mtime == st.st_mtime:
+                diff.unchanged.append(rel_path)
+                diff.file_stats[rel_path] = (st.st_size, st.st_mtime, record.sha256)
+                continue
+
+            sha = file_sha256(self.abs_path(rel_path))
+            diff.file_stats[rel_path] = (st.st_size, st.st_mtime, sha)
+            quarantined = self.quarantine.get(rel_path)
+            if record is None and quarantined and quarantined["sha256"] == sha and not retry_quarantined:
+                diff.quarantined.append(rel_path)
+            elif record is None:
+                diff.added.append(rel_path)
+            elif record.sha256 == sha:
+                diff.touched.append(rel_path)
+            else:
+                diff.modified.append(rel_path)
+
+        diff.removed = sorted(set(self.records) - seen)
+        for rel_path in set(self.quarantine) - seen:
+            del self.quarantine[rel_path]
+        return diff
+
+    def update(self, rel_path: str, size: int, mtime: float, sha256: str, chunk_ids: list):
+        self.records[rel_path] = FileRecord(rel_path, size, mtime, sha256, list(chunk_ids))
+        self.quarantine.pop(rel_path, None)
+
+    def add_quarantine(self, rel_path: str, sha256: str, reason: str):
+        self.quarantine[rel_path] = {"sha256": sha256, "reason": reason, "time": time.time()}
+
+    def touch(self, rel_path: str, size: int, mtime: float):
+        record = self.records[rel_path]
+        record.size = size
+        record.mtime = mtime
+
+    def remove(self, rel_path: str):
+        return self.records.pop(rel_path, None)
@@ -0,0 +1,207 @@
+# backend/app/ingestion/parsing.py
+"""
+多进程文档解析阶段。
+
+每个工作进程通过独立的 Pipe 接收任务并返回结果，主进程跟踪每个文件的开始时间：
+超过超时时间的文件会连同其工作进程一起被终止并隔离，再补充一个新的工作进程，
+因此一个损坏的 PDF 不会拖住整个摄取过程。解析结果按完成顺序逐个产出。
+"""
+import os
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+from dataclasses import dataclass, field
+
+from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
+from langchain.schema import Document
+
+# 按扩展名选择加载器
+LOADERS = {
+    ".pdf": PyPDFLoader,
+    ".txt": TextLoader,
+    ".docx": Docx2txtLoader,
+}
+
+
+def load_file(file_path: str) -> list:
+    """根据扩展名加载单个文件，返回 Document 列表。"""
+    loader_cls = LOADERS[os.path.splitext(file_path)[1].lower()]
+    return loader_cls(file_path).load()
+
+
+@dataclass
+class ParseResult:
+    rel_path: str
+    documents: list = field(default_factory=list)
+    error: str = None
+    timed_out: bool = False
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class ParseStats:
+    files: int = 0
+    pages: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    seconds: float = 0.0
+
+    def add(self, result: ParseResult):
+        self.files += 1
+        self.pages += len(result.documents)
+        if result.timed_out:
+            self.timed_out += 1
+        elif not result.ok:
+            self.failed += 1
+
+    def format(self) -> str:
+        files_per_sec = self.files / self.seconds if self.seconds else 0.0
+        pages_per_sec = self.pages / self.seconds if self.seconds else 0.0
+        return (
+            f"{self.files} 个文件, {self.pages} 页/段, 失败 {self.failed}, 超时 {self.timed_out}, "
+            f"耗时 {self.seconds:.2f} 秒 ({files_per_sec:.1f} 文件/秒, {pages_per_sec:.1f} 页/秒)"
+        )
+
+
+def _worker_main(conn, load=load_file):
+    """工作进程主循环: 接收 (rel_path, file_path)，返回解析出的 (page_content, metadata) 列表。"""
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+
+        rel_path, file_path = task
+        started = time.perf_counter()
+        try:
+            documents = load(file_path)
+            payload = [(doc.page_content, doc.metadata) for doc in documents]
+            conn.send((rel_path, payload, None, time.perf_counter() - started))
+        except Exception as e:
+            conn.send((rel_path, [], f"{type(e).__name__}: {e}", time.perf_counter() - started))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, ctx, load=load_file):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, load), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = 0.0
+
+    def assign(self, rel_path: str, file_path: str):
+        self.task = rel_path
+        self.started = time.monotonic()
+        self.conn.send((rel_path, file_path))
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ParsingPool:
+    """
+    用法:
+        pool = ParsingPool(workers=4, timeout=120)
+        for result in pool.imap([(rel_path, file_path), ...]):
+            ...
+        print(pool.stats.format())
+    """
+
+    def __init__(self, workers: int = 0, timeout: float = 120.0, load=load_file):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        # 加载函数在工作进程中调用，必须是可 pickle 的模块级函数
+        self.load = load
+        # 使用 spawn 以保证在 Windows 和 Linux 上的行为一致
+        self._ctx = multiprocessing.get_context("spawn")
+        self.stats = ParseStats()
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._ctx, self.load)
+
+    def _receive(self, worker: _Worker, pending, idle) -> ParseResult:
+        """读取已完成 (或已崩溃) 的工作进程的结果，并把进程放回空闲列表 (崩溃时补充新进程)。"""
+        try:
+            rel_path, payload, error, seconds = worker.conn.recv()
+        except (EOFError, OSError):
+            # 工作进程崩溃 (例如解析库段错误)，隔离该文件并补充新进程
+            result = ParseResult(worker.task, error="解析进程意外退出",
+                                 seconds=time.monotonic() - worker.started)
+            worker.kill()
+            if pending:
+                idle.append(self._spawn())
+            return result
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in payload]
+        idle.append(worker)
+        return ParseResult(rel_path, documents, error, seconds=seconds)
+
+    def imap(self, tasks):
+        """并行解析 tasks 中的文件，按完成顺序产出 ParseResult。"""
+        pending = deque(tasks)
+        if not pending:
+            return
+
+        started = time.perf_counter()
+        idle = [self._spawn() for _ in range(min(self.workers, len(pending)))]
+        busy = {}
+        try:
+            while pending or busy:
+                while pending and idle:
+                    worker = idle.pop()
+                    rel_path, file_path = pending.popleft()
+                    worker.assign(rel_path, file_path)
+                    busy[worker.conn] = worker
+
+                next_deadline = min(worker.started for worker in busy.values()) + self.timeout
+                ready = wait(list(busy), timeout=max(0.0, next_deadline - time.monotonic()))
+
+                for conn in ready:
+                    result = self._receive(busy.pop(conn), pending, idle)
+                    self.stats.add(result)
+                    yield result
+
+                # 下游较慢时上面的 yield 可能阻塞很久，期间完成的文件结果已在管道中等待:
+                # 只有管道中仍没有结果的工作进程才算超时
+                now = time.monotonic()
+                for conn, worker in list(busy.items()):
+                    if now - worker.started < self.timeout:
+                        continue
+                    del busy[conn]
+                    if conn.poll():
+                        result = self._receive(worker, pending, idle)
+                    else:
+                        worker.kill()
+                        result = ParseResult(worker.task, error=f"解析超时 (>{self.timeout:.0f} 秒)",
+                                             timed_out=True, seconds=now - worker.started)
+                        if pending:
+                            idle.append(self._spawn())
+                    self.stats.add(result)
+                    yield result
+        finally:
+            for worker in busy.values():
+                worker.kill()
+            for worker in idle:
+                worker.close()
+            self.stats.seconds += time.perf_counter() - started
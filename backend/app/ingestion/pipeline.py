@@ -0,0 +1,408 @@
+# backend/app/ingestion/pipeline.py
+"""
+流式摄取管线: 解析 -> 分割/去重/成批 -> 嵌入 -> upsert。
+
+每个阶段都是一个生成器，运行在独立线程中，阶段之间用有界队列连接，
+因此内存占用只取决于队列长度和批大小，与知识库规模无关；每批写入后立即可被检索。
+每批提交后会追加一条摄取日志 (journal)，中断后重新运行时已提交的块不会重复嵌入。
+"""
+import os
+import json
+import time
+import queue
+import threading
+import dataclasses
+from dataclasses import dataclass, field
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from ..core.config import settings
+from ..services.embedding_service import sanitize_metadata
+from .manifest import make_chunk_id, bump_index_version
+
+JOURNAL_FILENAME = "ingest_journal.jsonl"
+# 单次 delete 调用的最大 ID 数量，避免超出 ChromaDB 的批量限制
+DELETE_BATCH_SIZE = 5000
+# 清单最短保存间隔 (秒)，日志已记录每一批，清单无需每批都重写
+MANIFEST_SAVE_INTERVAL_SEC = 5.0
+
+# ingest.py 与知识库监视器必须使用相同的分割参数，否则同一文件的块 ID 和内容会不一致
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+_SENTINEL = object()
+
+
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _put(q: queue.Queue, item, stop_event: threading.Event) -> bool:
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def bounded_stage(iterable, maxsize: int, stop_event: threading.Event, name: str):
+    """
+    在后台线程中迭代 iterable，通过容量为 maxsize 的队列把结果交给调用方。
+    下游变慢时上游会阻塞在 put 上 (背压)；上游的异常会在调用方重新抛出。
+    """
+    q = queue.Queue(maxsize=maxsize)
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not _put(q, item, stop_event):
+                    return
+        except BaseException as e:
+            _put(q, _StageError(e), stop_event)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            _put(q, _SENTINEL, stop_event)
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if stop_event.is_set() and not thread.is_alive():
+                return
+            continue
+        if item is _SENTINEL:
+            break
+        if isinstance(item, _StageError):
+            raise item.error
+        yield item
+
+
+class IngestJournal:
+    """
+    追加式摄取日志，每行记录一批中某个文件已提交的块:
+    {"path": ..., "sha256": ..., "ids": [...]}。
+    只有 sha256 与当前文件一致的记录才会在恢复时被采用。
+    """
+
+    def __init__(self, journal_path: str):
+        self.journal_path = journal_path
+        self.committed = {}
+        if os.path.exists(journal_path):
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 最后一行可能因中断而不完整
+                        continue
+                    key = (entry["path"], entry["sha256"])
+                    self.committed.setdefault(key, set()).update(entry["ids"])
+        self._file = None
+
+    def committed_ids(self, rel_path: str, sha256: str) -> set:
+        return self.committed.get((rel_path, sha256), set())
+
+    def append(self, entries: list):
+        if not entries:
+            return
+        if self._file is None:
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+        for rel_path, sha256, ids in entries:
+            self._file.write(json.dumps({"path": rel_path, "sha256": sha256, "ids": ids}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self, completed: bool):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if completed and os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+@dataclass
+class _FileState:
+    rel_path: str
+    sha256: str
+    chunk_ids: list
+    remaining: int
+
+
+@dataclass
+class _Batch:
+    ids: list = field(default_factory=list)
+    documents: list = field(default_factory=list)
+    owners: list = field(default_factory=list)  # 每个块所属的 _FileState
+    completed: list = field(default_factory=list)  # 本批提交后全部块都已写入的文件
+    failed: list = field(default_factory=list)  # 解析失败的 ParseResult
+    vectors: object = None
+
+
+@dataclass
+class PipelineResult:
+    files_ingested: int = 0
+    chunks_written: int = 0
+    chunks_resumed: int = 0
+    chunks_deleted: int = 0
+    # 近重复去重: 未嵌入的重复块数、因代表块变化而重新摄取的文件、更新了重复来源元数据的代表块数
+    chunks_deduplicated: int = 0
+    files_reingested: list = field(default_factory=list)
+    metadata_updated: int = 0
+    batches: int = 0
+    failed_files: list = field(default_factory=list)
+    seconds: float = 0.0
+    embedding_seconds: float = 0.0
+    dedup_seconds: float = 0.0
+    # 本次摄取的嵌入引擎统计 (EmbeddingStats 增量)，没有嵌入任何块时为 None
+    embedding_stats: object = None
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks_written / self.seconds if self.seconds else 0.0
+
+    @property
+    def embedding_seconds_saved(self) -> float:
+        """按本次实测的每块嵌入耗时估算去重节省的嵌入时间。"""
+        if not self.chunks_written:
+            return 0.0
+        return self.chunks_deduplicated * self.embedding_seconds / self.chunks_written
+
+
+class IngestPipeline:
+    """
+    对一次 ManifestDiff 执行增量摄取: 先删除已移除/已修改文件的旧块，
+    再以流式管线处理新增/修改的文件，边提交边更新清单。
+    """
+
+    def __init__(
+        self,
+        collection,
+        manifest,
+        text_splitter,
+        parsing_pool,
+        embedding_engine_factory,
+        journal_path: str,
+        batch_size: int = settings.embedding_write_batch_size,
+        queue_size: int = settings.ingest_queue_size,
+        deduplicator=None,
+        log=print,
+    ):
+        self.collection = collection
+        self.manifest = manifest
+        self.text_splitter = text_splitter
+        self.parsing_pool = parsing_pool
+        self.embedding_engine_factory = embedding_engine_factory
+        self.journal = IngestJournal(journal_path)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        # DedupIndex，为 None 时不做近重复去重
+        self.deduplicator = deduplicator
+        self.log = log
+        self._embedding_engine = None
+        self._embedding_stats_start = None
+
+    def _delete(self, chunk_ids) -> int:
+        chunk_ids = list(chunk_ids)
+        for start in range(0, len(chunk_ids), DELETE_BATCH_SIZE):
+            self.collection.delete(ids=chunk_ids[start:start + DELETE_BATCH_SIZE])
+        return len(chunk_ids)
+
+    def apply_deletions(self, diff) -> int:
+        """删除已移除或已修改文件的旧块，保留上次中断前已为新内容提交的块。"""
+        deleted = 0
+        for rel_path in diff.removed + diff.modified:
+            record = self.manifest.remove(rel_path)
+            if record is None:
+                continue
+            if rel_path in diff.removed:
+                deleted += self._delete(record.chunk_ids)
+                self.log(f"🗑️ 已移除: {rel_path} ({len(record.chunk_ids)} 个块)")
+            else:
+                keep = self.journal.committed_ids(rel_path, diff.file_stats[rel_path][2])
+                deleted += self._delete(set(record.chunk_ids) - keep)
+
+        for rel_path in diff.added:
+            # 清理上次中断的摄取可能遗留的同源块 (已按当前内容提交的块除外)
+            existing = self.collection.get(where={"source": self.manifest.abs_path(rel_path)}, include=[])
+            keep = self.journal.committed_ids(rel_path, diff.file_stats[rel_path][2])
+            deleted += self._delete(set(existing["ids"]) - keep)
+
+        # 只更新了修改时间的文件无需重新嵌入
+        for rel_path in diff.touched:
+            size, mtime, _sha = diff.file_stats[rel_path]
+            self.manifest.touch(rel_path, size, mtime)
+        return deleted
+
+    def _split_and_batch(self, parse_results, diff, result: PipelineResult):
+        """分割每个解析完成的文件，并把块按 batch_size 组成批次。"""
+        batch = _Batch()
+        for parsed in parse_results:
+            rel_path = parsed.rel_path
+            sha = diff.file_stats[rel_path][2]
+            if not parsed.ok:
+                batch.failed.append(parsed)
+                continue
+
+            file_chunks = self.text_splitter.split_documents(parsed.documents)
+            ids = [make_chunk_id(rel_path, i) for i in range(len(file_chunks))]
+            committed = self.journal.committed_ids(rel_path, sha)
+            pending = [(chunk_id, doc) for chunk_id, doc in zip(ids, file_chunks) if chunk_id not in committed]
+            result.chunks_resumed += len(ids) - len(pending)
+            duplicates = 0
+            if self.deduplicator is not None:
+                pending, duplicates = self._deduplicate(rel_path, ids, file_chunks, committed, pending, result)
+                ids = [chunk_id for chunk_id in ids if chunk_id in committed] + [chunk_id for chunk_id, _doc in pending]
+            state = _FileState(rel_path, sha, ids, len(pending))
+            self.log(f"📄 {rel_path}: {len(parsed.documents)} 页/段, {len(file_chunks)} 个块 "
+                     f"({parsed.seconds:.2f} 秒)" + (f", 跳过 {len(file_chunks) - len(pending) - duplicates} 个已提交的块" if committed else "")
+                     + (f", {duplicates} 个近重复块已合并" if duplicates else ""))
+
+            if not pending:
+                batch.completed.append(state)
+            for chunk_id, doc in pending:
+                batch.ids.append(chunk_id)
+                batch.documents.append(doc)
+                batch.owners.append(state)
+                if len(batch.ids) >= self.batch_size:
+                    yield batch
+                    batch = _Batch()
+
+        if batch.ids or batch.completed or batch.failed:
+            yield batch
+
+    def _deduplicate(self, rel_path: str, ids: list, file_chunks: list, committed: set, pending: list, result: PipelineResult):
+        """丢弃与已有代表块近重复的待写入块，返回 (保留的待写入块, 丢弃数)。已提交的块直接登记为代表块。"""
+        started = time.perf_counter()
+        for chunk_id, doc in zip(ids, file_chunks):
+            if chunk_id in committed:
+                self.deduplicator.add(chunk_id, rel_path, doc.page_content)
+        kept = [
+            (chunk_id, doc) for chunk_id, doc in pending
+            if self.deduplicator.match_or_add(chunk_id, rel_path, doc.page_content, doc.metadata) is None
+        ]
+        result.chunks_deduplicated += len(pending) - len(kept)
+        result.dedup_seconds += time.perf_counter() - started
+        return kept, len(pending) - len(kept)
+
+    def _embed(self, batches, result: PipelineResult):
+        for batch in batches:
+            if batch.ids:
+                if self._embedding_engine is None:
+                    self._embedding_engine = self.embedding_engine_factory()
+                    stats = getattr(self._embedding_engine, "stats", None)
+                    self._embedding_stats_start = dataclasses.replace(stats) if stats is not None else None
+                started = time.perf_counter()
+                batch.vectors = self._embedding_engine.embed_array([doc.page_content for doc in batch.documents])
+                result.embedding_seconds += time.perf_counter() - started
+            yield batch
+
+    def _update_duplicate_metadata(self) -> int:
+        """把代表块吸收的重复来源写入其元数据 (duplicate_sources / duplicate_count)。"""
+        dirty = self.deduplicator.take_dirty()
+        updated = 0
+        for start in range(0, len(dirty), DELETE_BATCH_SIZE):
+            existing = self.collection.get(ids=dirty[start:start + DELETE_BATCH_SIZE], include=["metadatas"])
+            if not existing["ids"]:
+                continue
+            self.collection.update(
+                ids=existing["ids"],
+                metadatas=[
+                    dict(metadata or {}, **self.deduplicator.duplicate_metadata(chunk_id))
+                    for chunk_id, metadata in zip(existing["ids"], existing["metadatas"])
+                ],
+            )
+            updated += len(existing["ids"])
+        return updated
+
+    def _commit(self, batch: _Batch, diff, result: PipelineResult):
+        if batch.ids:
+            self.collection.upsert(
+                ids=batch.ids,
+                embeddings=batch.vectors,
+                documents=[doc.page_content for doc in batch.documents],
+                metadatas=[sanitize_metadata(doc.metadata) for doc in batch.documents],
+            )
+            result.chunks_written += len(batch.ids)
+
+            journal_entries = {}
+            for chunk_id, state in zip(batch.ids, batch.owners):
+                journal_entries.setdefault(state.rel_path, (state.sha256, []))[1].append(chunk_id)
+                state.remaining -= 1
+                if state.remaining == 0:
+                    batch.completed.append(state)
+            self.journal.append([(path, sha, ids) for path, (sha, ids) in journal_entries.items()])
+
+        for parsed in batch.failed:
+            self.log(f"⚠️ 已隔离 {parsed.rel_path}: {parsed.error}")
+            self.manifest.add_quarantine(parsed.rel_path, diff.file_stats[parsed.rel_path][2], parsed.error)
+            result.failed_files.append(parsed.rel_path)
+
+        for state in batch.completed:
+            size, mtime, sha = diff.file_stats[state.rel_path]
+            self.manifest.update(state.rel_path, size, mtime, sha, state.chunk_ids)
+            result.files_ingested += 1
+        result.batches += 1
+
+    def _save(self):
+        self.manifest.save()
+        if self.deduplicator is not None:
+            self.deduplicator.save()
+
+    def run(self, diff) -> PipelineResult:
+        result = PipelineResult()
+        started = time.perf_counter()
+        if self.deduplicator is not None:
+            # 代表块所在文件变化时，被其吸收的文件一并重新摄取
+            result.files_reingested = self.deduplicator.expand_diff(diff, self.manifest)
+            if result.files_reingested:
+                self.log(f"🧬 {len(result.files_reingested)} 个文件的块曾被合并到已变化文件的块中，将重新摄取: "
+                         f"{', '.join(result.files_reingested)}")
+        result.chunks_deleted = self.apply_deletions(diff)
+        self.manifest.save()
+
+        tasks = [(rel_path, self.manifest.abs_path(rel_path)) for rel_path in diff.to_ingest]
+        stop_event = threading.Event()
+        completed = False
+        last_save = time.monotonic()
+        try:
+            parsed = bounded_stage(self.parsing_pool.imap(tasks), self.queue_size, stop_event, "ingest-parse")
+            batches = bounded_stage(self._split_and_batch(parsed, diff, result), self.queue_size, stop_event, "ingest-split")
+            embedded = bounded_stage(self._embed(batches, result), self.queue_size, stop_event, "ingest-embed")
+            for batch in embedded:
+                self._commit(batch, diff, result)
+                # 已提交的批次立即可被检索，同时使后端的语义缓存和预取结果失效 (后端轮询 index_version)
+                bump_index_version(os.path.dirname(self.manifest.manifest_path))
+                self.log(f"💾 已提交第 {result.batches} 批: 累计 {result.chunks_written} 个块, "
+                         f"{result.files_ingested}/{len(tasks)} 个文件")
+                if time.monotonic() - last_save >= MANIFEST_SAVE_INTERVAL_SEC:
+                    self._save()
+                    last_save = time.monotonic()
+            if self.deduplicator is not None:
+                result.metadata_updated = self._update_duplicate_metadata()
+            completed = True
+        finally:
+            stop_event.set()
+            self._save()
+            self.journal.close(completed)
+            if result.chunks_written or result.chunks_deleted or result.metadata_updated:
+                bump_index_version(os.path.dirname(self.manifest.manifest_path))
+            result.seconds = time.perf_counter() - started
+            if self._embedding_stats_start is not None:
+                result.embedding_stats = self._embedding_engine.stats.since(self._embedding_stats_start)
+        return result
@@ -0,0 +1,343 @@
+# backend/app/ingestion/watcher.py
+"""
+知识库监视器: 后端运行时检测 knowledge_base 目录的变化并在线更新索引。
+
+后台线程定时对目录做一次 stat 扫描 (不读取文件内容)，发现变化后等待一段静默期 (debounce)，
+把连续保存、批量复制等突发变化合并为一次增量摄取: 复用 ingest.py 的清单和流式管线，
+只重新分割和嵌入受影响的文件。
+
+快照模式 (数据目录下有 CURRENT) 与 ingest.py 相同: 复制当前快照到新的快照目录，在其中 upsert/delete
+并重建 BM25 (以及 mmap 向量) 索引，随后由 SnapshotSwitcher 校验并切换，生效中的快照保持不变，可随时回滚。
+旧布局 (--in-place) 下直接写入 RAGService 正在使用的集合，已提交的批次立即可被检索。
+BM25 和向量索引是不可变的版本化导出 (mmap)，有变化时从集合整体重建；只更新了去重来源的元数据时不重建 BM25。
+摄取期间持有 RAGService (hold)，快照切换不会在写入过程中释放它的客户端。
+摄取在独立线程中进行，查询照常处理，扫描也不中断 (摄取期间的新变化排入下一轮)。
+
+只监视默认集合 (KNOWLEDGE_BASE_DIR)。命名集合 (knowledge_bases/<集合名>) 不在线更新，
+修改后运行 python scripts/ingest.py --collection <集合名>。
+"""
+import os
+import time
+import threading
+import logging
+
+from ..core.config import settings
+from ..core import metrics
+from .manifest import IngestManifest, MANIFEST_FILENAME, SUPPORTED_EXTENSIONS, read_index_version
+from .parsing import ParsingPool
+from .pipeline import IngestPipeline, JOURNAL_FILENAME, make_text_splitter
+from .dedup import DedupIndex, DEDUP_INDEX_FILENAME
+from ..services.lazy_service import ServiceUnavailable
+from ..services.rag_service import (
+    rag_service_loader, snapshot_switcher, open_persistent_client, release_persistent_client, COLLECTION_NAME,
+)
+from ..services.snapshots import create_snapshot, discard_snapshot, apply_retention
+from ..services.lexical_index import build_lexical_index, LEXICAL_INDEX_DIRNAME
+from ..services.vector_index import build_vector_index, VECTOR_INDEX_DIRNAME
+
+logger = logging.getLogger(__name__)
+
+IDLE = "idle"
+DEBOUNCING = "debouncing"
+INGESTING = "ingesting"
+STOPPED = "stopped"
+
+
+def snapshot_directory(knowledge_base_dir: str) -> dict:
+    """rel_path -> (size, mtime)，只包含受支持的文件。"""
+    snapshot = {}
+    for root, _dirs, files in os.walk(knowledge_base_dir):
+        for name in files:
+            if not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            abs_path = os.path.join(root, name)
+            try:
+                st = os.stat(abs_path)
+            except OSError:
+                continue
+            rel_path = os.path.relpath(abs_path, knowledge_base_dir).replace(os.sep, "/")
+            snapshot[rel_path] = (st.st_size, st.st_mtime)
+    return snapshot
+
+
+class KnowledgeBaseWatcher:
+    def __init__(
+        self,
+        rag_service_loader,
+        snapshot_switcher,
+        collection_name: str = COLLECTION_NAME,
+        knowledge_base_dir: str = settings.knowledge_base_dir,
+        interval_sec: float = settings.kb_watch_interval_sec,
+        debounce_sec: float = settings.kb_watch_debounce_sec,
+        max_delay_sec: float = settings.kb_watch_max_delay_sec,
+        parse_workers: int = settings.kb_watch_parse_workers,
+    ):
+        # 监视器只负责 rag_service_loader 对应的那一个集合
+        self.rag_service_loader = rag_service_loader
+        self.snapshot_switcher = snapshot_switcher
+        self.collection_name = collection_name
+        self.knowledge_base_dir = knowledge_base_dir
+        self.interval_sec = interval_sec
+        self.debounce_sec = debounce_sec
+        self.max_delay_sec = max_delay_sec
+        self.parse_workers = parse_workers
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._ingest_thread = None
+        self._lock = threading.Lock()
+        # 已检测到、尚未摄取的变化: rel_path -> 首次检测到的时间
+        self._pending = {}
+        # 正在摄取的变化 (计入队列深度和延迟，直到摄取完成)
+        self._in_progress = {}
+        self._last_change = None
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="kb-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"[KnowledgeBaseWatcher] Watching '{os.path.abspath(self.knowledge_base_dir)}' "
+                    f"(interval {self.interval_sec}s, debounce {self.debounce_sec}s).")
+
+    def stop(self, timeout: float = 5.0):
+        """停止扫描。正在进行的摄取不会被打断 (已提交的批次和清单保持一致)。"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def ingesting(self) -> bool:
+        return self._ingest_thread is not None and self._ingest_thread.is_alive()
+
+    @property
+    def state(self) -> str:
+        if self._thread is None:
+            return STOPPED
+        if self.ingesting:
+            return INGESTING
+        return DEBOUNCING if self._pending else IDLE
+
+    def _record_changes(self, previous: dict, current: dict):
+        changed = {path for path in set(previous) | set(current) if previous.get(path) != current.get(path)}
+        if not changed:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for path in changed:
+                self._pending.setdefault(path, now)
+            self._last_change = now
+        logger.info(f"[KnowledgeBaseWatcher] Detected {len(changed)} changed file(s), {len(self._pending)} pending.")
+
+    def _due(self) -> bool:
+        """静默期已过，或最早的变化已等待超过 max_delay_sec。"""
+        with self._lock:
+            if not self._pending:
+                return False
+            now = time.monotonic()
+            oldest = min(self._pending.values())
+            return now - self._last_change >= self.debounce_sec or now - oldest >= self.max_delay_sec
+
+    def _backlog(self):
+        """(队列深度, 最早未应用变化的检测时间)，包括正在摄取的文件。"""
+        with self._lock:
+            waiting = dict(self._in_progress)
+            for path, seen in self._pending.items():
+                waiting[path] = min(seen, waiting.get(path, seen))
+        return len(waiting), (min(waiting.values()) if waiting else None)
+
+    def _update_gauges(self):
+        depth, oldest = self._backlog()
+        metrics.KB_INGEST_QUEUE_DEPTH.set(depth)
+        metrics.KB_INGEST_LAG_SECONDS.set(time.monotonic() - oldest if oldest is not None else 0.0)
+
+    def _manifest_snapshot(self) -> dict:
+        """清单中记录的 (size, mtime)，用作初始快照，只有后端未运行期间变化的文件才会排队。"""
+        try:
+            service = self.rag_service_loader.get()
+        except ServiceUnavailable:
+            return {}
+        manifest, _valid = IngestManifest.load(
+            os.path.join(service.chroma_data_path, MANIFEST_FILENAME), self.knowledge_base_dir,
+            settings.embedding_model_name, self.collection_name,
+        )
+        return {rel_path: (record.size, record.mtime) for rel_path, record in manifest.records.items()}
+
+    def _loop(self):
+        previous = self._manifest_snapshot()
+        while True:
+            try:
+                current = snapshot_directory(self.knowledge_base_dir)
+                self._record_changes(previous, current)
+                previous = current
+                if not self.ingesting and self._due():
+                    self._ingest_thread = threading.Thread(target=self._run_once, name="kb-watcher-ingest", daemon=True)
+                    self._ingest_thread.start()
+                self._update_gauges()
+            except Exception as e:
+                logger.error(f"[KnowledgeBaseWatcher] Watch loop error: {e}", exc_info=True)
+            if self._stop_event.wait(self.interval_sec):
+                break
+
+    def _run_once(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._in_progress = batch
+        started = time.monotonic()
+        try:
+            summary = self._ingest()
+        except Exception as e:
+            # 失败的变化放回队列，下一轮静默期过后重试
+            with self._lock:
+                for path, seen in batch.items():
+                    self._pending[path] = min(seen, self._pending.get(path, seen))
+                self._last_change = time.monotonic()
+            self.failures += 1
+            self.last_error = str(e)
+            metrics.KB_INGEST_RUNS.inc(result="error")
+            logger.error(f"[KnowledgeBaseWatcher] Live ingest failed: {e}", exc_info=True)
+        else:
+            finished = time.monotonic()
+            self.runs += 1
+            self.last_error = None
+            summary["lag_seconds"] = round(finished - min(batch.values()), 3)
+            summary["seconds"] = round(finished - started, 3)
+            self.last_run = dict(summary, finished_at=time.time())
+            metrics.KB_INGEST_RUNS.inc(result="ok" if summary.get("applied") else "skipped")
+        finally:
+            with self._lock:
+                self._in_progress = {}
+            self._update_gauges()
+
+    def _log(self, message: str):
+        logger.info(f"[KnowledgeBaseWatcher] {message}")
+
+    def _ingest(self) -> dict:
+        """对当前目录执行一次增量摄取，返回摘要。"""
+        service = self.rag_service_loader.get()
+        with service.hold():
+            if service.snapshot_version:
+                return self._ingest_snapshot(service)
+            collection = service.collection
+            if collection is None:
+                raise RuntimeError("RAGService has no Chroma collection.")
+            summary = self._apply(collection, service.chroma_data_path, service.embedding_function)
+            if summary.get("applied"):
+                service.reload_indexes()
+            return summary
+
+    def _ingest_snapshot(self, service) -> dict:
+        """在新快照中应用变化，校验后切换 (生效中的快照只读，作为回滚目标保留)。"""
+        manifest, manifest_valid = IngestManifest.load(
+            os.path.join(service.chroma_data_path, MANIFEST_FILENAME), self.knowledge_base_dir,
+            settings.embedding_model_name, self.collection_name,
+        )
+        if manifest_valid and not manifest.scan().has_changes:
+            return {"applied": False, "reason": "no_changes"}
+
+        version, snapshot_dir = create_snapshot(service.data_root, service.chroma_data_path)
+        self._log(f"Building snapshot {version} from {service.snapshot_version}.")
+        try:
+            client = open_persistent_client(snapshot_dir)
+            try:
+                collection = client.get_or_create_collection(name=self.collection_name)
+                summary = self._apply(collection, snapshot_dir, service.embedding_function)
+            finally:
+                release_persistent_client(client, snapshot_dir)
+            if not summary.get("applied"):
+                discard_snapshot(service.data_root, version)
+                return summary
+            # 打开并校验新快照后更新 CURRENT，再原子地替换服务实例 (旧实例在宽限期后关闭)
+            self.snapshot_switcher.switch(version, activate=True, collection=self.collection_name)
+        except BaseException:
+            discard_snapshot(service.data_root, version)
+            raise
+        removed = apply_retention(service.data_root, settings.snapshot_retention, protect=[service.snapshot_version])
+        if removed:
+            self._log(f"Removed old snapshots by retention policy: {', '.join(removed)}")
+        summary["snapshot"] = version
+        return summary
+
+    def _apply(self, collection, data_dir: str, embedding_function) -> dict:
+        """把知识库的变化写入 data_dir 中的集合并重建索引。"""
+        manifest, manifest_valid = IngestManifest.load(
+            os.path.join(data_dir, MANIFEST_FILENAME), self.knowledge_base_dir, settings.embedding_model_name, self.collection_name
+        )
+        if not manifest_valid and collection.count() > 0:
+            # 清单缺失或嵌入模型变更: 需要完整重建，不能在服务运行时清空集合
+            logger.error("[KnowledgeBaseWatcher] Ingest manifest is missing or outdated; run 'python scripts/ingest.py --rebuild' once. Skipping live update.")
+            return {"applied": False, "reason": "manifest_invalid"}
+        if not manifest_valid:
+            # 集合为空: 按首次摄取处理，丢弃可能遗留的日志和去重索引
+            for stale_path in (os.path.join(data_dir, JOURNAL_FILENAME), os.path.join(data_dir, DEDUP_INDEX_FILENAME)):
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+
+        diff = manifest.scan()
+        if not diff.has_changes:
+            return {"applied": False, "reason": "no_changes"}
+        self._log(f"Applying changes: {diff.summary()}")
+
+        deduplicator = None
+        if settings.ingest_dedup_enabled:
+            deduplicator = DedupIndex.load(
+                os.path.join(data_dir, DEDUP_INDEX_FILENAME),
+                threshold=settings.ingest_dedup_threshold,
+                num_perm=settings.ingest_dedup_num_perm,
+                bands=settings.ingest_dedup_bands,
+            )
+        pipeline = IngestPipeline(
+            collection=collection,
+            manifest=manifest,
+            text_splitter=make_text_splitter(),
+            parsing_pool=ParsingPool(workers=self.parse_workers, timeout=settings.ingest_parse_timeout_sec),
+            embedding_engine_factory=lambda: embedding_function,
+            journal_path=os.path.join(data_dir, JOURNAL_FILENAME),
+            deduplicator=deduplicator,
+            log=self._log,
+        )
+        result = pipeline.run(diff)
+
+        index_version = read_index_version(data_dir)
+        if result.chunks_written or result.chunks_deleted:
+            lexical_index_dir = os.path.join(data_dir, LEXICAL_INDEX_DIRNAME)
+            os.makedirs(lexical_index_dir, exist_ok=True)
+            build_lexical_index(collection, lexical_index_dir, index_version)
+        if settings.vector_store == "mmap" and (result.chunks_written or result.chunks_deleted or result.metadata_updated):
+            vector_index_dir = os.path.join(data_dir, VECTOR_INDEX_DIRNAME)
+            os.makedirs(vector_index_dir, exist_ok=True)
+            build_vector_index(collection, vector_index_dir, index_version, settings.embedding_model_name)
+
+        return {
+            "applied": True,
+            "added": len(diff.added),
+            "modified": len(diff.modified),
+            "removed": len(diff.removed),
+            "chunks_written": result.chunks_written,
+            "chunks_deleted": result.chunks_deleted,
+            "chunks_deduplicated": result.chunks_deduplicated,
+            "metadata_updated": result.metadata_updated,
+            "failed_files": result.failed_files,
+        }
+
+    def stats(self) -> dict:
+        depth, oldest = self._backlog()
+        return {
+            "state": self.state,
+            "queue_depth": depth,
+            "lag_seconds": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+# 由 FastAPI lifespan 在 KB_WATCH_ENABLED=true 时启动 (只监视默认集合)
+knowledge_base_watcher = KnowledgeBaseWatcher(rag_service_loader, snapshot_switcher)
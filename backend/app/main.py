@@ -1,8 +1,39 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import Response
 from .api import interview
+from .services.llm_service import llm_registry
+from .services.rag_service import snapshot_switcher
+from .services.audio_service import audio_service_loader
+from .services.collection_cache import collection_cache
+from .ingestion.watcher import knowledge_base_watcher
+from .core.config import settings
+from .core import metrics
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="AI Interview Assistant API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 在后台加载模型并预热 LLM，不阻塞服务启动；加载进度见 /api/v1/status/ready
+    app.state.warmup_tasks = [
+        # 默认集合，随后是历史上最常用的命名集合
+        asyncio.create_task(collection_cache.warm_up()),
+        asyncio.create_task(audio_service_loader.warm_up()),
+        asyncio.create_task(llm_registry.warm_up_all()),
+    ]
+    # 监视 knowledge_base 目录，文件变化时在线增量更新索引
+    if settings.kb_watch_enabled:
+        knowledge_base_watcher.start()
+    # 轮询 chroma_data/CURRENT，ingest.py 激活新快照后在后台切换
+    snapshot_switcher.start()
+    yield
+    snapshot_switcher.stop()
+    collection_cache.save_usage()
+    knowledge_base_watcher.stop()
+    for task in app.state.warmup_tasks:
+        task.cancel()
+
+app = FastAPI(title="AI Interview Assistant API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -13,12 +44,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 按阶段统计延迟，Prometheus 从 /metrics 抓取
+app.add_middleware(metrics.MetricsMiddleware, routes=[("", app.routes), ("/api/v1", interview.router.routes)])
+
 app.include_router(interview.router, prefix="/api/v1")
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the AI Interview Assistant API"}
 
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 # @app.get("/status")
 # def get_status():
 #     return {"status": "ok", "message": "Backend is running"}
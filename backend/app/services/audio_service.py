@@ -1,13 +1,76 @@
-import whisper
-import os
-import tempfile
-import torch
+import io
+import time
+import wave
+import queue
+import asyncio
+import threading
+import contextlib
+import subprocess
+from collections import Counter, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from ..core.config import settings
+from ..core import metrics
+from .lazy_service import LazyService
+
+# whisper 期望 16 kHz 单声道 float32 输入
+SAMPLE_RATE = 16000
+# 统计排队延迟时保留的最近请求数
+QUEUE_DELAY_WINDOW = 1000
+
+
+class TranscriptionQueueFull(Exception):
+    """转录队列已满，调用方应返回 429。"""
+
+
+def decode_audio_bytes(data: bytes, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    在内存中把上传的音频解码为 float32 单声道数组，不经过临时文件。
+    16 kHz 单声道 16-bit PCM 的 WAV 直接解析，其他格式通过 stdin/stdout 管道交给 ffmpeg。
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            if wav.getframerate() == sr and wav.getnchannels() == 1 and wav.getsampwidth() == 2:
+                frames = wav.readframes(wav.getnframes())
+                return np.frombuffer(frames, np.int16).astype(np.float32) / 32768.0
+    except (wave.Error, EOFError):
+        pass
+
+    # 与 whisper.audio.load_audio 相同的参数，只是输入输出都走管道
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr),
+        "pipe:1",
+    ]
+    try:
+        out = subprocess.run(cmd, input=data, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to decode audio: {e.stderr.decode(errors='ignore')}") from e
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+@dataclass
+class _TranscriptionRequest:
+    audio: np.ndarray
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # 所在批次开始计算的时间，由批处理线程写入
+    started_at: float = None
+
 
 class AudioService:
     def __init__(self):
+        # whisper / torch 只在构建服务时导入，纯文本部署 (STT_ENABLED=false) 完全不会加载它们
+        import whisper
+        import torch
+
         # 检查是否存在可用的NVIDIA GPU和正确的CUDA环境
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        
+
         print("+"*50)
         if self.device == "cuda":
             print("✅ GPU detected! AudioService will run on 'cuda'.")
@@ -17,24 +80,179 @@ class AudioService:
             print("   Note: Speech-to-text performance will be significantly slower.")
         print("+"*50)
 
+        # fp16 (半精度浮点数) 可以大幅提升在现代GPU上的推理速度并减少显存占用
+        # 但在CPU模式下不支持，所以我们只在cuda模式下启用它
+        self.use_fp16 = self.device == "cuda"
+
         # 可选模型包括：tiny, base, small, medium, large
         # 更多信息请参考：https://github.com/openai/whisper/blob/main/README.md
-        self.model = whisper.load_model("base")
+        # whisper 在解码时会在模型上安装 kv-cache 钩子，同一个模型实例不能被并发使用，
+        # 因此每个并发转录槽位各持有一个模型副本，由各自的批处理线程独占
+        models = [whisper.load_model("base", device=self.device) for _ in range(max(1, settings.stt_max_concurrency))]
+        self.model = models[0]
+        self._start_scheduler(models)
+
+    # ---- 微批调度 ----
+
+    def _start_scheduler(self, models: list):
+        """初始化请求队列和名额计数，并为每个模型副本启动一个批处理线程。"""
+        self.max_concurrency = len(models)
+        self.max_queue = settings.stt_max_queue
+        self.batch_window_sec = max(0, settings.stt_batch_window_ms) / 1000.0
+        self.max_batch_size = max(1, settings.stt_max_batch_size)
+
+        self._requests = queue.Queue()
+        self._pending_lock = threading.Lock()
+        self._pending = 0
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_delays = deque(maxlen=QUEUE_DELAY_WINDOW)
+
+        for i, model in enumerate(models):
+            threading.Thread(target=self._batch_loop, args=(model,), name=f"stt-batch-{i}", daemon=True).start()
+
+    def _collect_batch(self) -> list:
+        """阻塞等待第一个请求，然后在批处理窗口内继续收集，直到达到 max_batch_size。"""
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + self.batch_window_sec
+        while len(batch) < self.max_batch_size:
+            try:
+                # 窗口结束后仍取走已经在排队的请求 (负载高时批次自然变大)
+                batch.append(self._requests.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self, model):
+        while True:
+            batch = [req for req in self._collect_batch() if req.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.monotonic()
+            for req in batch:
+                req.started_at = started
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._queue_delays.extend(started - req.enqueued_at for req in batch)
+            try:
+                texts = self._transcribe_batch(model, [req.audio for req in batch])
+            except Exception as e:
+                for req in batch:
+                    req.future.set_exception(e)
+                continue
+            for req, text in zip(batch, texts):
+                req.future.set_result(text)
+
+    def _transcribe_batch(self, model, audios: list) -> list:
+        """
+        不超过 30 秒的片段补齐到 whisper 的固定窗口后堆叠为一个 mel 批次，一次 decode 完成；
+        更长的片段需要 transcribe 的分段滑窗逻辑，逐个处理。
+        """
+        import whisper
+        import torch
+
+        texts = [None] * len(audios)
+        short = [i for i, audio in enumerate(audios) if len(audio) <= whisper.audio.N_SAMPLES]
+        if short:
+            mel = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(audios[i]), model.dims.n_mels)
+                for i in short
+            ]).to(model.device)
+            results = whisper.decode(model, mel, whisper.DecodingOptions(fp16=self.use_fp16))
+            for i, result in zip(short, results):
+                # 与 transcribe 一致: 判定为无语音的片段返回空文本
+                texts[i] = "" if result.no_speech_prob > 0.6 and result.avg_logprob < -1.0 else result.text
+        for i, audio in enumerate(audios):
+            if texts[i] is None:
+                texts[i] = model.transcribe(audio, fp16=self.use_fp16)["text"]
+        return texts
+
+    def _enqueue(self, audio: np.ndarray) -> _TranscriptionRequest:
+        request = _TranscriptionRequest(np.asarray(audio, dtype=np.float32))
+        self._requests.put(request)
+        return request
+
+    def submit(self, audio: np.ndarray) -> Future:
+        """把 16 kHz float32 数组交给批处理调度器，返回 concurrent.futures.Future。"""
+        return self._enqueue(audio).future
+
+    # ---- 对外接口 ----
+
+    def transcribe_array(self, audio: np.ndarray) -> str:
+        """转录 16 kHz float32 数组 (同步，阻塞直到所在批次完成)。"""
+        return self.submit(audio).result()
+
+    def transcribe_bytes(self, data: bytes) -> str:
+        return self.transcribe_array(decode_audio_bytes(data))
 
     def transcribe_audio(self, audio_file) -> str:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            tmp.write(audio_file.read())
-            tmp_path = tmp.name
+        return self.transcribe_bytes(audio_file.read())
+
+    @contextlib.contextmanager
+    def admit(self):
+        """
+        占用一个转录名额 (上传和 WebSocket 流式转录共用)。
+        正在处理和排队的请求总数超过 max_concurrency + max_queue 时立即抛出 TranscriptionQueueFull。
+        """
+        with self._pending_lock:
+            if self._pending >= self.max_concurrency + self.max_queue:
+                raise TranscriptionQueueFull(
+                    f"Transcription queue is full ({self._pending} requests in progress or waiting)."
+                )
+            self._pending += 1
+        try:
+            yield
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
 
+    async def _wait_transcription(self, audio: np.ndarray) -> str:
+        request = self._enqueue(audio)
         try:
-            # fp16 (半精度浮点数) 可以大幅提升在现代GPU上的推理速度并减少显存占用
-            # 但在CPU模式下不支持，所以我们只在cuda模式下启用它
-            use_fp16 = self.device == "cuda"
-            
-            result = self.model.transcribe(tmp_path, fp16=use_fp16)
-            
-            return result["text"]
+            return await asyncio.wrap_future(request.future)
         finally:
-            os.remove(tmp_path)
+            if request.started_at is not None:
+                # 排队 (等待批次) 与模型计算分开统计
+                metrics.observe_stage("stt_queue", request.started_at - request.enqueued_at)
+                metrics.observe_stage("stt", time.monotonic() - request.started_at)
+
+    async def transcribe_async(self, audio: np.ndarray) -> str:
+        """在 admit() 的名额限制下转录 16 kHz float32 数组，不阻塞事件循环。"""
+        with self.admit():
+            return await self._wait_transcription(audio)
+
+    async def transcribe_upload(self, upload_file) -> str:
+        """在线程池中解码上传的文件，再交给批处理调度器转录 (解码期间同样占用名额)，不阻塞事件循环。"""
+        with self.admit():
+            data = await upload_file.read()
+            loop = asyncio.get_running_loop()
+            with metrics.time_stage("audio_decode"):
+                audio = await loop.run_in_executor(None, decode_audio_bytes, data)
+            return await self._wait_transcription(audio)
+
+    def queue_stats(self) -> dict:
+        with self._pending_lock:
+            pending = self._pending
+        with self._stats_lock:
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+            delays = np.array(self._queue_delays, dtype=np.float64)
+        return {
+            "pending": pending,
+            "queued": self._requests.qsize(),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "batch_window_ms": self.batch_window_sec * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            # 批大小 -> 批次数
+            "batch_size_distribution": batch_sizes,
+            "queue_delay_ms": {
+                "count": int(len(delays)),
+                "mean": float(delays.mean() * 1000.0) if len(delays) else 0.0,
+                "p50": float(np.percentile(delays, 50) * 1000.0) if len(delays) else 0.0,
+                "p95": float(np.percentile(delays, 95) * 1000.0) if len(delays) else 0.0,
+                "max": float(delays.max() * 1000.0) if len(delays) else 0.0,
+            },
+        }
 
-audio_service = AudioService()
+# 延迟实例化服务: 首次使用或 lifespan 预热时才加载 whisper
+audio_service_loader = LazyService("stt", AudioService, enabled=settings.stt_enabled)
@@ -0,0 +1,210 @@
+# backend/app/services/collection_cache.py
+"""
+已打开集合的 LRU 缓存。
+
+每个命名集合 (见 knowledge_bases.py) 打开后都持有自己的 Chroma 客户端、HNSW 段、BM25/向量索引、
+检索线程池和答案缓存，无法同时全部常驻内存。请求按集合名取用 RAGService:
+已打开则命中，否则在线程中打开 (同一集合的并发请求等待同一次加载)，随后按估算内存
+(COLLECTION_CACHE_MAX_MB) 和数量 (COLLECTION_CACHE_MAX_LOADED) 淘汰最久未使用的集合。
+默认集合始终保留 (由 rag_service_loader 预热，供 /status/ready 报告)。
+被淘汰的实例在宽限期后关闭 (停止其 Chroma System，释放 HNSW 段)，已经拿到它的请求照常完成，最后一个请求结束后才释放。
+淘汰只卸载实例，集合的 LazyService 保留在缓存中，再次访问时重新打开。
+
+每个集合的累计使用次数保存在 chroma_data/collection_usage.json，启动时预热最常用的几个命名集合。
+"""
+import os
+import json
+import time
+import asyncio
+import functools
+import threading
+import logging
+from collections import OrderedDict
+
+from ..core.config import settings
+from ..core import metrics
+from .lazy_service import LazyService
+from .knowledge_bases import (
+    DEFAULT_DATA_ROOT, UnknownCollection, validate_collection_name, collection_data_root, list_collections,
+)
+from .rag_service import RAGService, rag_service_loader, snapshot_switcher, close_later
+
+logger = logging.getLogger(__name__)
+
+USAGE_FILENAME = "collection_usage.json"
+_MB = 1024 * 1024
+
+
+class CollectionCache:
+    def __init__(
+        self,
+        data_root: str = DEFAULT_DATA_ROOT,
+        max_bytes: float = settings.collection_cache_max_mb * _MB,
+        max_loaded: int = settings.collection_cache_max_loaded,
+        grace_sec: float = settings.snapshot_grace_sec,
+    ):
+        self.data_root = data_root
+        self.max_bytes = max_bytes
+        self.max_loaded = max(1, max_loaded)
+        self.grace_sec = grace_sec
+        self.default = settings.default_collection
+        # 集合名 -> LazyService，按最近使用排序 (最近使用的在末尾)
+        self._loaders = OrderedDict([(self.default, rag_service_loader)])
+        self._lock = threading.Lock()
+        # 集合名 -> {"hits", "misses", "evictions"}，进程内统计
+        self._stats = {}
+        self._memory = {}
+        self.usage_path = os.path.join(data_root, USAGE_FILENAME)
+        self.usage = self._load_usage()
+
+    def _load_usage(self) -> dict:
+        try:
+            with open(self.usage_path, "r", encoding="utf-8") as f:
+                return {name: int(count) for name, count in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"[CollectionCache] Ignoring unreadable usage file {self.usage_path}: {e}")
+            return {}
+
+    def save_usage(self):
+        with self._lock:
+            usage = dict(self.usage)
+        os.makedirs(self.data_root, exist_ok=True)
+        tmp_path = f"{self.usage_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(usage, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.usage_path)
+
+    def loader(self, name: str = None) -> LazyService:
+        """返回集合的 LazyService 并标记为最近使用 (不触发加载)。集合不存在时抛出 UnknownCollection。"""
+        name = validate_collection_name(name or self.default)
+        with self._lock:
+            loader = self._loaders.get(name)
+            if loader is None:
+                data_root = collection_data_root(name, self.data_root)
+                if not os.path.isdir(data_root):
+                    raise UnknownCollection(f"Collection '{name}' has not been ingested (run: python scripts/ingest.py --collection {name}).")
+                loader = LazyService(f"rag:{name}", functools.partial(RAGService, data_root, collection_name=name))
+                self._loaders[name] = loader
+                snapshot_switcher.watch(name, loader, data_root)
+            self._loaders.move_to_end(name)
+        return loader
+
+    def _record(self, name: str, hit: bool):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"hits": 0, "misses": 0, "evictions": 0})
+            stats["hits" if hit else "misses"] += 1
+            self.usage[name] = self.usage.get(name, 0) + 1
+        metrics.COLLECTION_LOOKUPS.inc(collection=name, result="hit" if hit else "miss")
+
+    def get(self, name: str = None) -> RAGService:
+        loader = self.loader(name)
+        hit = loader.instance is not None
+        service = loader.get()
+        self._record(service.collection_name, hit)
+        if not hit:
+            self._enforce_budget(keep=service.collection_name)
+        return service
+
+    async def aget(self, name: str = None, record: bool = True) -> RAGService:
+        """
+        get() 的异步版本: 集合尚未打开时在线程中加载，不阻塞事件循环。
+        record=False 时不计入命中统计和使用次数 (预取等后台流量)。
+        """
+        loader = self.loader(name)
+        hit = loader.instance is not None
+        service = await loader.aget()
+        if record:
+            self._record(service.collection_name, hit)
+        if not hit:
+            await asyncio.to_thread(self._enforce_budget, service.collection_name)
+        return service
+
+    def _enforce_budget(self, keep: str):
+        """按估算内存和数量上限淘汰最久未使用的已加载集合 (默认集合和 keep 除外)。"""
+        with self._lock:
+            loaded = [(name, loader, loader.instance) for name, loader in self._loaders.items() if loader.instance is not None]
+        # 估算值缓存在各个实例上，只有新打开的集合需要遍历数据目录，不在持有锁时进行
+        memory = {name: service.estimate_memory_bytes() for name, _loader, service in loaded}
+        evicted = []
+        with self._lock:
+            self._memory.update(memory)
+            total = sum(memory.values())
+            count = len(loaded)
+            for name, loader, service in loaded:
+                if total <= self.max_bytes and count <= self.max_loaded:
+                    break
+                if name in (self.default, keep):
+                    continue
+                total -= memory[name]
+                count -= 1
+                evicted.append((name, loader, service))
+            if total > self.max_bytes:
+                logger.warning(f"[CollectionCache] Loaded collections use ~{total / _MB:.0f} MB, "
+                               f"above the {self.max_bytes / _MB:.0f} MB budget even after eviction.")
+        for name, loader, service in evicted:
+            # LazyService 留在 _loaders 中，只卸载实例: 之前拿到该 loader 的调用者再次 get() 时重新打开，
+            # 新实例仍由缓存跟踪。期间实例已被快照切换替换或已被另一次淘汰卸载时跳过
+            if loader.reset(expected=service) is None:
+                continue
+            with self._lock:
+                self._memory.pop(name, None)
+                self._stats.setdefault(name, {"hits": 0, "misses": 0, "evictions": 0})["evictions"] += 1
+            close_later(service, self.grace_sec)
+            metrics.COLLECTION_EVICTIONS.inc(collection=name)
+            logger.info(f"[CollectionCache] Evicted collection '{name}' to stay within the memory budget.")
+        with self._lock:
+            memory = dict(self._memory)
+        for name, _loader, _service in loaded:
+            metrics.COLLECTION_MEMORY_BYTES.set(memory.get(name, 0), collection=name)
+
+    def most_used(self, count: int) -> list:
+        """使用次数最多、且已摄取的命名集合 (不含默认集合)。"""
+        available = set(list_collections(self.data_root)) - {self.default}
+        with self._lock:
+            ranked = sorted(available, key=lambda name: self.usage.get(name, 0), reverse=True)
+        return [name for name in ranked if self.usage.get(name, 0) > 0][:count]
+
+    async def warm_up(self, count: int = settings.collection_warm_count):
+        """依次预热最常用的命名集合 (在默认集合之后加载，不计入命中统计)。失败只记录日志。"""
+        await rag_service_loader.warm_up()
+        for name in self.most_used(min(count, self.max_loaded - 1)):
+            started = time.perf_counter()
+            try:
+                await self.loader(name).aget()
+            except Exception as e:
+                logger.warning(f"[CollectionCache] Failed to warm up collection '{name}': {e}")
+                continue
+            await asyncio.to_thread(self._enforce_budget, name)
+            logger.info(f"[CollectionCache] Warmed up collection '{name}' in {time.perf_counter() - started:.2f}s.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaders = dict(self._loaders)
+            stats = {name: dict(entry) for name, entry in self._stats.items()}
+            usage = dict(self.usage)
+            memory = dict(self._memory)
+        collections = {}
+        for name in sorted(loaders):
+            loader = loaders[name]
+            entry = stats.get(name, {"hits": 0, "misses": 0, "evictions": 0})
+            lookups = entry["hits"] + entry["misses"]
+            evicted = loader.instance is None and entry["evictions"] > 0
+            collections[name] = dict(
+                entry,
+                state="evicted" if evicted else loader.state,
+                hit_rate=round(entry["hits"] / lookups, 3) if lookups else None,
+                total_requests=usage.get(name, 0),
+                memory_mb=round(memory[name] / _MB, 1) if name in memory else None,
+            )
+        return {
+            "max_mb": round(self.max_bytes / _MB, 1),
+            "max_loaded": self.max_loaded,
+            "loaded": sum(1 for loader in loaders.values() if loader.instance is not None),
+            "loaded_mb": round(sum(memory.get(name, 0) for name in loaders) / _MB, 1),
+            "collections": collections,
+        }
+
+
+collection_cache = CollectionCache()
@@ -0,0 +1,158 @@
+# backend/app/services/context_packer.py
+"""
+按 token 预算打包检索到的上下文。
+
+摄取时 chunk_overlap=200，同一文件相邻的块经常重复同样的一段文字。打包时:
+  1. 按检索排名依次选取块，直到达到 token 预算 (完全重复或被包含的块直接跳过)
+  2. 同一来源、同一页的块按原文顺序 (块 ID 的序号) 排列，相邻块去掉重叠部分后合并为一段
+  3. 各段按其中最相关块的排名输出
+token 数为估算值 (汉字按 1 个、其他字符按 4 个字符 1 个计)，只用于预算和统计。
+摄取时被合并的近重复块的来源 (元数据 duplicate_sources) 也列入引用来源。
+"""
+import os
+import re
+import json
+from dataclasses import dataclass
+
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+# 认定为重叠的最短长度，避免把偶然相同的几个字符当成重叠
+MIN_OVERLAP_CHARS = 20
+# 重叠检测的最大长度 (应不小于摄取时的 chunk_overlap)
+MAX_OVERLAP_CHARS = 400
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _overlap(left: str, right: str) -> int:
+    """left 的后缀与 right 的前缀重合的最大长度 (不足 MIN_OVERLAP_CHARS 时返回 0)。"""
+    for length in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def _duplicate_sources(doc) -> list:
+    """摄取去重时记录在代表块元数据中的 [(source, page), ...]。"""
+    raw = doc.metadata.get("duplicate_sources")
+    if not raw:
+        return []
+    try:
+        return [tuple(pair) for pair in json.loads(raw)]
+    except (ValueError, TypeError):
+        return []
+
+
+def _ordinal(doc):
+    """块在文件中的序号 (块 ID 形如 '<路径哈希>-00012')，无法解析时返回 None。"""
+    chunk_id = getattr(doc, "id", None) or ""
+    suffix = chunk_id.rsplit("-", 1)[-1]
+    return int(suffix) if suffix.isdigit() else None
+
+
+@dataclass
+class PackedContext:
+    context: str
+    sources: str
+    chunks: int
+    segments: int
+    tokens: int
+    # 同样这些块直接拼接时的 token 数，与 tokens 的差即为去重合并节省的部分
+    naive_tokens: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.naive_tokens - self.tokens)
+
+
+@dataclass
+class _Group:
+    source: str
+    page: object
+    rank: int
+    items: list
+    duplicates: set
+
+
+def _header(source, page) -> str:
+    return f"Source: {source}, Page: {page}"
+
+
+def pack_context(docs: list, budget_tokens: int) -> PackedContext:
+    """docs 按相关度排序。至少包含排名第一的块，即使它本身超出预算。"""
+    groups = {}
+    seen = set()
+    used = 0
+    naive = 0
+    selected = 0
+    for rank, doc in enumerate(docs):
+        text = doc.page_content.strip()
+        if not text or text in seen:
+            continue
+        source = doc.metadata.get("source", "N/A")
+        page = doc.metadata.get("page", "N/A")
+        group = groups.get((source, page))
+
+        # 估算加入该块实际增加的 token 数 (扣除与同组已选块的重叠)
+        new_chars = len(text)
+        if group is not None:
+            for _rank, _ordinal_value, other in group.items:
+                if text in other:
+                    new_chars = 0
+                    break
+                new_chars = min(new_chars, len(text) - max(_overlap(other, text), _overlap(text, other)))
+        if new_chars == 0:
+            seen.add(text)
+            continue
+        header_cost = estimate_tokens(_header(source, page)) + 2 if group is None else 0
+        cost = estimate_tokens(text) * new_chars // len(text) + header_cost
+        if selected and used + cost > budget_tokens:
+            continue
+
+        if group is None:
+            group = groups[(source, page)] = _Group(source, page, rank, [], set())
+        group.items.append((rank, _ordinal(doc), text))
+        group.duplicates.update(_duplicate_sources(doc))
+        seen.add(text)
+        used += cost
+        naive += estimate_tokens(_header(source, page)) + 2 + estimate_tokens(text)
+        selected += 1
+
+    sections = []
+    segment_count = 0
+    for group in sorted(groups.values(), key=lambda g: g.rank):
+        # 有序号时按原文顺序排列，否则保持检索排名
+        items = sorted(group.items, key=lambda item: (item[1] is None, item[1] if item[1] is not None else item[0]))
+        segments = [items[0][2]]
+        for _rank, _ordinal_value, text in items[1:]:
+            previous = segments[-1]
+            if text in previous:
+                continue
+            overlap = _overlap(previous, text)
+            if overlap:
+                segments[-1] = previous + text[overlap:]
+            else:
+                segments.append(text)
+        segment_count += len(segments)
+        sections.append(f"{_header(group.source, group.page)}\nContent: " + "\n...\n".join(segments))
+
+    context = "\n\n".join(sections)
+    cited = {(str(g.source), str(g.page)) for g in groups.values()}
+    for g in groups.values():
+        cited.update((str(source), str(page)) for source, page in g.duplicates)
+    sources = "\n".join(
+        f"- {os.path.basename(source)}, Page: {page}"
+        for source, page in sorted(cited)
+    )
+    return PackedContext(
+        context=context,
+        sources=sources,
+        chunks=selected,
+        segments=segment_count,
+        tokens=estimate_tokens(context),
+        naive_tokens=naive,
+    )
@@ -0,0 +1,201 @@
+# backend/app/services/embedding_service.py
+"""
+按 token 长度分桶、自适应批大小的嵌入引擎。
+
+ingest.py 与 RAGService 共用同一个实例 (见 get_embedding_engine)，
+因此摄取与查询时的嵌入配置始终一致。
+"""
+import os
+import time
+import threading
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EmbeddingStats:
+    chunks: int = 0
+    tokens: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    def since(self, earlier: "EmbeddingStats") -> "EmbeddingStats":
+        """相对 earlier 的增量。引擎在进程内共享，统计一直累加，单次摄取的吞吐按增量计算。"""
+        return EmbeddingStats(
+            chunks=self.chunks - earlier.chunks,
+            tokens=self.tokens - earlier.tokens,
+            batches=self.batches - earlier.batches,
+            seconds=self.seconds - earlier.seconds,
+        )
+
+    def format(self) -> str:
+        return (
+            f"{self.chunks} chunks / {self.batches} batches in {self.seconds:.2f}s "
+            f"({self.chunks_per_sec:.1f} chunks/s, {self.tokens_per_sec:.0f} tokens/s)"
+        )
+
+
+def sanitize_metadata(metadata: dict) -> dict:
+    """ChromaDB 只接受 str/int/float/bool 类型的元数据值。"""
+    return {
+        key: value for key, value in metadata.items()
+        if isinstance(value, (str, int, float, bool))
+    }
+
+
+class BucketedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings 实现。先按 token 长度排序并分桶，再按
+    max_tokens_per_batch / 桶内最大长度 决定每个桶的批大小：
+    短文本用大批次，长文本用小批次，减少 padding 浪费并控制峰值内存。
+    """
+
+    def __init__(
+        self,
+        model_name: str = settings.embedding_model_name,
+        device: str = settings.embedding_device,
+        num_threads: int = settings.embedding_num_threads,
+        concurrent_callers: int = 1,
+        max_tokens_per_batch: int = settings.embedding_max_tokens_per_batch,
+        max_batch_size: int = settings.embedding_max_batch_size,
+        min_batch_size: int = 8,
+        bucket_width: int = 32,
+        normalize_embeddings: bool = True,
+    ):
+        # torch / sentence-transformers 导入较慢，延迟到构建引擎时
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+        self.model_name = model_name
+
+        if device == "cpu":
+            # 固定 torch 线程数，避免与其他线程池争抢核心导致的过度订阅。
+            # torch 的线程池按调用线程各自使用，后端有 RETRIEVAL_WORKERS 个线程同时调用模型，
+            # 默认把核心平分给它们 (ingest.py 只有一个嵌入线程，使用全部核心)
+            self.num_threads = num_threads or max(1, (os.cpu_count() or 1) // max(1, concurrent_callers))
+            torch.set_num_threads(self.num_threads)
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                # 只能在首次并行计算之前设置，之后调用会抛出异常
+                pass
+        else:
+            self.num_threads = torch.get_num_threads()
+
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_batch_size = max_batch_size
+        self.min_batch_size = min_batch_size
+        self.bucket_width = bucket_width
+        self.normalize_embeddings = normalize_embeddings
+
+        logger.info(f"Loading embedding model '{model_name}' on {device} (torch threads: {self.num_threads})")
+        self.model = SentenceTransformer(model_name, device=device)
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+        self.stats = EmbeddingStats()
+        self._stats_lock = threading.Lock()
+
+    def token_lengths(self, texts: list) -> list:
+        """返回截断到 max_seq_length 后的 token 数 (含特殊 token)。"""
+        encoded = self.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def plan_batches(self, lengths: list) -> list:
+        """将文本下标按长度分桶，返回 [(下标列表, 桶内最大长度), ...]。"""
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        batches = []
+        start = 0
+        while start < len(order):
+            bucket_ceiling = (lengths[order[start]] // self.bucket_width + 1) * self.bucket_width
+            end = start
+            while end < len(order) and lengths[order[end]] < bucket_ceiling:
+                end += 1
+
+            bucket_max_len = max(lengths[order[end - 1]], 1)
+            batch_size = self.max_tokens_per_batch // bucket_max_len
+            batch_size = max(self.min_batch_size, min(self.max_batch_size, batch_size))
+            for batch_start in range(start, end, batch_size):
+                batches.append((order[batch_start:min(batch_start + batch_size, end)], bucket_max_len))
+            start = end
+        return batches
+
+    def embed_array(self, texts: list) -> np.ndarray:
+        """嵌入一组文本，按原顺序返回 float32 矩阵。"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        started = time.perf_counter()
+        lengths = self.token_lengths(texts)
+        result = np.empty((len(texts), self.dimension), dtype=np.float32)
+        batches = self.plan_batches(lengths)
+        for indices, _bucket_max_len in batches:
+            vectors = self.model.encode(
+                [texts[i] for i in indices],
+                batch_size=len(indices),
+                normalize_embeddings=self.normalize_embeddings,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            result[indices] = vectors
+
+        with self._stats_lock:
+            self.stats.chunks += len(texts)
+            self.stats.tokens += sum(lengths)
+            self.stats.batches += len(batches)
+            self.stats.seconds += time.perf_counter() - started
+        return result
+
+    def embed_documents(self, texts: list) -> list:
+        return self.embed_array(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> list:
+        vector = self.model.encode(
+            [text],
+            normalize_embeddings=self.normalize_embeddings,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vector[0].tolist()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_embedding_engine(concurrent_callers: int = 1) -> BucketedEmbeddings:
+    """
+    返回进程内共享的嵌入引擎 (首次调用时加载模型)。
+    concurrent_callers 为同时调用模型的线程数，只在首次调用时用于确定默认的 torch 线程数。
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = BucketedEmbeddings(concurrent_callers=concurrent_callers)
+    return _engine
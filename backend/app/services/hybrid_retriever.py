@@ -0,0 +1,142 @@
+# backend/app/services/hybrid_retriever.py
+"""
+混合检索: 稠密向量检索 (ChromaDB，或 ingest.py 导出的 mmap 向量索引) + BM25 词法检索，
+用倒数排名融合 (RRF) 合并结果。
+
+纯向量检索容易漏掉 API 名、缩写等精确技术词项，BM25 正好弥补这一点；
+RRF 只依赖排名，不需要对两种得分做归一化。
+"""
+import logging
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+
+def reciprocal_rank_fusion(rankings: list, rrf_k: int = 60) -> list:
+    """rankings 为若干按相关度排序的 ID 列表，返回按融合得分排序的 [(id, score), ...]。"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    collection: Any = None
+    # 可选: collection 为 None 时按需打开集合的函数 (mmap 模式下 RAGService 延迟连接 Chroma)
+    collection_loader: Any = None
+    embedding_function: Any
+    lexical_index: Any = None
+    # 设置后稠密检索和按 ID 取回都走 mmap 向量索引，不再查询集合
+    vector_index: Any = None
+    k: int = 3
+    # 每一路检索的候选数量
+    candidate_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.search(query)
+
+    def _get_collection(self):
+        if self.collection is None and self.collection_loader is not None:
+            self.collection = self.collection_loader()
+        return self.collection
+
+    def dense_search(self, query_vector, n_results: int) -> dict:
+        return self.dense_search_batch([query_vector], n_results)[0]
+
+    def dense_search_batch(self, query_vectors: list, n_results: int) -> list:
+        """一次 collection.query 完成多个向量的检索，返回每个查询的 {chunk_id: Document} (按距离排序)。"""
+        vector_index = self.vector_index
+        if vector_index is not None:
+            return [
+                {vector_index.chunk_id(row): self._vector_index_document(vector_index, row) for row, _score in hits}
+                for hits in vector_index.search_batch(query_vectors, n_results)
+            ]
+        collection = self._get_collection()
+        if collection is None:
+            raise RuntimeError("No vector index and the Chroma collection is unavailable.")
+        result = collection.query(
+            query_embeddings=list(query_vectors),
+            n_results=n_results,
+            include=["documents", "metadatas"],
+        )
+        return [
+            {
+                chunk_id: Document(page_content=text or "", metadata=metadata or {}, id=chunk_id)
+                for chunk_id, text, metadata in zip(ids, documents, metadatas)
+            }
+            for ids, documents, metadatas in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+
+    @staticmethod
+    def _vector_index_document(vector_index, row: int) -> Document:
+        text, metadata = vector_index.record(row)
+        return Document(page_content=text, metadata=metadata, id=vector_index.chunk_id(row))
+
+    def fetch(self, chunk_ids: list) -> dict:
+        """按块 ID 取回正文和元数据，返回 {chunk_id: Document}。"""
+        found = {}
+        vector_index = self.vector_index
+        if vector_index is not None:
+            for chunk_id, row in vector_index.rows_for(chunk_ids).items():
+                found[chunk_id] = self._vector_index_document(vector_index, row)
+        remaining = [chunk_id for chunk_id in chunk_ids if chunk_id not in found]
+        collection = self._get_collection() if remaining else None
+        if collection is not None:
+            fetched = collection.get(ids=remaining, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+                found[chunk_id] = Document(page_content=text or "", metadata=metadata or {}, id=chunk_id)
+        return found
+
+    def search(self, query: str, query_vector: Optional[list] = None, k: Optional[int] = None) -> List[Document]:
+        if query_vector is None:
+            query_vector = self.embedding_function.embed_query(query)
+        return self.search_batch([query], [query_vector], k)[0]
+
+    def search_batch(self, queries: list, query_vectors: list, k: Optional[int] = None) -> list:
+        """
+        批量混合检索: 向量检索合并为一次集合查询 (或一次矩阵乘法)，仅由词法检索命中的块也合并为一次取回。
+        返回与 queries 对应的文档列表。
+        """
+        k = k or self.k
+        if not queries:
+            return []
+        dense_results = self.dense_search_batch(query_vectors, max(self.candidate_k, k))
+
+        lexical_index = self.lexical_index
+        if lexical_index is None:
+            return [list(dense_docs.values())[:k] for dense_docs in dense_results]
+
+        fused_results = []
+        for query, dense_docs in zip(queries, dense_results):
+            lexical_ranking = [chunk_id for chunk_id, _score in lexical_index.search(query, max(self.candidate_k, k))]
+            fused_results.append(reciprocal_rank_fusion([list(dense_docs), lexical_ranking], self.rrf_k)[:k])
+
+        # 仅由词法检索命中的块需要另外取回正文和元数据
+        known = {}
+        for dense_docs in dense_results:
+            known.update(dense_docs)
+        missing = list({chunk_id for fused in fused_results for chunk_id, _score in fused if chunk_id not in known})
+        if missing:
+            known.update(self.fetch(missing))
+
+        results = []
+        for fused in fused_results:
+            docs = []
+            for chunk_id, score in fused:
+                doc = known.get(chunk_id)
+                if doc is None:
+                    # 词法索引比集合旧 (块已被删除)，跳过
+                    continue
+                # 同一个块可能出现在多个查询的结果中，复制一份以免 rrf_score 相互覆盖
+                doc = Document(page_content=doc.page_content, metadata=dict(doc.metadata, rrf_score=score), id=chunk_id)
+                docs.append(doc)
+            results.append(docs)
+        return results
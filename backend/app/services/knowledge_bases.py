@@ -0,0 +1,50 @@
+# backend/app/services/knowledge_bases.py
+"""
+命名知识库 (集合) 的目录约定。
+
+默认集合 (settings.default_collection) 沿用原有目录: 文档在 knowledge_base，数据在 chroma_data。
+其他集合 (按岗位、按候选人等) 各自独立:
+    knowledge_bases/<name>/            源文档
+    chroma_data/collections/<name>/    ChromaDB、摄取清单、BM25/向量索引、快照...
+每个集合的数据目录互不共享，可以单独摄取、切换快照和从内存中淘汰。
+"""
+import os
+import re
+
+from ..core.config import settings
+
+DEFAULT_DATA_ROOT = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')), "chroma_data")
+COLLECTIONS_DIRNAME = "collections"
+# 与 ChromaDB 的集合命名规则一致: 3-63 个字符，字母或数字开头和结尾
+_COLLECTION_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{1,61}[A-Za-z0-9]$")
+
+
+class UnknownCollection(Exception):
+    """集合名不合法，或该集合尚未摄取 (没有数据目录)。"""
+
+
+def validate_collection_name(name: str) -> str:
+    if not name or not _COLLECTION_NAME_RE.match(name):
+        raise UnknownCollection(
+            f"Invalid collection name '{name}': use 3-63 letters, digits, '_' or '-', starting and ending with a letter or digit."
+        )
+    return name
+
+
+def collection_data_root(name: str, data_root: str = DEFAULT_DATA_ROOT) -> str:
+    if name == settings.default_collection:
+        return data_root
+    return os.path.join(data_root, COLLECTIONS_DIRNAME, validate_collection_name(name))
+
+
+def collection_knowledge_base_dir(name: str) -> str:
+    if name == settings.default_collection:
+        return settings.knowledge_base_dir
+    return os.path.join(settings.knowledge_bases_dir, validate_collection_name(name))
+
+
+def list_collections(data_root: str = DEFAULT_DATA_ROOT) -> list:
+    """默认集合和所有已摄取的命名集合。"""
+    root = os.path.join(data_root, COLLECTIONS_DIRNAME)
+    names = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))) if os.path.isdir(root) else []
+    return [settings.default_collection] + [name for name in names if name != settings.default_collection]
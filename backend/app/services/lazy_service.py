@@ -0,0 +1,110 @@
+# backend/app/services/lazy_service.py
+"""
+延迟构建的服务单例。
+
+RAGService / AudioService 会加载 Chroma、嵌入模型和 whisper，构建耗时数秒到数十秒。
+用 LazyService 包装后，导入模块不再触发加载: 服务在首次使用时构建，
+或由 FastAPI lifespan 在后台提前预热；加载状态供 /status/ready 报告。
+"""
+import time
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+NOT_LOADED = "not_loaded"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+DISABLED = "disabled"
+
+
+class ServiceUnavailable(Exception):
+    """服务被配置禁用或加载失败。"""
+
+
+class LazyService:
+    def __init__(self, name: str, factory, enabled: bool = True):
+        self.name = name
+        self._factory = factory
+        self.enabled = enabled
+        self._instance = None
+        self._lock = threading.Lock()
+        self.state = NOT_LOADED if enabled else DISABLED
+        self.error = None
+        self.load_seconds = None
+
+    @property
+    def instance(self):
+        """已构建的实例，尚未加载时返回 None (不会触发加载)。"""
+        return self._instance
+
+    def get(self):
+        """返回服务实例，首次调用时在当前线程中构建 (并发调用者等待同一次构建)。"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+        if not self.enabled:
+            raise ServiceUnavailable(f"Service '{self.name}' is disabled by configuration.")
+        with self._lock:
+            if self._instance is None:
+                self.state = LOADING
+                start = time.perf_counter()
+                try:
+                    self._instance = self._factory()
+                except Exception as e:
+                    # 保持可重试: 下一次 get() 会重新尝试构建
+                    self.state = FAILED
+                    self.error = str(e)
+                    logger.error(f"[LazyService] Failed to load '{self.name}': {e}", exc_info=True)
+                    raise ServiceUnavailable(f"Service '{self.name}' failed to load: {e}") from e
+                self.load_seconds = time.perf_counter() - start
+                self.state = READY
+                self.error = None
+                logger.info(f"[LazyService] '{self.name}' loaded in {self.load_seconds:.2f}s.")
+        return self._instance
+
+    def replace(self, instance):
+        """原子地替换为新构建的实例 (如切换到新的索引快照)，返回旧实例。"""
+        with self._lock:
+            previous, self._instance = self._instance, instance
+            self.state = READY
+            self.error = None
+        return previous
+
+    def reset(self, expected=None):
+        """
+        卸载实例 (下一次 get() 重新构建)，返回被卸载的实例。
+        指定 expected 时只有当前实例仍是它才卸载 (期间已被替换则什么也不做，返回 None)。
+        """
+        with self._lock:
+            previous = self._instance
+            if previous is None or (expected is not None and previous is not expected):
+                return None
+            self._instance = None
+            self.state = NOT_LOADED
+        return previous
+
+    async def aget(self):
+        """get() 的异步版本: 尚未加载时在线程中构建，不阻塞事件循环。"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+        return await asyncio.to_thread(self.get)
+
+    async def warm_up(self):
+        """后台预热。失败只记录日志，状态保留为 failed。"""
+        if not self.enabled:
+            return
+        try:
+            await self.aget()
+        except ServiceUnavailable:
+            pass
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+        }
@@ -0,0 +1,214 @@
+# backend/app/services/lexical_index.py
+"""
+基于 BM25 的紧凑磁盘倒排索引，由 ingest.py 在摄取后构建，与 ChromaDB 使用相同的块 ID。
+
+磁盘格式 (每次构建写入一个新的版本目录，CURRENT 文件指向当前版本):
+    vocab.npy        排好序的词项 (定长 bytes)，查询时用 np.searchsorted 二分查找
+    term_offsets.npy 每个词项在倒排表中的起止位置 (int64, 长度为词项数 + 1)
+    postings_doc.npy 倒排表: 文档序号 (int32)
+    postings_tf.npy  倒排表: 词频 (uint16)
+    doc_norm.npy     预先计算的 k1 * (1 - b + b * dl / avgdl) (float32)
+    chunk_ids.npy    文档序号 -> 块 ID (定长 bytes)
+    meta.json        文档数、平均长度、BM25 参数等
+
+所有数组都以 mmap 方式打开，加载只需读取文件头。
+"""
+import os
+import re
+import json
+import time
+import logging
+from array import array
+
+import numpy as np
+
+from .versioned_dir import write_current, cleanup_old_versions, current_version
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_DIRNAME = "lexical_index"
+FORMAT_VERSION = 1
+# 超过该字节数的词项 (通常是 URL、哈希等噪声) 不进入索引
+MAX_TERM_BYTES = 32
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_ASCII_TERM_RE = re.compile(r"[a-z0-9_]+(?:[.\-][a-z0-9_]+)*[+#]*")
+_CJK_RUN_RE = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def tokenize(text: str) -> list:
+    """
+    英文/代码按词切分并保留 c++、c#、node.js、gpt-4 这类技术词项 (同时输出其组成部分)；
+    中文按连续汉字的二元组切分 (单个汉字输出其本身)。
+    """
+    text = text.lower()
+    tokens = []
+    for match in _ASCII_TERM_RE.finditer(text):
+        term = match.group()
+        tokens.append(term)
+        if any(sep in term for sep in ".-+#"):
+            tokens.extend(part for part in re.split(r"[.\-+#]+", term) if part)
+    for match in _CJK_RUN_RE.finditer(text):
+        run = match.group()
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class LexicalIndexBuilder:
+    def __init__(self):
+        self._vocab = {}
+        self._term_ids = array("i")
+        self._doc_ids = array("i")
+        self._tfs = array("H")
+        self.chunk_ids = []
+        self.doc_lens = array("i")
+
+    def add(self, chunk_id: str, text: str):
+        doc_index = len(self.chunk_ids)
+        self.chunk_ids.append(chunk_id)
+        tokens = tokenize(text)
+        self.doc_lens.append(len(tokens))
+
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            if len(token.encode("utf-8")) > MAX_TERM_BYTES:
+                continue
+            term_id = self._vocab.setdefault(token, len(self._vocab))
+            self._term_ids.append(term_id)
+            self._doc_ids.append(doc_index)
+            self._tfs.append(min(tf, 65535))
+
+    def write(self, root_dir: str, index_version: str = "") -> str:
+        """写入一个新的版本目录并原子地切换 CURRENT 指针，返回版本目录路径。"""
+        version = f"{time.time():.6f}".replace(".", "")
+        version_dir = os.path.join(root_dir, version)
+        os.makedirs(version_dir, exist_ok=True)
+
+        sorted_terms = sorted(self._vocab)
+        remap = np.empty(len(sorted_terms), dtype=np.int32)
+        for final_id, term in enumerate(sorted_terms):
+            remap[self._vocab[term]] = final_id
+
+        term_ids = remap[np.frombuffer(self._term_ids, dtype=np.int32)] if self._term_ids else np.zeros(0, np.int32)
+        doc_ids = np.frombuffer(self._doc_ids, dtype=np.int32) if self._doc_ids else np.zeros(0, np.int32)
+        tfs = np.frombuffer(self._tfs, dtype=np.uint16) if self._tfs else np.zeros(0, np.uint16)
+        order = np.lexsort((doc_ids, term_ids))
+        offsets = np.zeros(len(sorted_terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(sorted_terms)), out=offsets[1:])
+
+        doc_lens = np.frombuffer(self.doc_lens, dtype=np.int32).astype(np.float32) if self.doc_lens else np.zeros(0, np.float32)
+        avg_doc_len = float(doc_lens.mean()) if len(doc_lens) else 0.0
+        doc_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens / max(avg_doc_len, 1e-6))
+
+        np.save(os.path.join(version_dir, "vocab.npy"),
+                np.array([t.encode("utf-8") for t in sorted_terms], dtype=f"S{MAX_TERM_BYTES}"))
+        np.save(os.path.join(version_dir, "term_offsets.npy"), offsets)
+        np.save(os.path.join(version_dir, "postings_doc.npy"), doc_ids[order])
+        np.save(os.path.join(version_dir, "postings_tf.npy"), tfs[order])
+        np.save(os.path.join(version_dir, "doc_norm.npy"), doc_norm.astype(np.float32))
+        max_id_len = max((len(c) for c in self.chunk_ids), default=1)
+        np.save(os.path.join(version_dir, "chunk_ids.npy"),
+                np.array([c.encode("utf-8") for c in self.chunk_ids], dtype=f"S{max_id_len}"))
+        with open(os.path.join(version_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "format_version": FORMAT_VERSION,
+                "num_docs": len(self.chunk_ids),
+                "num_terms": len(sorted_terms),
+                "num_postings": int(len(doc_ids)),
+                "avg_doc_len": avg_doc_len,
+                "k1": BM25_K1,
+                "b": BM25_B,
+                "index_version": index_version,
+            }, f)
+
+        write_current(root_dir, version)
+        cleanup_old_versions(root_dir, keep=version)
+        return version_dir
+
+
+def build_lexical_index(collection, root_dir: str, index_version: str = "", page_size: int = 5000):
+    """分页读取集合中的全部块并构建倒排索引，返回 (版本目录, 文档数)。"""
+    builder = LexicalIndexBuilder()
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for chunk_id, text in zip(page["ids"], page["documents"]):
+            builder.add(chunk_id, text or "")
+        offset += len(page["ids"])
+    return builder.write(root_dir, index_version), len(builder.chunk_ids)
+
+
+class LexicalIndex:
+    def __init__(self, version_dir: str, version: str):
+        self.version = version
+        self.version_dir = version_dir
+        self.vocab = self._load("vocab.npy")
+        self.term_offsets = self._load("term_offsets.npy")
+        self.postings_doc = self._load("postings_doc.npy")
+        self.postings_tf = self._load("postings_tf.npy")
+        self.doc_norm = self._load("doc_norm.npy")
+        self.chunk_ids = self._load("chunk_ids.npy")
+        with open(os.path.join(version_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.num_docs = self.meta["num_docs"]
+        self.k1 = self.meta["k1"]
+
+    def _load(self, name: str):
+        return np.load(os.path.join(self.version_dir, name), mmap_mode="r")
+
+    @classmethod
+    def open(cls, root_dir: str):
+        """打开 CURRENT 指向的索引版本，不存在时返回 None。"""
+        version = current_version(root_dir)
+        if not version:
+            return None
+        version_dir = os.path.join(root_dir, version)
+        try:
+            return cls(version_dir, version)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"[LexicalIndex] Failed to open lexical index at {version_dir}: {e}")
+            return None
+
+    def _term_id(self, term: str) -> int:
+        encoded = term.encode("utf-8")
+        if len(encoded) > MAX_TERM_BYTES or len(self.vocab) == 0:
+            return -1
+        position = int(np.searchsorted(self.vocab, encoded))
+        if position < len(self.vocab) and self.vocab[position] == encoded:
+            return position
+        return -1
+
+    def search(self, query: str, k: int) -> list:
+        """返回 BM25 得分最高的 k 个 (chunk_id, score)。"""
+        if self.num_docs == 0:
+            return []
+        scores = None
+        for term in set(tokenize(query)):
+            term_id = self._term_id(term)
+            if term_id < 0:
+                continue
+            start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log1p((self.num_docs - df + 0.5) / (df + 0.5))
+            if scores is None:
+                scores = np.zeros(self.num_docs, dtype=np.float32)
+            # 同一词项的倒排表中文档序号唯一，可以直接按下标累加
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.doc_norm[docs])
+
+        if scores is None:
+            return []
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.chunk_ids[i].decode("utf-8"), float(scores[i])) for i in candidates]
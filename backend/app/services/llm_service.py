@@ -1,12 +1,129 @@
+import asyncio
+import threading
+import logging
+from contextlib import asynccontextmanager
+
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.chat_models import ChatOllama
 from ..core.config import settings
 
-def get_llm(model_provider: str):
-    """Factory function to get a language model instance."""
+try:
+    # langchain-ollama 复用一个长连接的 httpx 客户端 (连接池 + keep-alive)
+    from langchain_ollama import ChatOllama
+    import httpx
+    _POOLED_OLLAMA = True
+except ImportError:
+    from langchain_community.chat_models import ChatOllama
+    _POOLED_OLLAMA = False
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = "gemini-1.5-flash"
+QWEN_MODEL = "qwen3:1.7b"
+SUPPORTED_PROVIDERS = ("gemini", "qwen")
+
+
+def _build_llm(model_provider: str):
     if model_provider == "gemini":
-        return ChatGoogleGenerativeAI(google_api_key=settings.google_api_key, model="gemini-1.5-flash")
+        return ChatGoogleGenerativeAI(google_api_key=settings.google_api_key, model=GEMINI_MODEL)
     elif model_provider == "qwen":
-        return ChatOllama(model="qwen3:1.7b", base_url=settings.ollama_base_url)
+        if _POOLED_OLLAMA:
+            limits = httpx.Limits(
+                max_connections=settings.ollama_max_concurrency,
+                max_keepalive_connections=settings.ollama_max_concurrency,
+            )
+            return ChatOllama(
+                model=QWEN_MODEL,
+                base_url=settings.ollama_base_url,
+                keep_alive=settings.ollama_keep_alive,
+                client_kwargs={"limits": limits},
+            )
+        return ChatOllama(model=QWEN_MODEL, base_url=settings.ollama_base_url, keep_alive=settings.ollama_keep_alive)
     else:
-        raise ValueError("Unsupported model provider.")
\ No newline at end of file
+        raise ValueError("Unsupported model provider.")
+
+
+class LLMRegistry:
+    """
+    Keeps one long-lived LLM client per provider (and therefore one HTTP connection pool),
+    plus a per-provider concurrency limit so a local Ollama is not flooded with requests.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.concurrency_limits = {
+            "gemini": settings.gemini_max_concurrency,
+            "qwen": settings.ollama_max_concurrency,
+        }
+
+    def get_llm(self, model_provider: str):
+        client = self._clients.get(model_provider)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(model_provider)
+                if client is None:
+                    client = _build_llm(model_provider)
+                    self._clients[model_provider] = client
+                    logger.info(f"[LLMRegistry] Created long-lived client for provider '{model_provider}'.")
+        return client
+
+    def register(self, model_provider: str, client, max_concurrency: int = None):
+        """Registers a pre-built client (e.g. a local stub for offline benchmarks) under a provider name."""
+        with self._lock:
+            self._clients[model_provider] = client
+            if max_concurrency is not None:
+                self.concurrency_limits[model_provider] = max_concurrency
+                self._semaphores.pop(model_provider, None)
+
+    @asynccontextmanager
+    async def limit(self, model_provider: str):
+        """Async context manager enforcing the per-provider concurrency limit."""
+        semaphore = self._semaphores.get(model_provider)
+        if semaphore is None:
+            semaphore = self._semaphores.setdefault(
+                model_provider, asyncio.Semaphore(self.concurrency_limits.get(model_provider, 4))
+            )
+        async with semaphore:
+            yield
+
+    async def warm_up(self, model_provider: str):
+        """
+        Builds the provider's client so the first real question does not pay for client setup.
+        A local Ollama also gets the model loaded; hosted APIs only receive a live request when LLM_WARMUP_PING is on.
+        """
+        try:
+            if model_provider == "qwen":
+                # 不带 prompt 的 generate 请求只会把模型加载进 Ollama 的内存，不产生输出
+                import ollama
+                await ollama.AsyncClient(host=settings.ollama_base_url).generate(
+                    model=QWEN_MODEL, keep_alive=settings.ollama_keep_alive
+                )
+            elif not settings.llm_warmup_ping:
+                # 付费 API 每次请求都计费，默认只创建客户端，不发送请求
+                self.get_llm(model_provider)
+                logger.info(f"[LLMRegistry] Built client for '{model_provider}' (live warm-up request disabled).")
+                return
+            else:
+                async with self.limit(model_provider):
+                    await self.get_llm(model_provider).ainvoke("ping")
+            logger.info(f"[LLMRegistry] Warm-up request for '{model_provider}' completed.")
+        except Exception as e:
+            logger.warning(f"[LLMRegistry] Warm-up for '{model_provider}' failed: {e}")
+
+    async def warm_up_all(self):
+        providers = [p.strip() for p in settings.llm_warmup_providers.split(",") if p.strip()]
+        for model_provider in providers:
+            if model_provider not in SUPPORTED_PROVIDERS:
+                logger.warning(f"[LLMRegistry] Skipping warm-up for unsupported provider '{model_provider}'.")
+                continue
+            self.get_llm(model_provider)
+        await asyncio.gather(*(self.warm_up(p) for p in providers if p in SUPPORTED_PROVIDERS))
+
+
+llm_registry = LLMRegistry()
+
+
+def get_llm(model_provider: str):
+    """Factory function to get a language model instance (cached per provider)."""
+    return llm_registry.get_llm(model_provider)
@@ -0,0 +1,271 @@
+# backend/app/services/prefetch.py
+"""
+基于实时转录的预取 (推测性检索)。
+
+桌面端在用户选中问题之前就把滚动的转录窗口发送到 /prefetch: 从窗口末尾取出最近的几句话作为候选问题，
+提前嵌入和检索，把取回的候选块保存在一个小的 TTL/LRU 缓存里。
+用户真正提问时，问题与某个候选相同 (归一化后) 或嵌入足够相似，就直接使用预取的检索结果
+(只需按提供者的 token 预算打包)，跳过查询嵌入和检索，LLM 立即开始生成。
+
+预取是尽力而为的后台工作，不能挤占真实请求:
+  - 每个会话按最小间隔限速，全局同时进行的预取数有上限 (超出时拒绝，客户端下一个窗口再试)；
+  - 同一会话的新窗口到达时取消该会话尚未完成的预取 (旧窗口的候选已经过时)，
+    每个阶段开始前检查是否已过时，已在线程中运行的阶段完成后丢弃结果；
+  - 知识库重新摄取后 (index_version 变化) 丢弃全部预取结果。
+"""
+import re
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..core.config import settings
+from ..core import metrics
+from ..ingestion.manifest import read_index_version
+from .single_flight import normalize_question
+from .lazy_service import ServiceUnavailable
+
+logger = logging.getLogger(__name__)
+
+# 句末标点 (中英文)、换行和段落分隔符 (QTextEdit 的选中文本使用 U+2029) 处切分；英文句点后须有空白，避免切开 node.js、3.5 这类词项
+_SENTENCE_SPLIT_RE = re.compile(r"[。！？!?；;\n\u2029]+|(?<=\.)\s+")
+_EDGE_PUNCTUATION = " \t。！？!?.,，;；:：、\"'“”‘’"
+
+
+def candidate_key(text: str) -> str:
+    """候选与真实问题的匹配键: 归一化空白和大小写，去掉首尾标点 (选中文本时常带或不带问号)。"""
+    return normalize_question(text).strip(_EDGE_PUNCTUATION)
+
+
+def extract_candidates(text: str, max_candidates: int, min_chars: int) -> list:
+    """从转录窗口末尾向前取出最近的若干句作为候选问题 (最新的在前，去重)。"""
+    candidates, seen = [], set()
+    for sentence in reversed(_SENTENCE_SPLIT_RE.split(text)):
+        sentence = sentence.strip(_EDGE_PUNCTUATION)
+        key = candidate_key(sentence)
+        if len(key) < min_chars or key in seen:
+            continue
+        seen.add(key)
+        candidates.append(sentence)
+        if len(candidates) >= max_candidates:
+            break
+    return candidates
+
+
+@dataclass
+class PrefetchedContext:
+    question: str
+    vector: np.ndarray
+    docs: list
+    created_at: float
+    hits: int = 0
+
+
+class _Session:
+    def __init__(self):
+        self.last_accepted = 0.0
+        self.last_seen = 0.0
+        self.generation = 0
+        self.task = None
+
+
+class ContextPrefetcher:
+    def __init__(
+        self,
+        service,
+        ttl_sec: float = settings.prefetch_ttl_sec,
+        max_entries: int = settings.prefetch_max_entries,
+        max_candidates: int = settings.prefetch_max_candidates,
+        min_chars: int = settings.prefetch_min_chars,
+        min_interval_sec: float = settings.prefetch_min_interval_sec,
+        max_concurrency: int = settings.prefetch_max_concurrency,
+        match_threshold: float = settings.prefetch_match_threshold,
+    ):
+        self.service = service
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        self.min_chars = min_chars
+        self.min_interval_sec = min_interval_sec
+        self.max_concurrency = max_concurrency
+        self.match_threshold = match_threshold
+        # 候选键 -> PrefetchedContext，LRU 顺序
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._index_version = read_index_version(service.chroma_data_path)
+        self._sessions = {}
+        # 已接受、尚未结束的预取任务数 (在 submit 中计入，任务结束时释放；
+        # 被取消的任务要等它已在线程中运行的阶段结束后才释放名额)
+        self._active = 0
+        self.counts = {"accepted": 0, "rate_limited": 0, "busy": 0, "cancelled": 0, "completed": 0, "hits": 0, "misses": 0}
+
+    def _count(self, result: str):
+        self.counts[result] += 1
+        metrics.PREFETCH_REQUESTS.inc(result=result)
+
+    # ---- 缓存 ----
+
+    def set_index_version(self, version: str):
+        """知识库重新摄取后丢弃全部预取结果 (由 RAGService 定时刷新索引时推送，请求路径上不读取文件)。"""
+        with self._lock:
+            if version != self._index_version:
+                self._entries.clear()
+                self._index_version = version
+
+    def _fresh(self, key: str, now: float):
+        entry = self._entries.get(key)
+        if entry is not None and now - entry.created_at > self.ttl_sec:
+            del self._entries[key]
+            entry = None
+        return entry
+
+    def lookup(self, question: str, question_vector=None):
+        """
+        返回与问题匹配的预取结果，未命中时返回 None。
+        先按候选键精确匹配 (无需向量)；提供了问题向量时再按余弦相似度匹配。
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._fresh(candidate_key(question), now)
+            if entry is None and question_vector is not None:
+                query = np.asarray(question_vector, dtype=np.float32)
+                query = query / (np.linalg.norm(query) or 1.0)
+                best, best_similarity = None, self.match_threshold
+                for key in list(self._entries):
+                    candidate = self._fresh(key, now)
+                    if candidate is None:
+                        continue
+                    similarity = float(candidate.vector @ query)
+                    if similarity >= best_similarity:
+                        best, best_similarity = key, similarity
+                entry = self._entries.get(best) if best is not None else None
+            if entry is None:
+                self.counts["misses"] += 1
+                metrics.PREFETCH_LOOKUPS.inc(result="miss")
+                return None
+            entry.hits += 1
+            self.counts["hits"] += 1
+        metrics.PREFETCH_LOOKUPS.inc(result="hit")
+        logger.info(f"[Prefetch] Using prefetched retrieval for question: '{question}' (candidate: '{entry.question}')")
+        return entry
+
+    def vector_for(self, question: str):
+        """精确匹配的候选已有嵌入时直接返回，省去一次查询嵌入。"""
+        with self._lock:
+            entry = self._fresh(candidate_key(question), time.time())
+        return entry.vector.tolist() if entry is not None else None
+
+    def _store(self, question: str, vector, docs: list, index_version: str):
+        with self._lock:
+            # 预取期间知识库发生了变化: 结果基于旧索引，丢弃
+            if index_version != self._index_version:
+                return
+            key = candidate_key(question)
+            self._entries[key] = PrefetchedContext(question, vector, docs, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # ---- 提交与执行 ----
+
+    def submit(self, session_id: str, text: str) -> dict:
+        """
+        接收一个转录窗口 (在事件循环中调用，立即返回)。
+        返回 {"accepted": bool, "reason", "candidates", "warm", "retry_after"}。
+        """
+        now = time.monotonic()
+        self._prune_sessions(now)
+        session = self._sessions.setdefault(session_id, _Session())
+        session.last_seen = now
+
+        wait = self.min_interval_sec - (now - session.last_accepted)
+        if wait > 0:
+            self._count("rate_limited")
+            return {"accepted": False, "reason": "rate_limited", "retry_after": round(wait, 3)}
+
+        candidates = extract_candidates(text, self.max_candidates, self.min_chars)
+        with self._lock:
+            wall_now = time.time()
+            pending = [c for c in candidates if self._fresh(candidate_key(c), wall_now) is None]
+        result = {"accepted": True, "reason": None, "candidates": len(candidates), "warm": len(candidates) - len(pending)}
+        if not pending:
+            session.last_accepted = now
+            return result
+
+        # 新窗口使该会话尚未完成的预取过时
+        if session.task is not None and not session.task.done():
+            session.task.cancel()
+            session.generation += 1
+            self._count("cancelled")
+        if self._active >= self.max_concurrency:
+            self._count("busy")
+            return {"accepted": False, "reason": "busy", "retry_after": self.min_interval_sec}
+
+        session.last_accepted = now
+        session.generation += 1
+        self._active += 1
+        session.task = asyncio.create_task(self._run(session, session.generation, pending))
+        # 用完成回调释放名额: 尚未开始运行就被取消的任务不会执行 _run 中的 finally
+        session.task.add_done_callback(self._release)
+        self._count("accepted")
+        return result
+
+    def _prune_sessions(self, now: float):
+        idle = [sid for sid, s in self._sessions.items() if now - s.last_seen > self.ttl_sec and (s.task is None or s.task.done())]
+        for sid in idle:
+            del self._sessions[sid]
+
+    async def _run(self, session: _Session, generation: int, questions: list):
+        def stale():
+            return session.generation != generation
+
+        try:
+            async with self.service.in_use():
+                index_version = self._index_version
+                vectors = await self._stage(stale, self._embed, questions)
+                if vectors is None:
+                    return
+                docs_per_question = await self._stage(stale, self.service._search_batch, questions, vectors.tolist())
+                if docs_per_question is None:
+                    return
+                for question, vector, docs in zip(questions, vectors, docs_per_question):
+                    self._store(question, vector, docs, index_version)
+                self._count("completed")
+        except (asyncio.CancelledError, ServiceUnavailable):
+            # 取消，或服务实例已被快照切换/集合淘汰替换 (预取结果随旧实例一起作废)
+            pass
+        except Exception as e:
+            logger.warning(f"[Prefetch] Prefetch failed: {e}", exc_info=True)
+
+    def _release(self, _task):
+        self._active -= 1
+
+    async def _stage(self, stale, func, *args):
+        """
+        在检索线程池中执行一个阶段；开始前已过时则跳过 (返回 None)。
+        任务被取消时线程中的阶段无法中断，等它结束后再传播取消，名额在此之前不释放。
+        """
+        def run():
+            return None if stale() else func(*args)
+
+        future = asyncio.ensure_future(self.service._run_blocking(run))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+    def _embed(self, questions: list) -> np.ndarray:
+        vectors = np.asarray(self.service.embedding_function.embed_documents(questions), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return dict(self.counts, entries=entries, sessions=len(self._sessions), active=self._active)
@@ -1,69 +1,173 @@
 # backend/app/services/rag_service.py
 import os
+import atexit
+import time
+import asyncio
+import threading
+import functools
+import contextvars
+import contextlib
 import chromadb
+from concurrent.futures import ThreadPoolExecutor
 from langchain.prompts import PromptTemplate
 from langchain.schema.runnable import RunnablePassthrough
 from langchain.schema.output_parser import StrOutputParser
 
-# 导入 LangChain 的 HuggingFace Embeddings
-from langchain_huggingface import HuggingFaceEmbeddings
-# 导入 LangChain 的 Chroma 向量存储
-from langchain_community.vectorstores import Chroma
-
 # 导入你的 LLM 服务和配置
-from .llm_service import get_llm
+from .llm_service import get_llm, llm_registry
+from .embedding_service import get_embedding_engine
+from .think_filter import ThinkTagFilter
+from .semantic_cache import SemanticCache
+from .lexical_index import LexicalIndex, LEXICAL_INDEX_DIRNAME
+from .vector_index import VectorIndex, VECTOR_INDEX_DIRNAME
+from .versioned_dir import current_version
+from .hybrid_retriever import HybridRetriever
+from .context_packer import pack_context, estimate_tokens
+from .lazy_service import LazyService, ServiceUnavailable
+from .knowledge_bases import DEFAULT_DATA_ROOT
+from .snapshots import current_snapshot, resolve_data_path, snapshot_path, list_snapshots, activate_snapshot
+from .single_flight import SingleFlight, normalize_question
+from .prefetch import ContextPrefetcher
+from ..ingestion.manifest import read_index_version
 from ..core.config import settings
+from ..core import metrics
 
 # 导入日志模块
 import logging
 logger = logging.getLogger(__name__)
-import torch # 导入torch以检查CUDA可用性
 
-# 确保集合名与 ingest.py 中一致
-COLLECTION_NAME = "interview_assistant"
+# 默认集合名 (ingest.py 未指定 --collection 时也使用它)
+COLLECTION_NAME = settings.default_collection
+SEMANTIC_CACHE_FILENAME = "semantic_cache.json"
+# 检索的文档数量
+RETRIEVAL_K = 3
+EMPTY_KNOWLEDGE_BASE_ANSWER = {"answer": "I could not find any relevant information in the knowledge base to answer your question. The knowledge base is currently empty.", "sources": "No sources found."}
+
+def open_persistent_client(path: str):
+    return chromadb.PersistentClient(path=path)
+
+
+def release_persistent_client(client, path: str):
+    """
+    释放 PersistentClient。chromadb 按路径共享 System (HNSW 段、SQLite 连接) 并自行维护引用计数，
+    client.close() 只在该路径上最后一个客户端关闭时停止 System。
+    旧版 chromadb 没有 close() (也没有引用计数)，此时不主动停止，交给进程退出回收。
+    """
+    close = getattr(client, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        logger.warning(f"[RAGService] Failed to release ChromaDB client for {path}: {e}")
+
 
 class RAGService:
-    def __init__(self):
+    def __init__(self, chroma_data_path: str = None, embedding_function=None, snapshot_version: str = None,
+                 collection_name: str = COLLECTION_NAME):
         # 定义 ChromaDB 数据存储的路径，数据将存储在项目根目录下的 'chroma_data' 文件夹中
-        chroma_data_path = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')), "chroma_data")
+        # (基准测试等场景可以传入独立的数据目录和嵌入函数)
+        # 数据目录下有 CURRENT 指针时打开其指向的快照，snapshot_version 可指定其他快照 (切换/回滚)
+        # 命名集合使用各自的数据目录 (见 knowledge_bases.collection_data_root)
+        self.collection_name = collection_name
+        self.data_root = chroma_data_path or DEFAULT_DATA_ROOT
+        self.snapshot_version = snapshot_version or current_snapshot(self.data_root)
+        if self.snapshot_version:
+            chroma_data_path = snapshot_path(self.data_root, self.snapshot_version)
+        else:
+            chroma_data_path = resolve_data_path(self.data_root)
         os.makedirs(chroma_data_path, exist_ok=True) # 确保目录存在
+        self.chroma_data_path = chroma_data_path
 
-        logger.info(f"RAGService connecting to ChromaDB (Persistent Client) at: {chroma_data_path}")
-        # 使用 PersistentClient 来创建一个持久化的 ChromaDB 实例
-        self.client = chromadb.PersistentClient(path=chroma_data_path)
+        # Chroma 客户端按需打开 (见 collection 属性): VECTOR_STORE=mmap 且向量索引可用时，
+        # 检索只读 mmap 索引，只有在线摄取写入、取回索引中没有的块时才需要启动持久化客户端
+        self.client = None
+        self._collection = None
+        self._chroma_lock = threading.Lock()
+        # 正在使用该实例的请求数 (见 in_use)。快照切换/淘汰后 close() 推迟到最后一个请求结束
+        self._users = 0
+        self._users_lock = threading.Lock()
+        self._retired = False
+        self._closed = False
+        # 估算的常驻内存 (见 estimate_memory_bytes)
+        self._memory_estimate = None
+        # 集合文档数，连接失败时为 None
+        self._collection_count = None
+        self.vector_index_dir = os.path.join(chroma_data_path, VECTOR_INDEX_DIRNAME)
+        vector_index = self._open_vector_index() if settings.vector_store == "mmap" else None
+        if vector_index is not None:
+            self._collection_count = vector_index.num_docs
+        elif self.collection is not None:
+            try:
+                self._collection_count = self.collection.count()
+                logger.info(f"ChromaDB collection '{collection_name}' document count: {self._collection_count}")
+            except Exception as e:
+                logger.error(f"Error counting ChromaDB collection '{collection_name}': {e}", exc_info=True)
+        if self._collection_count == 0:
+            logger.warning(f"ChromaDB collection '{collection_name}' is empty. Please run ingest.py to add documents.")
 
-        # 检查集合是否存在，如果不存在，创建一个 (这由get_or_create_collection处理)
-        try:
-            self.collection = self.client.get_or_create_collection(name=COLLECTION_NAME)
-            logger.info(f"ChromaDB collection '{COLLECTION_NAME}' document count: {self.collection.count()}")
-            if self.collection.count() == 0:
-                logger.warning(f"ChromaDB collection '{COLLECTION_NAME}' is empty. Please run ingest.py to add documents.")
-        except Exception as e:
-            logger.error(f"Error connecting to ChromaDB collection '{COLLECTION_NAME}': {e}", exc_info=True)
-            self.collection = None # 如果连接失败，将 collection 设为 None，以防后续操作报错
-
-        # 动态选择 HuggingFace Embeddings 的设备 (CPU 或 CUDA)
-        embedding_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        logger.info(f"Initializing HuggingFaceEmbeddings on device: {embedding_device}")
-        self.embedding_function = HuggingFaceEmbeddings( # 属性名修正为 embedding_function
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': embedding_device}, # 动态选择设备
-            encode_kwargs={'normalize_embeddings': True}
+        # 查询嵌入和向量检索是同步的 CPU 密集操作，放在专用的有界线程池中执行，避免阻塞事件循环
+        self._retrieval_executor = ThreadPoolExecutor(
+            max_workers=settings.retrieval_workers, thread_name_prefix="rag-retrieval"
         )
-        logger.info("[RAGService] LangChain's HuggingFaceEmbeddings initialized for RAGService.")
 
+        # 与 ingest.py 共用分桶嵌入引擎 (设备由 settings.embedding_device 决定，默认自动选择 CPU 或 CUDA)
+        self.embedding_function = embedding_function or get_embedding_engine(concurrent_callers=settings.retrieval_workers)
+        logger.info(f"[RAGService] Shared embedding engine initialized on device: {self.embedding_function.device}")
 
-        # 初始化 ChromaDB 作为向量存储
-        self.vector_store = Chroma(
-            client=self.client,
-            collection_name=COLLECTION_NAME,
-            embedding_function=self.embedding_function, # 确保这里使用正确的属性名
-            # persist_directory 必须与 client 的 path 一致，确保正确持久化
-            persist_directory=chroma_data_path
+        # 初始化检索器: 向量检索 + BM25 词法检索 (倒数排名融合)，检索前3个最相关的文档
+        self.lexical_index_dir = os.path.join(chroma_data_path, LEXICAL_INDEX_DIRNAME)
+        self.retriever = HybridRetriever(
+            collection=self._collection,
+            collection_loader=lambda: self.collection,
+            embedding_function=self.embedding_function,
+            lexical_index=LexicalIndex.open(self.lexical_index_dir),
+            vector_index=vector_index,
+            k=RETRIEVAL_K,
+            candidate_k=settings.hybrid_candidate_k,
+            rrf_k=settings.hybrid_rrf_k,
         )
+        if self.retriever.lexical_index is None:
+            logger.warning("[RAGService] Lexical (BM25) index not found, falling back to dense-only retrieval. Run ingest.py to build it.")
+        else:
+            logger.info(f"[RAGService] Lexical index loaded: {self.retriever.lexical_index.num_docs} chunks.")
+
+        # 每个提供者的上下文 token 预算
+        self.context_budgets = {
+            "gemini": settings.context_token_budget_gemini,
+            "qwen": settings.context_token_budget_qwen,
+        }
+
+        # 相同问题的在途请求合并 (single-flight)
+        self._inflight = SingleFlight("rag")
+
+        # 根据实时转录提前检索的候选问题 (/prefetch)
+        self.prefetcher = ContextPrefetcher(self) if settings.prefetch_enabled else None
+
+        # 每个提供者的 RAG 链只构建一次，复用长连接的 LLM 客户端
+        self._chains = {}
 
-        # 初始化检索器
-        self.retriever = self.vector_store.as_retriever(search_kwargs={"k": 3}) # 检索前3个最相关的文档
+        # 语义答案缓存: 近似重复的问题直接返回缓存的回答，不再检索和调用 LLM
+        self.answer_cache = None
+        if settings.semantic_cache_enabled:
+            persist_path = os.path.join(chroma_data_path, SEMANTIC_CACHE_FILENAME) if settings.semantic_cache_persist else None
+            self.answer_cache = SemanticCache(
+                threshold=settings.semantic_cache_threshold,
+                ttl_sec=settings.semantic_cache_ttl_sec,
+                max_entries=settings.semantic_cache_max_entries,
+                index_dir=chroma_data_path,
+                persist_path=persist_path,
+            )
+            if persist_path:
+                atexit.register(self.answer_cache.save)
+
+
+        # 集合文档数和词法索引由后台线程定时刷新，请求路径上只读取缓存值。
+        # 启动时 Chroma 不可用 (文档数未知) 也启动，之后重试连接
+        self._index_version = None
+        self.refresh_index_version()
+        self._stop_event = threading.Event()
+        threading.Thread(target=self._refresh_loop, name="rag-index-refresher", daemon=True).start()
 
         # 定义 RAG 提示模板
         self.prompt = PromptTemplate.from_template("""
@@ -77,60 +181,345 @@ class RAGService:
         问题: {question}
         回答:
         """)
+        # 模板本身的 token 数，用于估算每次请求的提示词大小
+        self._prompt_overhead_tokens = estimate_tokens(self.prompt.format(context="", question=""))
 
-    def _format_docs(self, docs):
-        """格式化检索到的文档，用于构建上下文和来源信息。"""
-        formatted_context = "\\n\\n".join(
-            f"Source: {doc.metadata.get('source', 'N/A')}, Page: {doc.metadata.get('page', 'N/A')}\\nContent: {doc.page_content}"
-            for doc in docs
-        )
+    @property
+    def collection(self):
+        """Chroma 集合，首次访问时才连接 (连接失败或实例已关闭时为 None，未关闭时下次访问重试)。"""
+        if self._collection is None and not self._closed:
+            with self._chroma_lock:
+                if self._collection is None and not self._closed:
+                    self._collection = self._open_collection()
+        return self._collection
 
-        unique_sources = set()
-        for doc in docs:
-            source_path = doc.metadata.get('source', 'Unknown')
-            page_number = doc.metadata.get('page', 'N/A')
-            unique_sources.add((source_path, page_number))
+    def _open_collection(self):
+        logger.info(f"RAGService connecting to ChromaDB (Persistent Client) at: {self.chroma_data_path}")
+        try:
+            # 使用 PersistentClient 来创建一个持久化的 ChromaDB 实例
+            if self.client is None:
+                self.client = open_persistent_client(self.chroma_data_path)
+            # 检查集合是否存在，如果不存在，创建一个 (这由get_or_create_collection处理)
+            return self.client.get_or_create_collection(name=self.collection_name)
+        except Exception as e:
+            logger.error(f"Error connecting to ChromaDB collection '{self.collection_name}': {e}", exc_info=True)
+            return None
 
-        sources = "\\n".join(
-            f"- {os.path.basename(src_path)}, Page: {pg_num}"
-            for src_path, pg_num in sorted(list(unique_sources))
-        )
-        return formatted_context, sources
+    def _open_vector_index(self):
+        """可选: 稠密检索改用 mmap float16 向量索引 (精确检索)，索引不存在时仍查询 Chroma。"""
+        started = time.perf_counter()
+        vector_index = VectorIndex.open(self.vector_index_dir)
+        if vector_index is None:
+            logger.warning("[RAGService] VECTOR_STORE=mmap but no vector index found, querying Chroma instead. Run ingest.py to build it.")
+        else:
+            logger.info(
+                f"[RAGService] Vector index opened in {(time.perf_counter() - started) * 1000:.1f} ms: "
+                f"{vector_index.num_docs} chunks x {vector_index.dimension} dims."
+            )
+        return vector_index
+
+    def _format_docs(self, docs, model_provider: str = None):
+        """
+        按提供者的 token 预算打包检索到的文档: 合并同一来源同一页的相邻块并去掉重叠部分。
+        返回 (formatted_context, sources, PackedContext)。
+        """
+        budget = self.context_budgets.get(model_provider, settings.context_token_budget_default)
+        packed = pack_context(docs, budget)
+        return packed.context, packed.sources, packed
 
     def get_rag_chain(self, model_provider: str):
-        """根据模型提供者获取 RAG 链。"""
-        llm = get_llm(model_provider)
+        """根据模型提供者获取 RAG 链 (每个提供者只构建一次)。"""
+        chain = self._chains.get(model_provider)
+        if chain is None:
+            llm = get_llm(model_provider)
 
-        rag_chain_core = (
-            self.prompt
-            | llm
-            | StrOutputParser()
-        )
-        return rag_chain_core
+            chain = (
+                self.prompt
+                | llm
+                | StrOutputParser()
+            )
+            self._chains[model_provider] = chain
+        return chain
 
-    async def invoke_chain(self, question: str, model_provider: str):
-        """异步调用 RAG 链进行问答。"""
-        if self.collection and self.collection.count() == 0:
+    def _refresh_loop(self):
+        # index_version 只是一个小文件，每 INDEX_VERSION_POLL_SEC 检查一次: 摄取提交一批后 (包括另一个进程中的
+        # ingest.py --in-place) 缓存立即失效；索引和文档数每 COLLECTION_COUNT_REFRESH_SEC 或版本变化时刷新
+        last_reload = time.monotonic()
+        while not self._stop_event.wait(settings.index_version_poll_sec):
+            changed = self.refresh_index_version()
+            if changed or time.monotonic() - last_reload >= settings.collection_count_refresh_sec:
+                self.reload_indexes()
+                last_reload = time.monotonic()
+
+    def refresh_index_version(self) -> bool:
+        """读取 index_version，变化时推送给语义缓存和预取缓存。返回是否变化。"""
+        index_version = read_index_version(self.chroma_data_path)
+        if index_version == self._index_version:
+            return False
+        self._index_version = index_version
+        if self.answer_cache is not None:
+            self.answer_cache.set_index_version(index_version)
+        if self.prefetcher is not None:
+            self.prefetcher.set_index_version(index_version)
+        return True
+
+    def reload_indexes(self):
+        """
+        重新打开有新版本的词法/向量索引，刷新集合文档数，并把当前 index_version 推送给语义缓存和预取缓存
+        (知识库监视器在线摄取后也会调用)。
+        """
+        self.reload_lexical_index()
+        if settings.vector_store == "mmap":
+            self.reload_vector_index()
+        self.refresh_collection_count()
+        self.refresh_index_version()
+
+    def reload_lexical_index(self):
+        """ingest.py 构建了新版本的词法索引时重新打开 (mmap 打开只需几毫秒)。"""
+        current = self.retriever.lexical_index
+        version = current_version(self.lexical_index_dir)
+        if version and (current is None or current.version != version):
+            lexical_index = LexicalIndex.open(self.lexical_index_dir)
+            if lexical_index is not None:
+                self.retriever.lexical_index = lexical_index
+                self._memory_estimate = None
+                logger.info(f"[RAGService] Reloaded lexical index version {version} ({lexical_index.num_docs} chunks).")
+
+    def reload_vector_index(self):
+        """ingest.py 导出了新版本的向量索引时重新打开。"""
+        current = self.retriever.vector_index
+        version = current_version(self.vector_index_dir)
+        if version and (current is None or current.version != version):
+            vector_index = VectorIndex.open(self.vector_index_dir)
+            if vector_index is not None:
+                self.retriever.vector_index = vector_index
+                self._memory_estimate = None
+                logger.info(f"[RAGService] Reloaded vector index version {version} ({vector_index.num_docs} chunks).")
+
+    @contextlib.contextmanager
+    def hold(self):
+        """
+        标记一个正在使用该实例的调用方。实例被替换后 close() 会等到所有调用方结束才真正释放资源；
+        已经释放的实例拒绝新的调用 (ServiceUnavailable，客户端重试时会拿到新实例)。
+        同步版本供后台线程 (知识库监视器) 使用，请求处理使用 in_use。
+        """
+        with self._users_lock:
+            if self._closed:
+                raise ServiceUnavailable(f"RAG service for snapshot '{self.snapshot_version}' has been retired; retry the request.")
+            self._users += 1
+        try:
+            yield self
+        finally:
+            with self._users_lock:
+                self._users -= 1
+                release = self._retired and self._users == 0 and not self._closed
+                if release:
+                    self._closed = True
+            if release:
+                self._release()
+
+    @contextlib.asynccontextmanager
+    async def in_use(self):
+        """hold 的异步版本，包裹一次请求。"""
+        with self.hold():
+            yield self
+
+    def close(self):
+        """
+        停止后台刷新，并在没有在途请求时释放线程池、Chroma 客户端和缓存的退出钩子
+        (快照切换或集合淘汰后由 close_later 在宽限期后调用；仍有请求时由最后一个请求释放)。
+        """
+        self._stop_event.set()
+        with self._users_lock:
+            self._retired = True
+            release = self._users == 0 and not self._closed
+            if release:
+                self._closed = True
+        if release:
+            self._release()
+        else:
+            logger.info(f"[RAGService] Deferring close of snapshot '{self.snapshot_version}' until in-flight requests finish.")
+
+    def _release(self):
+        self._retrieval_executor.shutdown(wait=False)
+        if self.answer_cache is not None and settings.semantic_cache_persist:
+            atexit.unregister(self.answer_cache.save)
+            self.answer_cache.save()
+        with self._chroma_lock:
+            client, self.client, self._collection = self.client, None, None
+            self.retriever.collection = None
+            self.retriever.collection_loader = None
+        if client is not None:
+            release_persistent_client(client, self.chroma_data_path)
+        logger.info(f"[RAGService] Closed '{self.collection_name}' snapshot '{self.snapshot_version}'.")
+
+    def estimate_memory_bytes(self) -> int:
+        """
+        估算该集合打开后的常驻内存: 数据目录中除 SQLite 元数据库以外的文件
+        (Chroma 的 HNSW 段在首次查询时整体载入内存，词法/向量索引以 mmap 方式常驻页缓存)。
+        每个实例对应一个快照，结果缓存在实例上，只在在线摄取重新打开索引后重新统计。
+        """
+        if self._memory_estimate is None:
+            self._memory_estimate = self._data_dir_bytes()
+        return self._memory_estimate
+
+    def _data_dir_bytes(self) -> int:
+        total = 0
+        for root, _dirs, files in os.walk(self.chroma_data_path):
+            for name in files:
+                if name.endswith((".sqlite3", ".json", ".tmp")):
+                    continue
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+        return total
+
+    @property
+    def collection_count(self):
+        """当前集合的块数 (尚未统计时为 None)。"""
+        return self._collection_count
+
+    def single_flight_stats(self) -> dict:
+        """相同问题合并执行的统计，供 /status 展示。"""
+        return self._inflight.stats()
+
+    def refresh_collection_count(self):
+        # 使用向量索引时以索引的行数为准，不必为此打开 Chroma
+        vector_index = self.retriever.vector_index
+        if vector_index is not None:
+            self._collection_count = vector_index.num_docs
+            return
+        collection = self.collection
+        if collection is None:
+            return
+        try:
+            self._collection_count = collection.count()
+        except Exception as e:
+            logger.warning(f"[RAGService] Failed to refresh collection count: {e}")
+
+    async def _run_blocking(self, func, *args):
+        """在检索线程池中执行同步函数并等待结果 (复制上下文变量，阶段指标能拿到 endpoint 标签)。"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._retrieval_executor, functools.partial(context.run, func, *args))
+
+    def _cache_lookup(self, question: str, model_provider: str):
+        """查询语义缓存。返回 (命中的回答字典或 None, 问题向量)，问题向量可复用于检索。"""
+        if self.answer_cache is None:
+            return None, None
+        question_vector = self._prefetched_vector(question)
+        if question_vector is None:
+            with metrics.time_stage("query_embedding", model_provider):
+                question_vector = self.embedding_function.embed_query(question)
+        entry, similarity = self.answer_cache.lookup(model_provider, question_vector)
+        metrics.CACHE_LOOKUPS.inc(model_provider=model_provider, result="hit" if entry is not None else "miss")
+        if entry is None:
+            return None, question_vector
+        logger.info(f"[RAGService] Semantic cache hit (similarity {similarity:.3f}) for question: '{question}' -> cached question: '{entry.question}'")
+        return {"answer": entry.answer, "sources": entry.sources}, question_vector
+
+    def _prefetched_vector(self, question: str):
+        return self.prefetcher.vector_for(question) if self.prefetcher is not None else None
+
+    def _cache_store(self, question: str, model_provider: str, question_vector, answer: str, sources: str):
+        if self.answer_cache is not None and question_vector is not None:
+            self.answer_cache.store(model_provider, question, question_vector, answer, sources)
+
+    def _retrieve_context(self, question: str, question_vector=None, model_provider: str = None):
+        """
+        检索并格式化上下文。返回 (formatted_context, sources_text, fallback)，
+        fallback 不为 None 时表示无法检索到上下文，应直接将其作为回答返回。
+        已有问题向量时直接按向量检索，避免重复嵌入。
+        """
+        if self._collection_count == 0:
             logger.warning("ChromaDB collection is empty, returning default 'no context' answer.")
-            return {"answer": "I could not find any relevant information in the knowledge base to answer your question. The knowledge base is currently empty.", "sources": "No sources found."}
+            return None, None, EMPTY_KNOWLEDGE_BASE_ANSWER
 
-        docs = self.retriever.invoke(question)
+        if question_vector is None:
+            question_vector = self._prefetched_vector(question)
+        if question_vector is None:
+            with metrics.time_stage("query_embedding", model_provider):
+                question_vector = self.embedding_function.embed_query(question)
+        # 转录窗口中已预取过同一 (或足够相似的) 问题时直接复用检索结果
+        prefetched = self.prefetcher.lookup(question, question_vector) if self.prefetcher is not None else None
+        if prefetched is not None:
+            return self._pack_docs(question, prefetched.docs, model_provider)
+        # 多取回一些候选块，预算有余时继续打包排名靠后的内容
+        with metrics.time_stage("vector_search", model_provider):
+            docs = self.retriever.search(question, question_vector, k=max(RETRIEVAL_K, settings.context_max_chunks))
+        return self._pack_docs(question, docs, model_provider)
+
+    def _retrieve_contexts(self, questions: list, question_vectors: list, model_provider: str = None):
+        """_retrieve_context 的批量版本: 所有问题的向量检索合并为一次集合查询。"""
+        if self._collection_count == 0:
+            logger.warning("ChromaDB collection is empty, returning default 'no context' answer.")
+            return [(None, None, EMPTY_KNOWLEDGE_BASE_ANSWER) for _ in questions]
+        with metrics.time_stage("vector_search", model_provider):
+            docs_per_question = self._search_batch(questions, question_vectors)
+        return [self._pack_docs(q, docs, model_provider) for q, docs in zip(questions, docs_per_question)]
 
+    def _search_batch(self, questions: list, question_vectors: list) -> list:
+        return self.retriever.search_batch(questions, question_vectors, k=max(RETRIEVAL_K, settings.context_max_chunks))
+
+    def _pack_docs(self, question: str, docs: list, model_provider: str = None):
         if not docs:
             logger.warning(f"No relevant documents found for question: '{question}'. Returning default answer.")
-            return {"answer": "I could not find any relevant information in the knowledge base to answer your question.", "sources": "No sources found."}
+            return None, None, {"answer": "I could not find any relevant information in the knowledge base to answer your question.", "sources": "No sources found."}
+
+        with metrics.time_stage("prompt_build", model_provider):
+            formatted_context, sources_text, packed = self._format_docs(docs, model_provider)
+        prompt_tokens = self._prompt_overhead_tokens + estimate_tokens(question) + packed.tokens
+        metrics.CONTEXT_TOKENS.observe(packed.tokens, model_provider=model_provider or "")
+        metrics.CONTEXT_TOKENS_SAVED.inc(packed.tokens_saved, model_provider=model_provider or "")
+        logger.info(
+            f"[RAGService] Packed {packed.chunks}/{len(docs)} chunks into {packed.segments} segments: "
+            f"~{packed.tokens} context tokens (~{prompt_tokens} prompt tokens), ~{packed.tokens_saved} tokens saved by dedup"
+        )
+        return formatted_context, sources_text, None
 
-        formatted_context, sources_text = self._format_docs(docs)
+    async def invoke_chain(self, question: str, model_provider: str):
+        """异步调用 RAG 链进行问答。相同问题的在途请求合并为一次检索和 LLM 调用。"""
+        async with self.in_use():
+            if not settings.single_flight_enabled:
+                return await self._invoke_chain(question, model_provider)
+            key = (normalize_question(question), model_provider)
+            result = await self._inflight.do(key, lambda: self._invoke_chain(question, model_provider))
+        # 每个调用者拿到独立的副本
+        return dict(result)
+
+    async def _invoke_chain(self, question: str, model_provider: str):
+        try:
+            cached, question_vector = await self._run_blocking(self._cache_lookup, question, model_provider)
+            if cached:
+                return cached
 
+            formatted_context, sources_text, fallback = await self._run_blocking(self._retrieve_context, question, question_vector, model_provider)
+        except Exception as e:
+            # 例如 Chroma 不可用 (文档数未知) 时检索抛出 RuntimeError，与 LLM 调用失败一样返回错误回答
+            logger.error(f"Error during retrieval: {e}", exc_info=True)
+            return {"answer": f"Error during answer generation: {str(e)}", "sources": "N/A"}
+        if fallback:
+            return fallback
+        return await self._generate(question, model_provider, formatted_context, sources_text, question_vector)
+
+    async def _generate(self, question: str, model_provider: str, formatted_context: str, sources_text: str, question_vector=None):
+        """在提供者的并发限制下调用 LLM 生成回答，并写入语义缓存。"""
         chain = self.get_rag_chain(model_provider)
 
         logger.info(f"[RAGService] Invoking chain for question: '{question}' with context length: {len(formatted_context)}...")
         try:
             # 使用 await chain.ainvoke() 因为 rag_service.invoke_chain 是异步的
-            raw_llm_result = await chain.ainvoke({
-                "question": question,
-                "context": formatted_context,
-            })
+            async with llm_registry.limit(model_provider):
+                metrics.LLM_IN_FLIGHT.inc(model_provider=model_provider)
+                try:
+                    with metrics.time_stage("llm_total", model_provider):
+                        raw_llm_result = await chain.ainvoke({
+                            "question": question,
+                            "context": formatted_context,
+                        })
+                finally:
+                    metrics.LLM_IN_FLIGHT.dec(model_provider=model_provider)
             logger.info(f"[RAGService] Raw LLM chain result type: {type(raw_llm_result)}, value (first 200 chars): {str(raw_llm_result)[:200]}")
 
             # 确保结果是字符串，并处理空字符串情况
@@ -141,11 +530,263 @@ class RAGService:
                 logger.warning("LLM chain returned an empty or whitespace string. Returning default answer.")
                 return {"answer": "I could not generate a meaningful answer based on the provided information.", "sources": "N/A"}
 
+            self._cache_store(question, model_provider, question_vector, raw_llm_result, sources_text)
             return {"answer": raw_llm_result, "sources": sources_text}
 
         except Exception as e:
             logger.error(f"Error during LLM chain invocation: {e}", exc_info=True) # 打印完整的异常信息
             return {"answer": f"Error during answer generation: {str(e)}", "sources": "N/A"}
 
-# 实例化服务
-rag_service = RAGService()
+    def _embed_and_lookup(self, questions: list, model_provider: str):
+        """一次批量嵌入全部问题并逐个查询语义缓存，返回 (向量列表, 缓存命中列表)。"""
+        with metrics.time_stage("query_embedding", model_provider):
+            vectors = self.embedding_function.embed_documents(questions)
+        cached = [None] * len(questions)
+        if self.answer_cache is not None:
+            for i, vector in enumerate(vectors):
+                entry, _similarity = self.answer_cache.lookup(model_provider, vector)
+                metrics.CACHE_LOOKUPS.inc(model_provider=model_provider, result="hit" if entry is not None else "miss")
+                if entry is not None:
+                    cached[i] = {"answer": entry.answer, "sources": entry.sources}
+        return vectors, cached
+
+    async def batch_chain(self, questions: list, model_provider: str, max_concurrency: int = None):
+        """
+        批量问答。所有问题一次批量嵌入、一次合并检索，LLM 生成以有界并发执行；
+        每个问题完成后立即产出 {"index", "question", "answer", "sources", "cached"}，顺序为完成顺序。
+        """
+        async with self.in_use():
+            async for item in self._batch_chain(questions, model_provider, max_concurrency):
+                yield item
+
+    async def _batch_chain(self, questions: list, model_provider: str, max_concurrency: int = None):
+        max_concurrency = max_concurrency or settings.batch_max_concurrency
+        vectors, cached = await self._run_blocking(self._embed_and_lookup, questions, model_provider)
+        pending = []
+        for i, question in enumerate(questions):
+            if cached[i] is not None:
+                yield dict(cached[i], index=i, question=question, cached=True)
+            else:
+                pending.append(i)
+        if not pending:
+            return
+
+        retrieved = await self._run_blocking(
+            self._retrieve_contexts, [questions[i] for i in pending], [vectors[i] for i in pending], model_provider
+        )
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def generate(i, formatted_context, sources_text):
+            async with semaphore:
+                result = await self._generate(questions[i], model_provider, formatted_context, sources_text, vectors[i])
+            return i, result
+
+        tasks = []
+        for i, (formatted_context, sources_text, fallback) in zip(pending, retrieved):
+            if fallback:
+                yield dict(fallback, index=i, question=questions[i], cached=False)
+            else:
+                tasks.append(asyncio.create_task(generate(i, formatted_context, sources_text)))
+        logger.info(f"[RAGService] Batch of {len(questions)} questions: {len(questions) - len(pending)} cached, {len(tasks)} generating (concurrency {max_concurrency}).")
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                i, result = await next_done
+                yield dict(result, index=i, question=questions[i], cached=False)
+        finally:
+            # 客户端断开时取消尚未完成的生成
+            for task in tasks:
+                task.cancel()
+
+    async def stream_chain(self, question: str, model_provider: str):
+        """
+        流式调用 RAG 链。依次产出事件字典:
+        {"event": "sources", "data": ...}，若干 {"event": "token", "data": ...}，
+        最后是 {"event": "done", "data": ""} 或 {"event": "error", "data": ...}。
+        <think> 块在服务端被去除。相同问题的在途流只生成一次，事件广播给所有客户端。
+        """
+        async with self.in_use():
+            if not settings.single_flight_enabled:
+                async for item in self._stream_chain(question, model_provider):
+                    yield item
+                return
+            key = (normalize_question(question), model_provider)
+            async for item in self._inflight.stream(key, lambda: self._stream_chain(question, model_provider)):
+                yield item
+
+    async def _stream_chain(self, question: str, model_provider: str):
+        try:
+            cached, question_vector = await self._run_blocking(self._cache_lookup, question, model_provider)
+            if cached:
+                # 缓存的回答是完整文本 (可能含 <think> 块)，同样经过过滤后一次性发送
+                think_filter = ThinkTagFilter()
+                yield {"event": "sources", "data": cached["sources"]}
+                yield {"event": "token", "data": think_filter.feed(cached["answer"]) + think_filter.flush()}
+                yield {"event": "done", "data": ""}
+                return
+
+            formatted_context, sources_text, fallback = await self._run_blocking(self._retrieve_context, question, question_vector, model_provider)
+            if fallback:
+                yield {"event": "sources", "data": fallback["sources"]}
+                yield {"event": "token", "data": fallback["answer"]}
+                yield {"event": "done", "data": ""}
+                return
+
+            yield {"event": "sources", "data": sources_text}
+
+            chain = self.get_rag_chain(model_provider)
+            think_filter = ThinkTagFilter()
+            answer_length = 0
+            raw_tokens = []
+
+            logger.info(f"[RAGService] Streaming chain for question: '{question}' with context length: {len(formatted_context)}...")
+            async with llm_registry.limit(model_provider):
+                metrics.LLM_IN_FLIGHT.inc(model_provider=model_provider)
+                llm_start = time.perf_counter()
+                try:
+                    async for token in chain.astream({
+                        "question": question,
+                        "context": formatted_context,
+                    }):
+                        if not raw_tokens:
+                            metrics.observe_stage("llm_ttft", time.perf_counter() - llm_start, model_provider)
+                        raw_tokens.append(token)
+                        visible = think_filter.feed(token)
+                        if visible:
+                            answer_length += len(visible)
+                            yield {"event": "token", "data": visible}
+                finally:
+                    metrics.LLM_IN_FLIGHT.dec(model_provider=model_provider)
+                metrics.observe_stage("llm_total", time.perf_counter() - llm_start, model_provider)
+
+            visible = think_filter.flush()
+            if visible:
+                answer_length += len(visible)
+                yield {"event": "token", "data": visible}
+
+            if answer_length == 0:
+                logger.warning("LLM stream produced no visible text. Returning default answer.")
+                yield {"event": "token", "data": "I could not generate a meaningful answer based on the provided information."}
+            else:
+                self._cache_store(question, model_provider, question_vector, "".join(raw_tokens), sources_text)
+            logger.info(f"[RAGService] Stream finished. Answer length: {answer_length}")
+            yield {"event": "done", "data": ""}
+
+        except Exception as e:
+            # 缓存查询和检索失败同样以 error 事件结束流
+            logger.error(f"Error during RAG chain streaming: {e}", exc_info=True)
+            yield {"event": "error", "data": f"Error during answer generation: {str(e)}"}
+
+# 延迟实例化服务: 首次使用或 lifespan 预热时才连接 Chroma 并加载嵌入模型
+rag_service_loader = LazyService("rag", RAGService)
+
+
+def close_later(service: RAGService, delay_sec: float):
+    """宽限期后关闭不再对外提供的服务实例 (在途请求继续完成，最后一个请求结束后才释放资源)。"""
+    timer = threading.Timer(delay_sec, service.close)
+    timer.daemon = True
+    timer.start()
+
+
+class SnapshotSwitcher:
+    """
+    蓝绿切换: 轮询各个已打开集合数据目录的 CURRENT 指针 (或由管理接口触发)，在后台线程中为目标快照
+    构建新的 RAGService (共享已加载的嵌入模型)，校验后原子地替换对应 LazyService 中的实例。
+    已经拿到旧实例的请求继续由旧快照处理，旧实例在宽限期后关闭。
+    """
+
+    def __init__(self, poll_sec: float = settings.snapshot_poll_sec, grace_sec: float = settings.snapshot_grace_sec):
+        self.poll_sec = poll_sec
+        self.grace_sec = grace_sec
+        # 集合名 -> (LazyService, 数据目录)；命名集合由 CollectionCache 首次打开时登记 (淘汰后实例为空，轮询时跳过)
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.last_switch = {}
+        self.last_error = {}
+
+    def watch(self, collection: str, loader: LazyService, data_root: str):
+        self._targets[collection] = (loader, data_root)
+
+    def _target(self, collection: str = None):
+        collection = collection or COLLECTION_NAME
+        target = self._targets.get(collection)
+        if target is None:
+            raise KeyError(f"Collection '{collection}' is not loaded.")
+        return collection, target[0], target[1]
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._loop, name="rag-snapshot-switcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread = None
+
+    def _loop(self):
+        while not self._stop_event.wait(self.poll_sec):
+            for collection, (loader, data_root) in list(self._targets.items()):
+                service = loader.instance
+                target = current_snapshot(data_root)
+                # 服务尚未加载时无需切换，首次加载会直接打开 CURRENT 指向的快照
+                if service is None or not target or target == service.snapshot_version:
+                    continue
+                try:
+                    self.switch(target, collection=collection)
+                except Exception as e:
+                    logger.error(f"[SnapshotSwitcher] Failed to switch '{collection}' to snapshot {target}: {e}", exc_info=True)
+
+    def switch(self, version: str, activate: bool = False, collection: str = None) -> dict:
+        """切换到指定快照。activate=True 时同时更新 CURRENT (管理接口回滚用)。"""
+        collection, loader, data_root = self._target(collection)
+        if version not in list_snapshots(data_root):
+            raise FileNotFoundError(f"Snapshot '{version}' does not exist under {data_root}")
+        with self._lock:
+            current = loader.get()
+            if version == current.snapshot_version:
+                if activate:
+                    activate_snapshot(data_root, version)
+                return self.status(collection)
+            started = time.perf_counter()
+            try:
+                service = RAGService(data_root, embedding_function=current.embedding_function,
+                                     snapshot_version=version, collection_name=current.collection_name)
+                if not service.collection_count:
+                    service.close()
+                    raise ValueError(f"Snapshot '{version}' has no documents; refusing to switch.")
+                if activate:
+                    activate_snapshot(data_root, version)
+            except Exception as e:
+                self.last_error[collection] = str(e)
+                raise
+            previous = loader.replace(service)
+            self.last_error.pop(collection, None)
+            last_switch = self.last_switch[collection] = {
+                "from": previous.snapshot_version if previous is not None else None,
+                "to": version,
+                "seconds": round(time.perf_counter() - started, 3),
+                "at": time.time(),
+            }
+            logger.info(f"[SnapshotSwitcher] Switched '{collection}' from snapshot {last_switch['from']} to {version} "
+                        f"in {last_switch['seconds']:.2f}s ({service.collection_count} chunks).")
+            if previous is not None:
+                close_later(previous, self.grace_sec)
+            return self.status(collection)
+
+    def status(self, collection: str = None) -> dict:
+        collection, loader, data_root = self._target(collection)
+        service = loader.instance
+        return {
+            "collection": collection,
+            "current": current_snapshot(data_root) or None,
+            "loaded": (service.snapshot_version or None) if service is not None else None,
+            "available": list_snapshots(data_root),
+            "last_switch": self.last_switch.get(collection),
+            "last_error": self.last_error.get(collection),
+        }
+
+
+snapshot_switcher = SnapshotSwitcher()
+snapshot_switcher.watch(COLLECTION_NAME, rag_service_loader, DEFAULT_DATA_ROOT)
@@ -0,0 +1,211 @@
+# backend/app/services/semantic_cache.py
+"""
+基于问题嵌入的语义答案缓存。
+
+每个 model_provider 各自维护一个分区: 新问题与分区内已缓存问题做余弦相似度比较，
+超过阈值即视为同一问题，直接返回缓存的回答和来源，不再调用 LLM。
+条目按 TTL 过期、按 LRU 淘汰；知识库重新摄取后 (index_version 变化) 整个缓存失效。
+index_version 由 RAGService 在定时刷新索引时推送 (set_index_version)，查询和写入路径上不读取文件。
+"""
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..ingestion.manifest import read_index_version
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 1
+# 持久化的最短间隔 (秒)
+SAVE_INTERVAL_SEC = 30.0
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    answer: str
+    sources: str
+    vector: np.ndarray
+    created_at: float
+    hits: int = 0
+
+
+class _Partition:
+    """单个 model_provider 的缓存分区。条目按 LRU 顺序存放在 OrderedDict 中。"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self._matrix = None
+        self._keys = []
+
+    def matrix(self):
+        # 条目变化时才重建矩阵，查询时只做一次矩阵-向量乘法
+        if self._matrix is None and self.entries:
+            self._keys = list(self.entries)
+            self._matrix = np.stack([self.entries[key].vector for key in self._keys])
+        return self._matrix, self._keys
+
+    def invalidate_matrix(self):
+        self._matrix = None
+
+
+class SemanticCache:
+    def __init__(self, threshold: float, ttl_sec: float, max_entries: int, index_dir: str, persist_path: str = None):
+        self.threshold = threshold
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.index_dir = index_dir
+        self.persist_path = persist_path
+        self._partitions = {}
+        self._lock = threading.Lock()
+        self._index_version = read_index_version(index_dir)
+        self._last_save = 0.0
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        if persist_path:
+            self._load()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def set_index_version(self, version: str):
+        """知识库被重新摄取后清空缓存，避免返回基于旧文档的回答。"""
+        with self._lock:
+            if version == self._index_version:
+                return
+            logger.info(f"[SemanticCache] Knowledge base changed ({self._index_version} -> {version}), invalidating cache.")
+            self._partitions.clear()
+            self._index_version = version
+            self._dirty = True
+
+    def _expire(self, partition: _Partition, now: float):
+        expired = [key for key, entry in partition.entries.items() if now - entry.created_at > self.ttl_sec]
+        for key in expired:
+            del partition.entries[key]
+        if expired:
+            partition.invalidate_matrix()
+            self._dirty = True
+
+    def lookup(self, model_provider: str, vector):
+        """返回相似度超过阈值的最近缓存条目及其相似度，未命中时返回 (None, 最高相似度)。"""
+        query = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            partition = self._partitions.get(model_provider)
+            if partition is not None:
+                self._expire(partition, now)
+            if partition is None or not partition.entries:
+                self.misses += 1
+                return None, 0.0
+
+            matrix, keys = partition.matrix()
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, similarity
+
+            key = keys[best]
+            entry = partition.entries[key]
+            partition.entries.move_to_end(key)
+            entry.hits += 1
+            self.hits += 1
+            return entry, similarity
+
+    def store(self, model_provider: str, question: str, vector, answer: str, sources: str):
+        entry = CacheEntry(question, answer, sources, self._normalize(vector), time.time())
+        with self._lock:
+            partition = self._partitions.setdefault(model_provider, _Partition())
+            partition.entries[question] = entry
+            partition.entries.move_to_end(question)
+            while len(partition.entries) > self.max_entries:
+                partition.entries.popitem(last=False)
+            partition.invalidate_matrix()
+            self._dirty = True
+        if self.persist_path and time.monotonic() - self._last_save >= SAVE_INTERVAL_SEC:
+            self.save()
+
+    def invalidate(self):
+        with self._lock:
+            self._partitions.clear()
+            self._index_version = read_index_version(self.index_dir)
+            self._dirty = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": {provider: len(p.entries) for provider, p in self._partitions.items()},
+                "hits": self.hits,
+                "misses": self.misses,
+                "index_version": self._index_version,
+            }
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "version": CACHE_FORMAT_VERSION,
+                "index_version": self._index_version,
+                "partitions": {
+                    provider: [
+                        {
+                            "question": e.question,
+                            "answer": e.answer,
+                            "sources": e.sources,
+                            "vector": e.vector.tolist(),
+                            "created_at": e.created_at,
+                            "hits": e.hits,
+                        }
+                        for e in partition.entries.values()
+                    ]
+                    for provider, partition in self._partitions.items()
+                },
+            }
+            self._dirty = False
+            self._last_save = time.monotonic()
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            logger.warning(f"[SemanticCache] Failed to persist cache to {self.persist_path}: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[SemanticCache] Ignoring unreadable cache file {self.persist_path}: {e}")
+            return
+        if data.get("version") != CACHE_FORMAT_VERSION or data.get("index_version") != self._index_version:
+            logger.info("[SemanticCache] Persisted cache is stale, starting empty.")
+            return
+
+        now = time.time()
+        for provider, items in data.get("partitions", {}).items():
+            partition = self._partitions.setdefault(provider, _Partition())
+            for item in items:
+                if now - item["created_at"] > self.ttl_sec:
+                    continue
+                partition.entries[item["question"]] = CacheEntry(
+                    item["question"], item["answer"], item["sources"],
+                    np.asarray(item["vector"], dtype=np.float32), item["created_at"], item.get("hits", 0),
+                )
+        logger.info(f"[SemanticCache] Loaded {sum(len(p.entries) for p in self._partitions.values())} cached answers.")
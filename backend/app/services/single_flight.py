@@ -0,0 +1,148 @@
+# backend/app/services/single_flight.py
+"""
+相同问题的在途请求合并 (single-flight)。
+
+多个客户端同时提出同一个问题 (或桌面端连续点击两次查询) 时，只有第一个请求 (leader)
+真正执行检索和 LLM 调用，其余请求等待同一个结果:
+  - do():     普通调用，所有调用者拿到同一个结果 (或同一个异常)
+  - stream(): 流式调用，leader 的事件流被广播给所有订阅者，后加入的订阅者先补发已产生的事件；
+              生成过程抛出的异常以 {"event": "error"} 事件广播
+两者都在最后一个等待者离开 (断开或取消) 时取消共享的任务。
+键为归一化后的问题 (去首尾空白、合并连续空白、忽略大小写) 加上 model_provider。
+"""
+import re
+import asyncio
+import logging
+
+from ..core import metrics
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    return _WHITESPACE_RE.sub(" ", question.strip()).casefold()
+
+
+class _Broadcast:
+    """一个在途流: 事件按顺序追加，订阅者各自维护读取位置。"""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task = None
+
+    async def publish(self, event):
+        async with self.changed:
+            self.events.append(event)
+            self.changed.notify_all()
+
+    async def finish(self):
+        async with self.changed:
+            self.done = True
+            self.changed.notify_all()
+
+
+class _Call:
+    """一个在途调用: 共享的任务和正在等待它的调用者数。"""
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _count(self, kind: str, coalesced: bool):
+        if coalesced:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+        metrics.SINGLE_FLIGHT.inc(group=self.name, kind=kind, result="coalesced" if coalesced else "leader")
+
+    async def do(self, key, factory):
+        """
+        执行 factory() 返回的协程；同一 key 已有在途调用时等待其结果。
+        某个调用者被取消时共享的任务继续运行 (其他调用者仍在等待)，最后一个调用者离开时才取消它。
+        """
+        call = self._calls.get(key)
+        coalesced = call is not None
+        if not coalesced:
+            call = self._calls[key] = _Call(asyncio.ensure_future(factory()))
+            call.task.add_done_callback(lambda _t: self._calls.pop(key, None) if self._calls.get(key) is call else None)
+        else:
+            logger.info(f"[SingleFlight:{self.name}] Coalescing duplicate in-flight call for key {key!r}.")
+        self._count("call", coalesced)
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    async def stream(self, key, factory):
+        """
+        订阅 factory() 返回的异步生成器的事件流；同一 key 已有在途流时从头补发并跟随其后续事件。
+        所有订阅者都断开后，尚未结束的生成会被取消。
+        """
+        broadcast = self._streams.get(key)
+        coalesced = broadcast is not None
+        if not coalesced:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(self._produce(key, broadcast, factory))
+        else:
+            logger.info(f"[SingleFlight:{self.name}] Fanning out in-flight stream for key {key!r}.")
+        self._count("stream", coalesced)
+
+        broadcast.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with broadcast.changed:
+                    while position >= len(broadcast.events) and not broadcast.done:
+                        await broadcast.changed.wait()
+                    pending = broadcast.events[position:]
+                    finished = broadcast.done
+                for event in pending:
+                    yield event
+                position += len(pending)
+                if finished and position >= len(broadcast.events):
+                    return
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                broadcast.task.cancel()
+
+    async def _produce(self, key, broadcast: _Broadcast, factory):
+        try:
+            async for event in factory():
+                await broadcast.publish(event)
+        except Exception as e:
+            # 异常不向订阅者抛出 (任务结果无人读取)，改为广播 error 事件，订阅者据此结束流
+            logger.error(f"[SingleFlight:{self.name}] Stream for key {key!r} failed: {e}", exc_info=True)
+            await broadcast.publish({"event": "error", "data": str(e)})
+        finally:
+            # 先移除再结束广播，之后到达的相同问题会发起新的调用 (结果已可能在语义缓存中)
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            await broadcast.finish()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,98 @@
+# backend/app/services/snapshots.py
+"""
+版本化的索引快照 (蓝绿切换)。
+
+目录布局:
+    chroma_data/
+        CURRENT                 当前生效的快照版本号 (原子替换)
+        snapshots/<version>/    完整的数据目录: ChromaDB、摄取清单、BM25/向量索引、去重索引...
+
+ingest.py 在新的快照目录中构建 (增量摄取时先复制当前快照)，校验通过后才切换 CURRENT；
+后端轮询 CURRENT (或通过管理接口) 在后台打开新快照，就绪后原子地替换 RAGService，
+构建期间查询始终由旧快照处理。旧快照按保留策略清理，保留的快照可以随时回滚。
+没有 CURRENT 文件时沿用旧布局 (数据直接位于 chroma_data 下)。
+"""
+import os
+import time
+import shutil
+import logging
+
+from .versioned_dir import write_current, current_version
+from .knowledge_bases import COLLECTIONS_DIRNAME
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_DIRNAME = "snapshots"
+
+
+def snapshots_dir(data_root: str) -> str:
+    return os.path.join(data_root, SNAPSHOTS_DIRNAME)
+
+
+def snapshot_path(data_root: str, version: str) -> str:
+    return os.path.join(snapshots_dir(data_root), version)
+
+
+def current_snapshot(data_root: str) -> str:
+    """当前生效的快照版本，旧布局或指向的目录不存在时返回空字符串。"""
+    version = current_version(data_root)
+    if version and os.path.isdir(snapshot_path(data_root, version)):
+        return version
+    return ""
+
+
+def resolve_data_path(data_root: str) -> str:
+    """实际的数据目录: 有生效快照时为快照目录，否则为 data_root 本身 (旧布局)。"""
+    version = current_snapshot(data_root)
+    return snapshot_path(data_root, version) if version else data_root
+
+
+def list_snapshots(data_root: str) -> list:
+    """按版本 (创建时间) 升序排列的快照版本号。"""
+    root = snapshots_dir(data_root)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def new_snapshot_version() -> str:
+    return time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+
+
+def create_snapshot(data_root: str, copy_from: str = None) -> tuple:
+    """创建新的快照目录 (可选地复制现有数据目录的内容)，返回 (版本号, 路径)。"""
+    version = new_snapshot_version()
+    path = snapshot_path(data_root, version)
+    if copy_from and os.path.isdir(copy_from):
+        # 从旧布局迁移时不要把 snapshots 目录本身 (以及默认数据目录下的命名集合) 也复制进去
+        shutil.copytree(copy_from, path, ignore=shutil.ignore_patterns(SNAPSHOTS_DIRNAME, COLLECTIONS_DIRNAME, "CURRENT", "*.tmp"))
+    else:
+        os.makedirs(path)
+    return version, path
+
+
+def activate_snapshot(data_root: str, version: str):
+    if not os.path.isdir(snapshot_path(data_root, version)):
+        raise FileNotFoundError(f"Snapshot '{version}' does not exist under {snapshots_dir(data_root)}")
+    write_current(data_root, version)
+
+
+def discard_snapshot(data_root: str, version: str):
+    shutil.rmtree(snapshot_path(data_root, version), ignore_errors=True)
+
+
+def apply_retention(data_root: str, keep: int, protect=()) -> list:
+    """
+    只保留最新的 keep 个快照 (当前快照和 protect 中的版本始终保留)，返回删除的版本。
+    后端可能仍打开着旧快照的文件 (Windows 上无法删除)，删除失败的目录留待下次清理。
+    """
+    protected = set(protect) | {current_snapshot(data_root)}
+    versions = list_snapshots(data_root)
+    removed = []
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version in protected:
+            continue
+        discard_snapshot(data_root, version)
+        if not os.path.exists(snapshot_path(data_root, version)):
+            removed.append(version)
+    return removed
@@ -0,0 +1,298 @@
+# backend/app/services/stream_stt.py
+"""
+WebSocket 流式音频的服务端增量转录。
+
+客户端持续发送 PCM (s16le / f32le，任意采样率) 或 Opus (WebM/Ogg 容器，经常驻 ffmpeg 进程解码) 音频，
+StreamingTranscriber 把音频累积为当前片段: 每新增 step 秒音频就对片段 (最长 window 秒) 做一次转录并推送 partial，
+检测到片段末尾的静音或片段达到 window 秒时转录完整片段并推送 final。
+所有转录都提交给 AudioService 的批处理调度器，多个连接共享同一组已加载的模型，并与上传接口共用排队上限。
+解码后的音频进入每个连接的有界收件箱；转录跟不上导致收件箱写满时解码器标记 overflowed，由连接关闭。
+"""
+import asyncio
+import logging
+import threading
+import subprocess
+
+import numpy as np
+
+from .audio_service import SAMPLE_RATE, TranscriptionQueueFull
+
+logger = logging.getLogger(__name__)
+
+PCM_FORMATS = {"pcm_s16le": np.int16, "pcm_f32le": np.float32}
+STREAM_FORMATS = tuple(PCM_FORMATS) + ("opus",)
+# ffmpeg 每次从 stdout 读取的字节数 (16 kHz s16le 下约 0.1 秒)
+_FFMPEG_READ_BYTES = 3200
+
+
+def resample_linear(audio: np.ndarray, source_rate: int, target_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """线性插值重采样。语音识别对此足够，且不引入额外依赖。"""
+    if source_rate == target_rate or len(audio) == 0:
+        return audio
+    duration = len(audio) / source_rate
+    target_len = int(round(duration * target_rate))
+    source_times = np.arange(len(audio)) / source_rate
+    target_times = np.arange(target_len) / target_rate
+    return np.interp(target_times, source_times, audio).astype(np.float32)
+
+
+class _StreamDecoder:
+    def __init__(self, output: asyncio.Queue):
+        self.output = output
+        self.overflowed = False
+
+    def deliver(self, item):
+        """
+        在事件循环中把解码后的音频 (或命令) 放入收件箱，不等待。
+        收件箱已满时丢弃并标记 overflowed；结束标记 None 必须送达，改为等待空位后放入。
+        """
+        try:
+            self.output.put_nowait(item)
+        except asyncio.QueueFull:
+            if item is None:
+                asyncio.get_running_loop().create_task(self.output.put(None))
+            else:
+                self.overflowed = True
+
+
+class PcmDecoder(_StreamDecoder):
+    """原始 PCM 帧 -> 16 kHz float32 单声道。跨帧的半个采样会保留到下一帧。"""
+
+    def __init__(self, output: asyncio.Queue, fmt: str = "pcm_s16le", sample_rate: int = SAMPLE_RATE, channels: int = 1):
+        super().__init__(output)
+        self.dtype = np.dtype(PCM_FORMATS[fmt])
+        self.sample_rate = sample_rate
+        self.channels = max(1, channels)
+        self._remainder = b""
+        self._closed = False
+
+    async def feed(self, data: bytes):
+        data = self._remainder + data
+        frame_bytes = self.dtype.itemsize * self.channels
+        usable = len(data) - len(data) % frame_bytes
+        self._remainder = data[usable:]
+        if not usable:
+            return
+        audio = np.frombuffer(data[:usable], dtype=self.dtype).astype(np.float32)
+        if self.dtype == np.int16:
+            audio /= 32768.0
+        if self.channels > 1:
+            audio = audio.reshape(-1, self.channels).mean(axis=1)
+        self.deliver(resample_linear(audio, self.sample_rate))
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            self.deliver(None)
+
+
+class FfmpegStreamDecoder(_StreamDecoder):
+    """
+    Opus (WebM/Ogg) 等压缩流: 整个连接期间保持一个 ffmpeg 进程，字节写入 stdin，
+    由读取线程把 stdout 中的 16 kHz s16le PCM 交回事件循环。
+    """
+
+    def __init__(self, output: asyncio.Queue):
+        super().__init__(output)
+        self._loop = asyncio.get_running_loop()
+        self._process = subprocess.Popen(
+            [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-i", "pipe:0",
+                "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._reader = threading.Thread(target=self._read_loop, name="ws-ffmpeg-reader", daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        remainder = b""
+        while True:
+            # read1 有多少返回多少，不等凑满缓冲区，保证解码后的音频及时送出
+            data = self._process.stdout.read1(_FFMPEG_READ_BYTES)
+            if not data:
+                break
+            data = remainder + data
+            usable = len(data) - len(data) % 2
+            remainder = data[usable:]
+            audio = np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+            self._loop.call_soon_threadsafe(self.deliver, audio)
+        self._loop.call_soon_threadsafe(self.deliver, None)
+
+    async def feed(self, data: bytes):
+        # 写管道可能短暂阻塞 (ffmpeg 尚未读取)，放到线程中执行
+        try:
+            await asyncio.to_thread(self._write, data)
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"ffmpeg decoder exited: {e}") from e
+
+    def _write(self, data: bytes):
+        self._process.stdin.write(data)
+        self._process.stdin.flush()
+
+    async def close(self):
+        """关闭 stdin，ffmpeg 输出剩余音频后退出，读取线程随后放入结束标记 None。可重复调用。"""
+        if self._process.stdin.closed and self._process.poll() is not None:
+            return
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        await asyncio.to_thread(self._reader.join, 5.0)
+        if self._process.poll() is None:
+            self._process.kill()
+
+
+def create_decoder(output: asyncio.Queue, fmt: str, sample_rate: int, channels: int):
+    if fmt == "opus":
+        return FfmpegStreamDecoder(output)
+    if fmt in PCM_FORMATS:
+        return PcmDecoder(output, fmt, sample_rate, channels)
+    raise ValueError(f"Unsupported audio format '{fmt}'. Supported: {', '.join(STREAM_FORMATS)}")
+
+
+class SegmentBuffer:
+    """
+    当前片段的音频: 预分配的 float32 数组，追加只复制新块 (O(块大小))，容量不足时按倍数扩展。
+    片段长度有上限 (window 秒)，容量按此预分配后通常不再扩展。
+    """
+
+    def __init__(self, capacity: int):
+        self._data = np.empty(max(1, capacity), dtype=np.float32)
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, audio: np.ndarray):
+        end = self._len + len(audio)
+        if end > len(self._data):
+            grown = np.empty(max(end, 2 * len(self._data)), dtype=np.float32)
+            grown[:self._len] = self._data[:self._len]
+            self._data = grown
+        self._data[self._len:end] = audio
+        self._len = end
+
+    def view(self) -> np.ndarray:
+        """片段音频的视图 (不复制)。下一次 append 或 clear 之后内容可能被覆盖，需要保留时调用方复制。"""
+        return self._data[:self._len]
+
+    def tail(self, samples: int) -> np.ndarray:
+        return self._data[max(0, self._len - samples):self._len]
+
+    def keep_tail(self, samples: int):
+        """只保留最后 samples 个采样 (移到缓冲区开头)。"""
+        tail = self.tail(samples)
+        self._data[:len(tail)] = tail
+        self._len = len(tail)
+
+    def clear(self):
+        self._len = 0
+
+
+class StreamingTranscriber:
+    """
+    单个连接的增量转录状态。send 为发送 JSON 消息的协程函数。
+    每个连接同时最多只有一个 partial 转录在进行，跟不上时跳过中间的 partial，只保证 final。
+    """
+
+    def __init__(self, audio_service, send, step_sec: float, window_sec: float, silence_sec: float, silence_rms: float):
+        self.audio_service = audio_service
+        self.send = send
+        self.step_samples = int(step_sec * SAMPLE_RATE)
+        self.window_samples = int(window_sec * SAMPLE_RATE)
+        self.silence_samples = int(silence_sec * SAMPLE_RATE)
+        self.silence_rms = silence_rms
+
+        self.segment_id = 0
+        self.finals = {}
+        # 片段最长 window 秒，多留一个 step 给最后一块音频
+        self._buffer = SegmentBuffer(self.window_samples + self.step_samples)
+        self._since_partial = 0
+        self._has_speech = False
+        self._partial_task = None
+
+    @staticmethod
+    def _rms(audio: np.ndarray) -> float:
+        return float(np.sqrt(np.mean(audio * audio))) if len(audio) else 0.0
+
+    async def _transcribe(self, audio: np.ndarray) -> str:
+        # 与上传接口共用排队上限，名额不足时抛出 TranscriptionQueueFull
+        return (await self.audio_service.transcribe_async(audio)).strip()
+
+    async def feed(self, audio: np.ndarray):
+        if not len(audio):
+            return
+        self._buffer.append(audio)
+        self._since_partial += len(audio)
+        if self._rms(audio) >= self.silence_rms:
+            self._has_speech = True
+
+        if not self._has_speech:
+            # 片段开始前的静音只保留最后一小段，避免缓冲无限增长
+            if len(self._buffer) > self.silence_samples * 2:
+                self._buffer.keep_tail(self.silence_samples)
+            self._since_partial = 0
+            return
+
+        samples = len(self._buffer)
+        ended_by_silence = samples > self.silence_samples and self._rms(self._buffer.tail(self.silence_samples)) < self.silence_rms
+        if ended_by_silence or samples >= self.window_samples:
+            await self.finalize()
+        elif self._since_partial >= self.step_samples and (self._partial_task is None or self._partial_task.done()):
+            self._since_partial = 0
+            self._partial_task = asyncio.create_task(self._send_partial(self.segment_id, self._buffer.view().copy()))
+
+    async def _send_partial(self, segment_id: int, audio: np.ndarray):
+        try:
+            text = await self._transcribe(audio)
+        except TranscriptionQueueFull:
+            # partial 只是预览，转录繁忙时直接跳过
+            return
+        except Exception as e:
+            logger.warning(f"[StreamingTranscriber] Partial transcription failed: {e}")
+            return
+        # 片段在转录期间已经结束时丢弃过期的 partial
+        if text and segment_id == self.segment_id:
+            await self.send({"type": "partial", "segment_id": segment_id, "text": text})
+
+    async def finalize(self):
+        """结束当前片段: 转录完整音频并推送 final，返回片段 ID (片段中没有语音时返回 None)。"""
+        if self._partial_task is not None and not self._partial_task.done():
+            self._partial_task.cancel()
+        has_speech = self._has_speech
+        # 缓冲区会被下一个片段复用，转录的音频需要复制
+        audio = self._buffer.view().copy() if has_speech else None
+        segment_id = self.segment_id
+        self.segment_id += 1
+        self._buffer.clear()
+        self._since_partial, self._has_speech = 0, False
+        if not has_speech:
+            return None
+
+        try:
+            text = await self._transcribe(audio)
+        except TranscriptionQueueFull as e:
+            logger.warning(f"[StreamingTranscriber] Dropping segment {segment_id}: {e}")
+            self.finals[segment_id] = ""
+            await self.send({"type": "error", "segment_id": segment_id, "data": str(e)})
+            return segment_id
+        self.finals[segment_id] = text
+        await self.send({"type": "final", "segment_id": segment_id, "text": text})
+        return segment_id
+
+    def pending_audio(self) -> bool:
+        return self._has_speech and len(self._buffer) > 0
+
+    def text_for(self, segment_ids=None) -> str:
+        """按片段 ID 取出转录文本；未指定时返回最近一个非空的 final 片段。"""
+        if segment_ids:
+            return " ".join(self.finals.get(i, "") for i in segment_ids).strip()
+        for segment_id in sorted(self.finals, reverse=True):
+            if self.finals[segment_id]:
+                return self.finals[segment_id]
+        return ""
@@ -0,0 +1,57 @@
+# backend/app/services/think_filter.py
+"""
+流式去除 <think>...</think> 推理块 (例如 qwen3 的输出)。
+
+标签可能被拆分在两个 token 中，因此在块末尾保留可能是标签前缀的字符，
+等下一个 token 到达后再判断。
+"""
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_suffix(text: str, tag: str) -> int:
+    """返回 text 末尾与 tag 前缀重合的最大长度 (不含完整的 tag)。"""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ThinkTagFilter:
+    def __init__(self):
+        self._buffer = ""
+        self._inside = False
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        """输入一个 token，返回可以立即输出的文本 (可能为空)。"""
+        self._buffer += text
+        output = []
+        while True:
+            tag = THINK_CLOSE if self._inside else THINK_OPEN
+            index = self._buffer.find(tag)
+            if index == -1:
+                keep = _partial_tag_suffix(self._buffer, tag)
+                if not self._inside:
+                    output.append(self._buffer[:len(self._buffer) - keep])
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+                break
+            if not self._inside:
+                output.append(self._buffer[:index])
+            self._buffer = self._buffer[index + len(tag):]
+            self._inside = not self._inside
+        return self._emit("".join(output))
+
+    def flush(self) -> str:
+        """流结束时调用，返回剩余的可见文本。未闭合的 <think> 块会被丢弃。"""
+        rest = "" if self._inside else self._buffer
+        self._buffer = ""
+        return self._emit(rest)
+
+    def _emit(self, text: str) -> str:
+        # 与非流式接口的 strip() 保持一致: 丢弃回答开头的空白 (通常是 </think> 之后的换行)
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
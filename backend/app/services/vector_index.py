@@ -0,0 +1,180 @@
+# backend/app/services/vector_index.py
+"""
+内存映射的 float16 向量索引，由 ingest.py 在摄取后从 ChromaDB 集合导出，与集合使用相同的块 ID。
+
+知识库规模通常可以整体放入内存，精确的暴力点积检索既比 HNSW 近似检索召回更高，
+打开时也只需读取文件头，不必启动 Chroma 的持久化客户端。
+
+磁盘格式 (与词法索引相同，见 versioned_dir: 每次构建写入一个新的版本目录，CURRENT 文件指向当前版本):
+    embeddings.npy      L2 归一化后的嵌入矩阵 (float16, 形状为 文档数 x 维度，行连续存储)
+    chunk_ids.npy       行号 -> 块 ID (定长 bytes)
+    payload.bin         每行的正文和元数据，UTF-8 编码的 JSON 数组 [text, metadata] 依次拼接
+    payload_offsets.npy 每行在 payload.bin 中的起止位置 (int64, 长度为文档数 + 1)
+    meta.json           文档数、维度、嵌入模型等
+
+所有文件都以 mmap 方式打开；检索时按块把 float16 转为 float32 再做矩阵乘法，
+每块只保留各查询的前 k 名，峰值内存约为 查询数 x (块大小 + k)，与文档数无关。
+"""
+import os
+import json
+import time
+import logging
+
+import numpy as np
+
+from .versioned_dir import write_current, cleanup_old_versions, current_version
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_DIRNAME = "vector_index"
+FORMAT_VERSION = 1
+# 每次转换为 float32 参与矩阵乘法的行数 (384 维时约 24 MB)
+SEARCH_BLOCK_ROWS = 16384
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndexBuilder:
+    def __init__(self):
+        self.chunk_ids = []
+        self._vectors = []
+        self._payload = []
+
+    def add_batch(self, chunk_ids: list, embeddings, documents: list, metadatas: list):
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        self._vectors.append(vectors.astype(np.float16))
+        self.chunk_ids.extend(chunk_ids)
+        for text, metadata in zip(documents, metadatas):
+            self._payload.append(json.dumps([text or "", metadata or {}], ensure_ascii=False).encode("utf-8"))
+
+    def write(self, root_dir: str, index_version: str = "", embedding_model: str = "") -> str:
+        """写入一个新的版本目录并原子地切换 CURRENT 指针，返回版本目录路径。"""
+        version = f"{time.time():.6f}".replace(".", "")
+        version_dir = os.path.join(root_dir, version)
+        os.makedirs(version_dir, exist_ok=True)
+
+        embeddings = np.concatenate(self._vectors) if self._vectors else np.zeros((0, 0), np.float16)
+        np.save(os.path.join(version_dir, "embeddings.npy"), np.ascontiguousarray(embeddings))
+        max_id_len = max((len(c) for c in self.chunk_ids), default=1)
+        np.save(os.path.join(version_dir, "chunk_ids.npy"),
+                np.array([c.encode("utf-8") for c in self.chunk_ids], dtype=f"S{max_id_len}"))
+
+        offsets = np.zeros(len(self._payload) + 1, dtype=np.int64)
+        np.cumsum([len(record) for record in self._payload], out=offsets[1:])
+        with open(os.path.join(version_dir, "payload.bin"), "wb") as f:
+            for record in self._payload:
+                f.write(record)
+        np.save(os.path.join(version_dir, "payload_offsets.npy"), offsets)
+
+        with open(os.path.join(version_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "format_version": FORMAT_VERSION,
+                "num_docs": len(self.chunk_ids),
+                "dimension": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+                "embedding_model": embedding_model,
+                "index_version": index_version,
+            }, f)
+
+        write_current(root_dir, version)
+        cleanup_old_versions(root_dir, keep=version)
+        return version_dir
+
+
+def build_vector_index(collection, root_dir: str, index_version: str = "", embedding_model: str = "", page_size: int = 5000):
+    """分页读取集合中的全部块 (含嵌入) 并写入向量索引，返回 (版本目录, 文档数)。"""
+    builder = VectorIndexBuilder()
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not len(page["ids"]):
+            break
+        builder.add_batch(page["ids"], page["embeddings"], page["documents"], page["metadatas"])
+        offset += len(page["ids"])
+    return builder.write(root_dir, index_version, embedding_model), len(builder.chunk_ids)
+
+
+class VectorIndex:
+    def __init__(self, version_dir: str, version: str):
+        self.version = version
+        self.version_dir = version_dir
+        self.embeddings = self._load("embeddings.npy")
+        self.chunk_ids = self._load("chunk_ids.npy")
+        self.payload_offsets = self._load("payload_offsets.npy")
+        self.payload = np.memmap(os.path.join(version_dir, "payload.bin"), dtype=np.uint8, mode="r") \
+            if self.payload_offsets[-1] else np.zeros(0, np.uint8)
+        with open(os.path.join(version_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.num_docs = self.meta["num_docs"]
+        self.dimension = self.meta["dimension"]
+        # 块 ID -> 行号，仅在按 ID 取回时才构建
+        self._rows = None
+
+    def _load(self, name: str):
+        return np.load(os.path.join(self.version_dir, name), mmap_mode="r")
+
+    @classmethod
+    def open(cls, root_dir: str):
+        """打开 CURRENT 指向的索引版本，不存在时返回 None。"""
+        version = current_version(root_dir)
+        if not version:
+            return None
+        version_dir = os.path.join(root_dir, version)
+        try:
+            return cls(version_dir, version)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"[VectorIndex] Failed to open vector index at {version_dir}: {e}")
+            return None
+
+    def search_batch(self, query_vectors: list, k: int) -> list:
+        """按余弦相似度精确检索，返回每个查询得分最高的 k 个 [(行号, score), ...]。"""
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32).reshape(len(query_vectors), -1))
+        if self.num_docs == 0 or len(queries) == 0:
+            return [[] for _ in range(len(queries))]
+        if queries.shape[1] != self.dimension:
+            raise ValueError(
+                f"Query dimension {queries.shape[1]} does not match vector index dimension {self.dimension}. "
+                "Re-run ingest.py after changing the embedding model."
+            )
+
+        # 每个块只保留各查询当前的前 k 名，与下一块的得分拼接后再取前 k，避免分配 查询数 x 文档数 的得分矩阵
+        k = min(k, self.num_docs)
+        top_rows = np.empty((len(queries), 0), dtype=np.int64)
+        top_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.num_docs, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.embeddings[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            candidate_scores = np.concatenate([top_scores, queries @ block.T], axis=1)
+            candidate_rows = np.concatenate(
+                [top_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1
+            )
+            if candidate_scores.shape[1] > k:
+                keep = np.argpartition(candidate_scores, -k, axis=1)[:, -k:]
+                candidate_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+                candidate_rows = np.take_along_axis(candidate_rows, keep, axis=1)
+            top_scores, top_rows = candidate_scores, candidate_rows
+
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        top_rows = np.take_along_axis(top_rows, order, axis=1)
+        return [
+            [(int(row), float(score)) for row, score in zip(rows, row_scores)]
+            for rows, row_scores in zip(top_rows, top_scores)
+        ]
+
+    def chunk_id(self, row: int) -> str:
+        return self.chunk_ids[row].decode("utf-8")
+
+    def record(self, row: int):
+        """返回该行的 (正文, 元数据)。"""
+        start, end = int(self.payload_offsets[row]), int(self.payload_offsets[row + 1])
+        text, metadata = json.loads(bytes(self.payload[start:end]).decode("utf-8"))
+        return text, metadata
+
+    def rows_for(self, chunk_ids) -> dict:
+        """块 ID -> 行号 (索引中不存在的块 ID 不出现在结果中)。"""
+        if self._rows is None:
+            self._rows = {chunk_id.decode("utf-8"): row for row, chunk_id in enumerate(self.chunk_ids)}
+        return {chunk_id: self._rows[chunk_id] for chunk_id in chunk_ids if chunk_id in self._rows}
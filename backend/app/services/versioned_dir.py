@@ -0,0 +1,32 @@
+# backend/app/services/versioned_dir.py
+"""
+版本化目录: 每次构建写入一个新的版本子目录，CURRENT 文件 (原子替换) 指向当前生效的版本。
+词法索引、向量索引和索引快照共用这一布局。
+"""
+import os
+import shutil
+
+CURRENT_FILENAME = "CURRENT"
+
+
+def write_current(root_dir: str, version: str):
+    path = os.path.join(root_dir, CURRENT_FILENAME)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{path}.tmp", path)
+
+
+def cleanup_old_versions(root_dir: str, keep: str):
+    """删除旧版本目录。后端可能仍以 mmap 打开旧文件 (Windows 上无法删除)，失败时留待下次清理。"""
+    for name in os.listdir(root_dir):
+        path = os.path.join(root_dir, name)
+        if name != keep and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def current_version(root_dir: str) -> str:
+    try:
+        with open(os.path.join(root_dir, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
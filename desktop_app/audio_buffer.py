@@ -0,0 +1,58 @@
+# desktop_app/audio_buffer.py
+import numpy as np
+
+class AudioRingBuffer:
+    """
+    预分配的 float32 环形缓冲区 (镜像布局)。
+    底层数组长度为 2 * capacity 帧，每帧同时写入位置 i 和 i + capacity，
+    因此任意不超过 capacity 帧的连续窗口都是底层数组的一个切片 (零拷贝视图)。
+    长度由写入和读取的帧计数相减得到，O(1)；写满时丢弃最旧的音频。
+    只在 STT 线程中使用，不加锁。
+    """
+
+    def __init__(self, capacity: int, channels: int = 1):
+        self.capacity = capacity
+        self.channels = channels
+        self._data = np.zeros((2 * capacity, channels), dtype=np.float32)
+        self._read = 0 # 已消费的总帧数
+        self._write = 0 # 已写入的总帧数
+        self.dropped = 0
+
+    def __len__(self):
+        return self._write - self._read
+
+    def write(self, chunk: np.ndarray):
+        # sounddevice 回调给出的是 (帧数, 通道数) 的 float32 数组，赋值时直接写入 (无需 astype)
+        chunk = chunk.reshape(-1, self.channels)
+        frames = len(chunk)
+        if frames > self.capacity:
+            self.dropped += frames - self.capacity
+            chunk = chunk[-self.capacity:]
+            frames = self.capacity
+        overflow = len(self) + frames - self.capacity
+        if overflow > 0:
+            self._read += overflow
+            self.dropped += overflow
+
+        start = self._write % self.capacity
+        first = min(frames, self.capacity - start)
+        rest = frames - first
+        # 主区域 [0, capacity) 和镜像区域 [capacity, 2 * capacity) 各写一份，主区域在末尾折返
+        self._data[start:start + first] = chunk[:first]
+        self._data[start + self.capacity:start + self.capacity + first] = chunk[:first]
+        if rest:
+            self._data[:rest] = chunk[first:]
+            self._data[self.capacity:self.capacity + rest] = chunk[first:]
+        self._write += frames
+
+    def view(self, frames: int = None) -> np.ndarray:
+        """最旧的 frames 帧 (默认全部) 的视图 (不复制)。下一次 write 之前有效，调用方不应修改。"""
+        frames = len(self) if frames is None else min(frames, len(self))
+        start = self._read % self.capacity
+        return self._data[start:start + frames]
+
+    def consume(self, frames: int):
+        self._read += min(frames, len(self))
+
+    def clear(self):
+        self._read = self._write
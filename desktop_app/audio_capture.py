@@ -100,9 +100,11 @@ class AudioCaptureWorker(QThread):
                 break
         self.wait() # 等待线程结束
 
-    def get_audio_chunk(self):
-        """从队列中获取音频数据块"""
+    def get_audio_chunk(self, timeout=None):
+        """从队列中获取音频数据块。timeout 为 None 时不等待；否则最多阻塞 timeout 秒，超时返回 None"""
         try:
-            return self.q.get_nowait()
+            if timeout is None:
+                return self.q.get_nowait()
+            return self.q.get(timeout=timeout)
         except queue.Empty:
             return None
@@ -1 +1,6 @@
-BACKEND_URL = "http://localhost:8000/api/v1"
\ No newline at end of file
+BACKEND_URL = "http://localhost:8000/api/v1"
+
+# 把实时转录的滚动窗口发送到后端 /prefetch，提问前提前完成检索
+PREFETCH_ENABLED = True
+PREFETCH_WINDOW_CHARS = 400 # 每次发送转录末尾的字符数
+PREFETCH_INTERVAL_SEC = 1.0 # 两次发送之间的最短间隔 (与后端 PREFETCH_MIN_INTERVAL_SEC 一致)
@@ -16,8 +16,8 @@ from PyQt6.QtGui import QColor, QTextCharFormat, QSyntaxHighlighter, QTextDocume
 
 from .audio_capture import AudioCaptureWorker
 from .stt_processor import STTProcessorWorker
-from .rag_client import RAGClientWorker
-from .config_desktop import BACKEND_URL
+from .rag_client import RAGClientWorker, PrefetchClientWorker
+from .config_desktop import BACKEND_URL, PREFETCH_ENABLED, PREFETCH_WINDOW_CHARS
 
 class CustomTextHighlighter(QSyntaxHighlighter):
     def __init__(self, parent: QTextDocument):
@@ -121,6 +121,7 @@ class InterviewAssistantGUI(QMainWindow):
             compute_type=self.compute_type
         )
         self.rag_client_worker = RAGClientWorker()
+        self.prefetch_client_worker = PrefetchClientWorker()
 
     def connect_signals(self):
         self.audio_capture_worker.audio_data_available.connect(self.on_audio_data_available)
@@ -226,6 +227,9 @@ class InterviewAssistantGUI(QMainWindow):
         self.current_stt_text += text + " "
         self.transcript_text_edit.setText(self.current_stt_text.strip())
         self.transcript_text_edit.verticalScrollBar().setValue(self.transcript_text_edit.verticalScrollBar().maximum())
+        if PREFETCH_ENABLED:
+            # 在用户选中问题之前，让后端针对最近的几句话提前检索
+            self.prefetch_client_worker.submit(self.current_stt_text[-PREFETCH_WINDOW_CHARS:])
 
     def on_llm_provider_changed(self, index):
         self.model_provider = self.llm_provider_combo.currentText()
@@ -268,6 +272,7 @@ class InterviewAssistantGUI(QMainWindow):
         print("Closing application. Stopping workers...")
         self.stop_audio_capture()
         self.rag_client_worker.stop()
+        self.prefetch_client_worker.stop()
         self.backend_check_timer.stop()
         super().closeEvent(event)
 
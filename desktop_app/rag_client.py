@@ -1,7 +1,9 @@
 # desktop_app/rag_client.py
+import uuid
+import threading
 import requests
 from PyQt6.QtCore import QThread, pyqtSignal
-from .config_desktop import BACKEND_URL
+from .config_desktop import BACKEND_URL, PREFETCH_INTERVAL_SEC
 
 class RAGClientWorker(QThread):
     # 信号用于向主线程发送RAG结果
@@ -41,4 +43,58 @@ class RAGClientWorker(QThread):
         self._running = False
         if self.isRunning():
             self.quit()
-            self.wait()
\ No newline at end of file
+            self.wait()
+
+class PrefetchClientWorker(QThread):
+    """
+    把实时转录的滚动窗口发送到后端 /prefetch，让后端在用户提问前完成检索。
+    尽力而为: 只发送最新的窗口 (发送期间到达的新窗口覆盖尚未发送的旧窗口)，
+    两次发送至少间隔 interval_sec，后端返回 429 时按 Retry-After 推迟，网络错误静默忽略。
+    """
+
+    def __init__(self, interval_sec: float = PREFETCH_INTERVAL_SEC):
+        super().__init__()
+        self.session_id = uuid.uuid4().hex
+        self.interval_sec = interval_sec
+        self._pending = None
+        self._running = True
+        self._condition = threading.Condition()
+        # 复用连接，预取请求频繁
+        self._http = requests.Session()
+
+    def submit(self, text: str):
+        """非阻塞地提交最新的转录窗口"""
+        with self._condition:
+            self._pending = text
+            self._condition.notify()
+        if not self.isRunning():
+            self._running = True
+            self.start()
+
+    def run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or not self._running)
+                if not self._running:
+                    return
+                text, self._pending = self._pending, None
+
+            delay = self.interval_sec
+            try:
+                response = self._http.post(
+                    f"{BACKEND_URL}/prefetch", json={"text": text, "session_id": self.session_id}, timeout=2
+                )
+                if response.status_code == 429:
+                    delay = max(delay, float(response.headers.get("Retry-After", delay)))
+            except (requests.exceptions.RequestException, ValueError):
+                pass
+
+            with self._condition:
+                self._condition.wait_for(lambda: not self._running, timeout=delay)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self.isRunning():
+            self.wait()
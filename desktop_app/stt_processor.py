@@ -2,11 +2,11 @@
 from faster_whisper import WhisperModel
 import numpy as np
 from PyQt6.QtCore import QThread, pyqtSignal
-import time
-import collections
 import resampy
 import traceback
 
+from .audio_buffer import AudioRingBuffer
+
 class STTProcessorWorker(QThread):
     text_recognized = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
@@ -18,10 +18,25 @@ class STTProcessorWorker(QThread):
         self.device = device
         self.compute_type = compute_type
         self._running = True
-        self.audio_buffer = collections.deque()
-        
+        self.audio_buffer = None
+
         self.target_stt_samplerate = 16000
         self.buffer_duration_sec = 2
+        # 转录较慢时积压的音频上限 (与 whisper 的 30 秒窗口一致)，超出时丢弃最旧的音频
+        self.max_buffer_sec = 30
+        # 阻塞等待音频的超时，只用于及时响应 stop()
+        self.queue_timeout_sec = 0.1
+
+    def _wait_for_audio(self) -> bool:
+        """阻塞等待至少一个音频块，随后把队列中已有的块全部写入环形缓冲区。超时返回 False。"""
+        audio_chunk = self.audio_capture_worker_instance.get_audio_chunk(timeout=self.queue_timeout_sec)
+        if audio_chunk is None:
+            return False
+        while audio_chunk is not None:
+            if audio_chunk.size > 0:
+                self.audio_buffer.write(audio_chunk)
+            audio_chunk = self.audio_capture_worker_instance.get_audio_chunk()
+        return True
 
     def run(self):
         try:
@@ -31,70 +46,59 @@ class STTProcessorWorker(QThread):
             print("DEBUG STT: STT processor running, waiting for audio chunks...")
 
             capture_samplerate = self.audio_capture_worker_instance.samplerate
+            channels = self.audio_capture_worker_instance.channels
             print(f"DEBUG STT: Audio captured at {capture_samplerate} Hz, target STT samplerate is {self.target_stt_samplerate} Hz.")
 
+            self.audio_buffer = AudioRingBuffer(int(self.max_buffer_sec * capture_samplerate), channels)
+            threshold_samples = int((self.buffer_duration_sec - 0.01) * capture_samplerate)
+
             while self._running:
-                audio_chunk = self.audio_capture_worker_instance.get_audio_chunk()
-                
-                if audio_chunk is not None and audio_chunk.size > 0:
-                    self.audio_buffer.append(audio_chunk.astype(np.float32))
-
-                current_buffer_samples = sum(len(chunk) for chunk in self.audio_buffer)
-                
-                if current_buffer_samples / capture_samplerate >= self.buffer_duration_sec - 0.01:
-                    print(f"DEBUG STT: Buffer threshold reached ({current_buffer_samples / capture_samplerate:.2f}s). Starting transcription...")
-                    
-                    if not self.audio_buffer:
-                        print("DEBUG STT: Audio buffer is empty despite threshold being met. Skipping transcription.")
-                        continue
-
-                    audio_data = np.concatenate(list(self.audio_buffer))
-                    self.audio_buffer.clear()
-
-                    print(f"DEBUG STT: Concatenated audio data initial shape: {audio_data.shape}, total samples: {len(audio_data)}")
-
-                    if audio_data.ndim > 1:
-                        if audio_data.shape[1] > 1:
-                            audio_data = audio_data.mean(axis=1)
-                            print(f"DEBUG STT: Converted multi-channel to mono. New shape: {audio_data.shape}")
-                        else:
-                            audio_data = audio_data.flatten()
-                            print(f"DEBUG STT: Flattened 2D single-channel array to 1D. New shape: {audio_data.shape}")
-
-                    if len(audio_data) < self.target_stt_samplerate * 0.1:
-                        print(f"DEBUG STT: WARNING: Processed audio data too short ({len(audio_data)} samples) for meaningful transcription. Skipping this batch.")
-                        continue
-
-                    print(f"DEBUG STT: Audio data shape before resampling: {audio_data.shape}")
-
-                    if capture_samplerate != self.target_stt_samplerate:
-                        print(f"DEBUG STT: Resampling audio from {capture_samplerate} Hz to {self.target_stt_samplerate} Hz for transcription...")
-                        audio_data = np.ascontiguousarray(audio_data)
-                        audio_data = resampy.resample(audio_data, capture_samplerate, self.target_stt_samplerate)
-                        print("DEBUG STT: Resampling complete.")
-                    
-                    print(f"DEBUG STT: Audio data shape after resampling: {audio_data.shape}")
-
-                    segments, info = self.model.transcribe(
-                        audio_data,
-                        beam_size=5,
-                        language="en",
-                        vad_filter=True
-                    )
-                    
-                    full_text = []
-                    for segment in segments:
-                        full_text.append(segment.text)
-                    
-                    recognized_text = "".join(full_text).strip()
-                    
-                    if recognized_text:
-                        print(f"DEBUG STT: Recognized text: '{recognized_text}'")
-                        self.text_recognized.emit(recognized_text)
-                    else:
-                        print("DEBUG STT: Recognized text is empty or only whitespace (might be silence or non-speech).")
-                
-                time.sleep(0.01)
+                if not self._wait_for_audio() or len(self.audio_buffer) < threshold_samples:
+                    continue
+
+                current_buffer_samples = len(self.audio_buffer)
+                print(f"DEBUG STT: Buffer threshold reached ({current_buffer_samples / capture_samplerate:.2f}s). Starting transcription...")
+                if self.audio_buffer.dropped:
+                    print(f"DEBUG STT: WARNING: {self.audio_buffer.dropped / capture_samplerate:.2f}s of audio dropped because transcription fell behind.")
+                    self.audio_buffer.dropped = 0
+
+                # 零拷贝视图，在本轮转录结束、下一次写入之前一直有效
+                audio_data = self.audio_buffer.view(current_buffer_samples)
+                self.audio_buffer.consume(current_buffer_samples)
+
+                if channels > 1:
+                    audio_data = audio_data.mean(axis=1)
+                    print(f"DEBUG STT: Converted multi-channel to mono. New shape: {audio_data.shape}")
+                else:
+                    audio_data = audio_data[:, 0]
+
+                if len(audio_data) < self.target_stt_samplerate * 0.1:
+                    print(f"DEBUG STT: WARNING: Processed audio data too short ({len(audio_data)} samples) for meaningful transcription. Skipping this batch.")
+                    continue
+
+                if capture_samplerate != self.target_stt_samplerate:
+                    # 单声道的列视图本身是连续的，这里不会复制
+                    audio_data = np.ascontiguousarray(audio_data)
+                    audio_data = resampy.resample(audio_data, capture_samplerate, self.target_stt_samplerate)
+
+                segments, info = self.model.transcribe(
+                    audio_data,
+                    beam_size=5,
+                    language="en",
+                    vad_filter=True
+                )
+
+                full_text = []
+                for segment in segments:
+                    full_text.append(segment.text)
+
+                recognized_text = "".join(full_text).strip()
+
+                if recognized_text:
+                    print(f"DEBUG STT: Recognized text: '{recognized_text}'")
+                    self.text_recognized.emit(recognized_text)
+                else:
+                    print("DEBUG STT: Recognized text is empty or only whitespace (might be silence or non-speech).")
 
         except Exception as e:
             self.error_occurred.emit(f"STT处理错误: {e}")
@@ -106,4 +110,4 @@ class STTProcessorWorker(QThread):
 
     def stop(self):
         self._running = False
-        self.wait()
\ No newline at end of file
+        self.wait()
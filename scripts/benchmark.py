@@ -0,0 +1,449 @@
+"""
+离线 RAG 管线基准测试。
+
+1. 生成指定规模的合成知识库 (确定性随机，相同 --seed 得到相同内容)
+2. 用 ingest.py 的流式管线摄取到临时 ChromaDB 目录，统计摄取吞吐
+3. 对合成问题测量查询嵌入 + 混合检索的延迟分位数和命中率
+4. 对比 Chroma 与 mmap float16 向量索引的稠密检索: 冷启动耗时、延迟分位数和 recall@k
+5. 用本地确定性桩 LLM 并发调用 RAGService.invoke_chain，测量端到端延迟
+6. 结果 (含 git 提交号和峰值 RSS) 写入 JSON 文件，便于在不同提交之间对比
+
+全程离线、仅使用 CPU。默认使用哈希嵌入 (不需要下载模型)；--embedder model 使用
+settings.embedding_model_name 对应的本地已缓存模型。
+
+用法: python scripts\\benchmark.py --docs 200 --questions 100 --concurrency 4
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+# 禁止 huggingface 访问网络 (必须在导入 sentence-transformers 之前设置)
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+
+import ingest
+from ingest import PROJECT_ROOT
+from backend.app.core.config import settings
+from backend.app.services.embedding_service import EmbeddingStats, get_embedding_engine
+from backend.app.services.lexical_index import tokenize
+from backend.app.services.llm_service import llm_registry
+from backend.app.services.rag_service import RAGService, COLLECTION_NAME
+from backend.app.services.hybrid_retriever import HybridRetriever
+from backend.app.services.vector_index import VectorIndex, VECTOR_INDEX_DIRNAME
+
+STUB_PROVIDER = "stub"
+# 在新进程中测量冷启动 (导入 + 打开 + 第一次查询)，避免进程内已加载的模块和缓存影响结果
+COLD_START_SNIPPETS = {
+    "chroma": (
+        "import chromadb\n"
+        "client = chromadb.PersistentClient(path=sys.argv[2])\n"
+        "collection = client.get_collection(name=sys.argv[3])\n"
+        "collection.query(query_embeddings=[json.loads(sys.argv[4])], n_results=int(sys.argv[5]))\n"
+    ),
+    "mmap": (
+        "from backend.app.services.vector_index import VectorIndex\n"
+        "index = VectorIndex.open(sys.argv[2])\n"
+        "index.search_batch([json.loads(sys.argv[4])], int(sys.argv[5]))\n"
+    ),
+}
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmark_results")
+
+TOPICS = [
+    "python", "docker", "kubernetes", "postgresql", "redis", "kafka", "react", "linux",
+    "tcp", "http", "graphql", "grpc", "spark", "pytorch", "git", "nginx",
+]
+CONCEPTS = [
+    "connection pooling", "garbage collection", "consistent hashing", "write-ahead logging",
+    "backpressure", "rate limiting", "leader election", "query planning", "memory mapping",
+    "event loop", "copy on write", "lock contention", "cache eviction", "schema migration",
+]
+FILLER = [
+    "In practice the behaviour depends on the workload and on how the service is deployed.",
+    "Interviewers usually expect a concrete example together with the trade-offs involved.",
+    "A common follow-up question asks how the design changes under a tenfold increase in traffic.",
+    "Monitoring latency percentiles makes regressions visible long before users complain.",
+    "The default configuration is rarely optimal for production traffic patterns.",
+]
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    确定性的特征哈希嵌入: 与 lexical_index 相同的分词，词项哈希到固定维度后做 L2 归一化。
+    不依赖任何模型文件，用于在离线环境下测量管线本身的开销。
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.device = "cpu"
+        self.stats = EmbeddingStats()
+        self._stats_lock = threading.Lock()
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in tokenize(text):
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.dimension] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_array(self, texts: list) -> np.ndarray:
+        started = time.perf_counter()
+        result = np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self.dimension), np.float32)
+        with self._stats_lock:
+            self.stats.chunks += len(texts)
+            self.stats.tokens += sum(len(tokenize(t)) for t in texts)
+            self.stats.batches += 1
+            self.stats.seconds += time.perf_counter() - started
+        return result
+
+    def embed_documents(self, texts: list) -> list:
+        return self.embed_array(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> list:
+        return self._vector(text).tolist()
+
+
+class StubLLM(LLM):
+    """确定性的本地桩 LLM: 固定延迟后返回由提示词哈希生成的回答，不访问网络。"""
+
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-stub"
+
+    def _answer(self, prompt: str) -> str:
+        return f"Stub answer {zlib.crc32(prompt.encode('utf-8')):08x} for a prompt of {len(prompt)} characters."
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs) -> str:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return self._answer(prompt)
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs) -> str:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+        return self._answer(prompt)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="离线 RAG 管线基准测试 (合成知识库 + 桩 LLM)。")
+    parser.add_argument("--docs", type=int, default=200, help="合成知识库的文件数")
+    parser.add_argument("--paragraphs", type=int, default=20, help="每个文件的段落数")
+    parser.add_argument("--questions", type=int, default=100, help="检索和端到端测试的问题数")
+    parser.add_argument("--concurrency", type=int, default=4, help="端到端测试的并发请求数")
+    parser.add_argument("--embedder", choices=["hashing", "model"], default="hashing",
+                        help="hashing: 特征哈希 (无需模型); model: 本地已缓存的嵌入模型")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="桩 LLM 每次调用的固定延迟")
+    parser.add_argument("--dense-k", type=int, default=10, help="稠密检索后端对比时的 k (recall@k)")
+    parser.add_argument("--semantic-cache", action="store_true", help="启用语义答案缓存 (默认关闭，以测量完整链路)")
+    parser.add_argument("--workers", type=int, default=settings.ingest_parse_workers, help="解析文档的进程数")
+    parser.add_argument("--batch-size", type=int, default=settings.embedding_write_batch_size, help="每批写入的块数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--work-dir", default=None, help="合成知识库和 ChromaDB 的目录 (默认使用临时目录)")
+    parser.add_argument("--keep", action="store_true", help="保留工作目录")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径 (默认写入 benchmark_results/)")
+    return parser.parse_args()
+
+
+def build_knowledge_base(kb_dir: str, docs: int, paragraphs: int, seed: int) -> list:
+    """
+    生成合成知识库，返回 [(问题, 来源文件名), ...] 候选。
+    每个段落包含一个唯一的技术标识符 (如 redis-cfg-0012-07)，问题引用该标识符，命中来源可验证。
+    """
+    rng = random.Random(seed)
+    os.makedirs(kb_dir, exist_ok=True)
+    questions = []
+    for doc_index in range(docs):
+        topic = TOPICS[doc_index % len(TOPICS)]
+        file_name = f"{topic}_{doc_index:04d}.txt"
+        lines = [f"{topic.title()} interview notes #{doc_index}", ""]
+        for para_index in range(paragraphs):
+            concept = rng.choice(CONCEPTS)
+            identifier = f"{topic}-cfg-{doc_index:04d}-{para_index:02d}"
+            sentences = [
+                f"The {identifier} setting controls how {topic} handles {concept}.",
+                f"Raising {identifier} above {rng.randint(2, 512)} trades latency for throughput in {concept}.",
+            ] + rng.sample(FILLER, 3)
+            lines.append(" ".join(sentences))
+            lines.append("")
+            questions.append((f"How does {identifier} affect {concept} in {topic}?", file_name))
+        with open(os.path.join(kb_dir, file_name), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+    return questions
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    values = np.array(samples, dtype=np.float64) * 1000.0
+    return {
+        "count": int(len(values)),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def peak_rss_mb() -> dict:
+    """当前进程及 (已结束的) 子进程的峰值 RSS。Windows 上需要 psutil，否则返回 None。"""
+    try:
+        import resource
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # macOS 单位为字节，Linux 为 KB
+        return {
+            "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+        }
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return {"self": getattr(info, "peak_wset", info.rss) / (1024 * 1024), "children": None}
+    except ImportError:
+        return {"self": None, "children": None}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_retrieval(service, questions: list) -> dict:
+    """逐个问题测量查询嵌入和混合检索 (向量 + BM25) 的延迟，以及前 k 个结果的来源命中率。"""
+    embed_times, search_times, hits = [], [], 0
+    for question, source in questions:
+        started = time.perf_counter()
+        vector = service.embedding_function.embed_query(question)
+        embedded = time.perf_counter()
+        docs = service.retriever.search(question, vector)
+        finished = time.perf_counter()
+        embed_times.append(embedded - started)
+        search_times.append(finished - embedded)
+        retrieval_sources = {os.path.basename(doc.metadata.get("source", "")) for doc in docs}
+        hits += source in retrieval_sources
+    return {
+        "query_embedding": percentiles(embed_times),
+        "search": percentiles(search_times),
+        "total": percentiles([e + s for e, s in zip(embed_times, search_times)]),
+        "hit_rate_at_k": hits / len(questions) if questions else 0.0,
+        "k": service.retriever.k,
+    }
+
+
+def cold_start_seconds(backend: str, path: str, vector: list, k: int):
+    code = (
+        "import sys, json, time\n"
+        "sys.path.insert(0, sys.argv[1])\n"
+        "started = time.perf_counter()\n"
+        + COLD_START_SNIPPETS[backend]
+        + "print(json.dumps(time.perf_counter() - started))\n"
+    )
+    try:
+        output = subprocess.run(
+            [sys.executable, "-c", code, PROJECT_ROOT, path, COLLECTION_NAME, json.dumps(vector), str(k)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        return float(output.strip().splitlines()[-1])
+    except (OSError, subprocess.CalledProcessError, ValueError, IndexError) as e:
+        print(f"⚠️ {backend} 冷启动测量失败: {e}")
+        return None
+
+
+def bench_dense_backends(service, questions: list, k: int):
+    """
+    对比两种稠密检索后端 (都通过 HybridRetriever.dense_search，含取回正文和元数据):
+    Chroma (HNSW 近似检索) 与 mmap float16 向量索引 (暴力精确检索)。
+    recall@k 以集合中原始 float32 嵌入的精确检索结果为基准。
+    """
+    vector_index_dir = os.path.join(service.chroma_data_path, VECTOR_INDEX_DIRNAME)
+    started = time.perf_counter()
+    vector_index = VectorIndex.open(vector_index_dir)
+    open_seconds = time.perf_counter() - started
+    if vector_index is None:
+        return None
+
+    everything = service.collection.get(include=["embeddings"])
+    ids = list(everything["ids"])
+    matrix = np.asarray(everything["embeddings"], dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    vectors = [service.embedding_function.embed_query(question) for question, _source in questions]
+    backends = {
+        "chroma": HybridRetriever(collection=service.collection, embedding_function=service.embedding_function, k=k),
+        "mmap": HybridRetriever(collection=service.collection, embedding_function=service.embedding_function,
+                                vector_index=vector_index, k=k),
+    }
+    results = {}
+    for name, retriever in backends.items():
+        times, recalls = [], []
+        for vector in vectors:
+            query = np.asarray(vector, dtype=np.float32)
+            exact = {ids[i] for i in np.argsort(-(matrix @ (query / max(np.linalg.norm(query), 1e-12))))[:k]}
+            started = time.perf_counter()
+            docs = retriever.dense_search(vector, k)
+            times.append(time.perf_counter() - started)
+            recalls.append(len(exact & set(docs)) / len(exact) if exact else 1.0)
+        results[name] = {
+            "search": percentiles(times),
+            "recall_at_k": float(np.mean(recalls)) if recalls else 0.0,
+            "cold_start_seconds": cold_start_seconds(
+                name, service.chroma_data_path if name == "chroma" else vector_index_dir, vectors[0], k
+            ) if vectors else None,
+        }
+    results["mmap"]["open_seconds"] = open_seconds
+    results["k"] = k
+    return results
+
+
+async def bench_end_to_end(service, questions: list, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def ask(question: str):
+        async with semaphore:
+            started = time.perf_counter()
+            await service.invoke_chain(question, STUB_PROVIDER)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(ask(question) for question, _source in questions))
+    wall = time.perf_counter() - started
+    return {
+        "latency": percentiles(latencies),
+        "concurrency": concurrency,
+        "wall_seconds": wall,
+        "questions_per_sec": len(questions) / wall if wall else 0.0,
+    }
+
+
+def main():
+    args = parse_args()
+    settings.semantic_cache_enabled = args.semantic_cache
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="rag-bench-")
+    kb_dir = os.path.join(work_dir, "knowledge_base")
+    chroma_data_path = os.path.join(work_dir, "chroma_data")
+    shutil.rmtree(kb_dir, ignore_errors=True)
+    shutil.rmtree(chroma_data_path, ignore_errors=True)
+
+    print(f"🧪 基准测试工作目录: {work_dir}")
+    candidates = build_knowledge_base(kb_dir, args.docs, args.paragraphs, args.seed)
+    questions = random.Random(args.seed).sample(candidates, min(args.questions, len(candidates)))
+    print(f"📝 已生成合成知识库: {args.docs} 个文件, {len(candidates)} 个段落, {len(questions)} 个测试问题")
+
+    embedder = HashingEmbeddings() if args.embedder == "hashing" else get_embedding_engine()
+
+    # 1. 摄取 (与 ingest.py 相同的管线，写入独立的数据目录)
+    ingest_args = argparse.Namespace(
+        rebuild=True,
+        workers=args.workers,
+        timeout=settings.ingest_parse_timeout_sec,
+        retry_quarantined=False,
+        batch_size=args.batch_size,
+        vector_index=True,
+        in_place=False,
+        collection=COLLECTION_NAME,
+        knowledge_base=None,
+    )
+    started = time.perf_counter()
+    pipeline_result = ingest.run_ingest(
+        ingest_args, knowledge_base_dir=kb_dir, chroma_data_path=chroma_data_path, embedding_engine_factory=lambda: embedder
+    )
+    ingest_seconds = time.perf_counter() - started
+    chunks = pipeline_result.chunks_written if pipeline_result else 0
+    # 只统计本次摄取的嵌入 (引擎在进程内共享，之后的检索基准也会调用它)
+    embedding_stats = pipeline_result.embedding_stats if pipeline_result and pipeline_result.embedding_stats else EmbeddingStats()
+
+    # 2. 检索与端到端 (RAGService 使用同一个数据目录和嵌入函数，LLM 替换为桩)
+    llm_registry.register(STUB_PROVIDER, StubLLM(latency_ms=args.llm_latency_ms), max_concurrency=args.concurrency)
+    service = RAGService(chroma_data_path=chroma_data_path, embedding_function=embedder)
+
+    print("🔎 测量检索延迟...")
+    retrieval = bench_retrieval(service, questions)
+    print("🧮 对比 Chroma 与 mmap 向量索引...")
+    dense_backends = bench_dense_backends(service, questions, args.dense_k)
+    print("🤖 测量端到端延迟 (桩 LLM)...")
+    end_to_end = asyncio.run(bench_end_to_end(service, questions, args.concurrency))
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "ingest": {
+            "files": args.docs,
+            "chunks": chunks,
+            "seconds": ingest_seconds,
+            "pipeline_seconds": pipeline_result.seconds if pipeline_result else 0.0,
+            "chunks_per_sec": chunks / ingest_seconds if ingest_seconds else 0.0,
+            "files_per_sec": args.docs / ingest_seconds if ingest_seconds else 0.0,
+            "embedding": {
+                "chunks": embedding_stats.chunks,
+                "tokens": embedding_stats.tokens,
+                "batches": embedding_stats.batches,
+                "seconds": embedding_stats.seconds,
+                "chunks_per_sec": embedding_stats.chunks_per_sec,
+            },
+        },
+        "retrieval": retrieval,
+        "dense_backends": dense_backends,
+        "end_to_end": end_to_end,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench-{results['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print("✅ 基准测试完成!")
+    print(f"   摄取: {chunks} 个块, {ingest_seconds:.2f} 秒 ({results['ingest']['chunks_per_sec']:.1f} 块/秒)")
+    print(f"   检索: p50 {retrieval['total']['p50_ms']:.1f} ms, p95 {retrieval['total']['p95_ms']:.1f} ms, "
+          f"p99 {retrieval['total']['p99_ms']:.1f} ms, 命中率@{retrieval['k']} {retrieval['hit_rate_at_k']:.2%}")
+    if dense_backends:
+        for name in ("chroma", "mmap"):
+            backend = dense_backends[name]
+            cold = f"{backend['cold_start_seconds'] * 1000:.0f} ms" if backend["cold_start_seconds"] is not None else "N/A"
+            print(f"   稠密检索 [{name}]: p50 {backend['search']['p50_ms']:.2f} ms, p99 {backend['search']['p99_ms']:.2f} ms, "
+                  f"recall@{dense_backends['k']} {backend['recall_at_k']:.2%}, 冷启动 {cold}")
+    print(f"   端到端: p50 {end_to_end['latency']['p50_ms']:.1f} ms, p99 {end_to_end['latency']['p99_ms']:.1f} ms, "
+          f"{end_to_end['questions_per_sec']:.1f} 问题/秒 (并发 {args.concurrency})")
+    if results["peak_rss_mb"]["self"] is not None:
+        print(f"   峰值 RSS: {results['peak_rss_mb']['self']:.0f} MB")
+    print(f"📄 结果已写入: {output}")
+
+    if not args.keep and not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
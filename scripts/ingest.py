@@ -1,141 +1,345 @@
 import os
 import sys
+import time
 import shutil
-import chromadb
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader, TextLoader, Docx2txtLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.schema import Document
+import argparse
 
-# 将 backend 路径添加到 sys.path
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'app'))
-from core.config import settings
+# 将项目根目录添加到 sys.path，以便复用 backend 中的模块
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(PROJECT_ROOT)
+from backend.app.core.config import settings
+from backend.app.ingestion.manifest import IngestManifest, MANIFEST_FILENAME, read_index_version
+from backend.app.ingestion.parsing import ParsingPool
+from backend.app.ingestion.pipeline import IngestPipeline, JOURNAL_FILENAME, make_text_splitter
+from backend.app.ingestion.dedup import DedupIndex, DEDUP_INDEX_FILENAME
+from backend.app.services.embedding_service import get_embedding_engine
+from backend.app.services.lexical_index import build_lexical_index, LEXICAL_INDEX_DIRNAME
+from backend.app.services.vector_index import build_vector_index, VECTOR_INDEX_DIRNAME
+from backend.app.services.versioned_dir import current_version
+from backend.app.services.rag_service import open_persistent_client, release_persistent_client
+from backend.app.services.snapshots import (
+    resolve_data_path, current_snapshot, create_snapshot, activate_snapshot, discard_snapshot, apply_retention,
+    SNAPSHOTS_DIRNAME,
+)
+from backend.app.services.knowledge_bases import (
+    collection_data_root, collection_knowledge_base_dir, validate_collection_name, UnknownCollection, COLLECTIONS_DIRNAME,
+)
 
-KNOWLEDGE_BASE_DIR = "knowledge_base"
-COLLECTION_NAME = "interview_assistant"
 
 def clean_chroma_data(chroma_data_path):
     """
-    完全清理ChromaDB数据目录
+    完全清理ChromaDB数据目录 (旧布局下数据目录同时是快照和命名集合的根目录，这两者保留)
     """
     if os.path.exists(chroma_data_path):
         print(f"🗑️ 清理现有 ChromaDB 数据目录: {chroma_data_path}")
         try:
-            shutil.rmtree(chroma_data_path)
+            for name in os.listdir(chroma_data_path):
+                if name in (SNAPSHOTS_DIRNAME, COLLECTIONS_DIRNAME):
+                    continue
+                path = os.path.join(chroma_data_path, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
             print("✅ 成功清理旧数据")
         except Exception as e:
             print(f"⚠️ 警告: 无法清理旧数据: {e}")
-    
+
     # 重新创建目录
     os.makedirs(chroma_data_path, exist_ok=True)
 
-def main():
-    print("🚀 开始知识库摄取...")
+def build_lexical(collection, chroma_data_path):
+    """基于集合的当前内容重建 BM25 倒排索引 (与向量索引使用相同的块 ID)。"""
+    started = time.perf_counter()
+    lexical_index_dir = os.path.join(chroma_data_path, LEXICAL_INDEX_DIRNAME)
+    os.makedirs(lexical_index_dir, exist_ok=True)
+    version_dir, num_docs = build_lexical_index(collection, lexical_index_dir, read_index_version(chroma_data_path))
+    print(f"🔤 已构建 BM25 词法索引: {num_docs} 个块 -> {version_dir} ({time.perf_counter() - started:.2f} 秒)")
 
-    # 定义 ChromaDB 数据存储路径，与 rag_service.py 中的路径一致
-    chroma_data_path = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')), "chroma_data")
-    
-    # 完全清理数据目录（推荐用于开发阶段）
-    clean_chroma_data(chroma_data_path)
-    
-    print(f"摄取脚本使用 ChromaDB (持久化客户端) 路径: {chroma_data_path}")
-    # 初始化 ChromaDB 的持久化客户端
-    client = chromadb.PersistentClient(path=chroma_data_path)
-
-    # 1. 加载文档
-    all_documents = []
+def build_vector(collection, chroma_data_path):
+    """把集合中的嵌入导出为 mmap float16 向量索引 (VECTOR_STORE=mmap 时后端用它代替 Chroma 检索)。"""
+    started = time.perf_counter()
+    vector_index_dir = os.path.join(chroma_data_path, VECTOR_INDEX_DIRNAME)
+    os.makedirs(vector_index_dir, exist_ok=True)
+    version_dir, num_docs = build_vector_index(
+        collection, vector_index_dir, read_index_version(chroma_data_path), settings.embedding_model_name
+    )
+    print(f"🧮 已导出 float16 向量索引: {num_docs} 个块 -> {version_dir} ({time.perf_counter() - started:.2f} 秒)")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="增量摄取 knowledge_base 目录中的文档到 ChromaDB。")
+    parser.add_argument(
+        "--collection",
+        default=settings.default_collection,
+        help="目标集合名 (命名集合的文档默认位于 KNOWLEDGE_BASES_DIR/<集合名>，数据位于 chroma_data/collections/<集合名>)",
+    )
+    parser.add_argument(
+        "--knowledge-base",
+        default=None,
+        help="源文档目录 (默认由集合名决定)",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="删除 chroma_data 目录并重新摄取全部文档",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.ingest_parse_workers,
+        help="解析文档的进程数 (0 表示使用全部 CPU 核心)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=settings.ingest_parse_timeout_sec,
+        help="单个文件的解析超时时间 (秒)，超时的文件会被隔离",
+    )
+    parser.add_argument(
+        "--retry-quarantined",
+        action="store_true",
+        help="重新尝试解析之前失败或超时且内容未变的文件",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=settings.embedding_write_batch_size,
+        help="每批嵌入并写入 ChromaDB 的块数",
+    )
+    parser.add_argument(
+        "--in-place",
+        action="store_true",
+        default=not settings.ingest_snapshots,
+        help="直接修改当前数据目录，不创建新快照 (运行中的后端会看到摄取过程中的中间状态)",
+    )
+    parser.add_argument(
+        "--vector-index",
+        action="store_true",
+        default=settings.vector_store == "mmap",
+        help="同时导出 mmap float16 向量索引 (VECTOR_STORE=mmap 时默认开启)",
+    )
+    args = parser.parse_args()
     try:
-        pdf_loader = DirectoryLoader(
-            KNOWLEDGE_BASE_DIR,
-            glob="**/*.pdf",
-            loader_cls=PyPDFLoader,
-            show_progress=True,
-            use_multithreading=True
-        )
-        all_documents.extend(pdf_loader.load())
-        print(f"📕 加载了 {len(all_documents)} PDF 文档") # 修正计数
-    except Exception as e:
-        print(f"⚠️ 加载 PDF 文件时出错: {e}")
+        validate_collection_name(args.collection)
+    except UnknownCollection as e:
+        parser.error(str(e))
+    return args
+
+def has_pending_changes(args, knowledge_base_dir, chroma_data_path) -> bool:
+    """当前数据目录是否需要摄取 (知识库有变化、清单无效或缺少索引)。只做 stat 扫描，不修改任何文件。"""
+    manifest, manifest_valid = IngestManifest.load(
+        os.path.join(chroma_data_path, MANIFEST_FILENAME), knowledge_base_dir, settings.embedding_model_name, args.collection
+    )
+    if not manifest_valid:
+        return True
+    if not current_version(os.path.join(chroma_data_path, LEXICAL_INDEX_DIRNAME)):
+        return True
+    if args.vector_index and not current_version(os.path.join(chroma_data_path, VECTOR_INDEX_DIRNAME)):
+        return True
+    return manifest.scan(retry_quarantined=args.retry_quarantined).has_changes
 
+def verify_snapshot(chroma_data_path, knowledge_base_dir, collection_name, vector_index: bool):
+    """切换前校验快照: 集合可打开且块数与清单一致、索引齐全、能完成一次向量查询。返回问题描述，通过时返回 None。"""
     try:
-        text_loader = DirectoryLoader(
-            KNOWLEDGE_BASE_DIR,
-            glob="**/*.txt",
-            loader_cls=TextLoader,
-            show_progress=True,
-            use_multithreading=True
-        )
-        txt_docs = text_loader.load()
-        all_documents.extend(txt_docs)
-        print(f"📄 加载了 {len(txt_docs)} TXT 文档")
+        client = open_persistent_client(chroma_data_path)
     except Exception as e:
-        print(f"⚠️ 加载 TXT 文件时出错: {e}")
+        return f"无法打开集合: {e}"
+    try:
+        return _verify_collection(client, chroma_data_path, knowledge_base_dir, collection_name, vector_index)
+    finally:
+        release_persistent_client(client, chroma_data_path)
 
+def _verify_collection(client, chroma_data_path, knowledge_base_dir, collection_name, vector_index: bool):
     try:
-        docx_loader = DirectoryLoader(
-            KNOWLEDGE_BASE_DIR,
-            glob="**/*.docx",
-            loader_cls=Docx2txtLoader,
-            show_progress=True,
-            use_multithreading=True
-        )
-        docx_docs = docx_loader.load()
-        all_documents.extend(docx_docs)
-        print(f"📘 加载了 {len(docx_docs)} DOCX 文档")
+        collection = client.get_collection(name=collection_name)
+        document_count = collection.count()
     except Exception as e:
-        print(f"⚠️ 加载 DOCX 文件时出错: {e}")
+        return f"无法打开集合: {e}"
+    manifest, manifest_valid = IngestManifest.load(
+        os.path.join(chroma_data_path, MANIFEST_FILENAME), knowledge_base_dir, settings.embedding_model_name, collection_name
+    )
+    if not manifest_valid:
+        return "摄取清单无效"
+    expected_count = sum(len(record.chunk_ids) for record in manifest.records.values())
+    if document_count != expected_count:
+        return f"集合中有 {document_count} 个块，清单记录了 {expected_count} 个"
+    if not current_version(os.path.join(chroma_data_path, LEXICAL_INDEX_DIRNAME)):
+        return "缺少 BM25 词法索引"
+    if vector_index and not current_version(os.path.join(chroma_data_path, VECTOR_INDEX_DIRNAME)):
+        return "缺少向量索引"
+    if document_count:
+        sample = collection.get(limit=1, include=["embeddings"])
+        found = collection.query(query_embeddings=[list(sample["embeddings"][0])], n_results=1, include=[])
+        if not found["ids"] or not found["ids"][0]:
+            return "向量查询没有返回结果"
+    return None
 
-    documents = all_documents
+def run_ingest(args, knowledge_base_dir=None, chroma_data_path=None, embedding_engine_factory=get_embedding_engine):
+    """
+    执行一次 (增量) 摄取，返回本次的 PipelineResult (知识库无变化时为 None)。
+    默认在新的快照目录中构建 (增量摄取时先复制当前快照)，校验通过后切换 CURRENT 指针，
+    运行中的后端随后在后台切换到新快照；--in-place 时直接修改当前数据目录。
+    knowledge_base_dir / chroma_data_path / embedding_engine_factory 可以替换，供 benchmark.py 复用整条管线。
+    """
+    # 定义 ChromaDB 数据存储路径，与 rag_service.py 中的路径一致 (命名集合各自使用 chroma_data/collections/<集合名>)
+    data_root = chroma_data_path or collection_data_root(args.collection, os.path.join(PROJECT_ROOT, "chroma_data"))
+    knowledge_base_dir = knowledge_base_dir or args.knowledge_base or collection_knowledge_base_dir(args.collection)
+    if not os.path.isdir(knowledge_base_dir):
+        raise FileNotFoundError(f"知识库目录不存在: {knowledge_base_dir}")
+    print(f"📂 集合 '{args.collection}': 文档 {knowledge_base_dir} -> 数据 {data_root}")
+    if args.in_place:
+        try:
+            return ingest_into(args, knowledge_base_dir, resolve_data_path(data_root), embedding_engine_factory)
+        except Exception:
+            print("   已提交的批次已保存，重新运行 ingest.py 将从中断处继续。")
+            raise
+
+    live_path = resolve_data_path(data_root)
+    if not args.rebuild and not has_pending_changes(args, knowledge_base_dir, live_path):
+        print("✅ 知识库无变化，无需创建新快照。")
+        return None
 
-    if not documents:
-        print(f"❌ 在 {KNOWLEDGE_BASE_DIR} 目录中未找到文档。中止。")
-        return
+    # 增量摄取基于当前数据 (包括旧布局下直接位于 chroma_data 中的数据)，--rebuild 从空目录开始
+    copy_from = None
+    if not args.rebuild and os.path.exists(os.path.join(live_path, MANIFEST_FILENAME)):
+        copy_from = live_path
+    version, snapshot_dir = create_snapshot(data_root, copy_from)
+    print(f"📸 在新快照 {version} 中构建" + (f" (复制自 {copy_from})" if copy_from else ""))
+    try:
+        result = ingest_into(args, knowledge_base_dir, snapshot_dir, embedding_engine_factory)
+        problem = verify_snapshot(snapshot_dir, knowledge_base_dir, args.collection, args.vector_index)
+    except BaseException:
+        discard_snapshot(data_root, version)
+        print(f"   未完成的快照 {version} 已删除，当前生效的快照 ({current_snapshot(data_root) or '旧布局'}) 不受影响。")
+        raise
+    if problem:
+        discard_snapshot(data_root, version)
+        raise RuntimeError(f"快照 {version} 校验失败，未切换: {problem}")
 
-    print(f"📚 总共加载的文档数量: {len(documents)}")
+    activate_snapshot(data_root, version)
+    print(f"🔀 已切换到快照 {version}，运行中的后端将在 {settings.snapshot_poll_sec:.0f} 秒内切换 (无需重启)")
+    removed = apply_retention(data_root, settings.snapshot_retention)
+    if removed:
+        print(f"🧹 按保留策略 (最近 {settings.snapshot_retention} 个) 删除旧快照: {', '.join(removed)}")
+    return result
 
-    # 2. 将文档分割成块
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000, 
-        chunk_overlap=200,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    chunks = text_splitter.split_documents(documents)
-    print(f"📄 分割成 {len(chunks)} 个块。")
-
-    # 3. 初始化 LangChain 的 HuggingFace Embeddings
-    print("🧠 使用 LangChain HuggingFaceEmbeddings 创建嵌入...")
-    embeddings_for_langchain_chroma = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
-    )
+def ingest_into(args, knowledge_base_dir, chroma_data_path, embedding_engine_factory):
+    """对指定的数据目录执行一次 (增量) 摄取。"""
+    start_time = time.perf_counter()
+    print("🚀 开始知识库摄取...")
+
+    manifest_path = os.path.join(chroma_data_path, MANIFEST_FILENAME)
+    journal_path = os.path.join(chroma_data_path, JOURNAL_FILENAME)
+    dedup_index_path = os.path.join(chroma_data_path, DEDUP_INDEX_FILENAME)
 
-    # 4. 存储到 ChromaDB (使用持久化客户端)
-    print(f"💾 将块存储到 ChromaDB 集合: {COLLECTION_NAME}...")
+    if args.rebuild and args.in_place:
+        # 完全清理数据目录 (快照模式下新快照本身就是空目录)
+        clean_chroma_data(chroma_data_path)
+    os.makedirs(chroma_data_path, exist_ok=True)
 
+    print(f"摄取脚本使用 ChromaDB (持久化客户端) 路径: {chroma_data_path}")
+    # 初始化 ChromaDB 的持久化客户端，结束时释放 (快照目录随后可能被校验、切换或删除)
+    client = open_persistent_client(chroma_data_path)
     try:
-        # 使用 LangChain 的 Chroma.from_documents 来创建并填充向量存储
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings_for_langchain_chroma,
-            collection_name=COLLECTION_NAME,
-            client=client,
-            persist_directory=chroma_data_path
+        manifest, manifest_valid = IngestManifest.load(
+            manifest_path, knowledge_base_dir, settings.embedding_model_name, args.collection
+        )
+        collection = client.get_or_create_collection(name=args.collection)
+
+        if not manifest_valid or (manifest.records and collection.count() == 0):
+            # 没有可用的清单 (首次运行、旧版本数据或嵌入模型变更)，或者集合已被外部清空：
+            # 丢弃集合中的旧数据，所有文件按新增处理
+            print("ℹ️ 未找到有效的摄取清单，将重新摄取全部文档。")
+            manifest.records = {}
+            for stale_path in (journal_path, dedup_index_path):
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+            client.delete_collection(name=args.collection)
+            collection = client.get_or_create_collection(name=args.collection)
+
+        # 1. 对比知识库与清单
+        diff = manifest.scan(retry_quarantined=args.retry_quarantined)
+        print(f"🔍 扫描完成: {diff.summary()}")
+
+        lexical_index_missing = not current_version(os.path.join(chroma_data_path, LEXICAL_INDEX_DIRNAME))
+        build_vector_index_enabled = args.vector_index
+        vector_index_missing = build_vector_index_enabled and not current_version(os.path.join(chroma_data_path, VECTOR_INDEX_DIRNAME))
+        if not diff.has_changes:
+            if lexical_index_missing:
+                build_lexical(collection, chroma_data_path)
+            if vector_index_missing:
+                build_vector(collection, chroma_data_path)
+            print(f"✅ 知识库无变化，无需摄取。集合中的总文档数量: {collection.count()} "
+                  f"(耗时 {time.perf_counter() - start_time:.2f} 秒)")
+            return None
+
+        # 2. 流式管线: 删除旧块 -> 解析 -> 分割 -> 嵌入 -> 分批写入
+        text_splitter = make_text_splitter()
+        deduplicator = None
+        if settings.ingest_dedup_enabled:
+            deduplicator = DedupIndex.load(
+                dedup_index_path,
+                threshold=settings.ingest_dedup_threshold,
+                num_perm=settings.ingest_dedup_num_perm,
+                bands=settings.ingest_dedup_bands,
+            )
+        pipeline = IngestPipeline(
+            collection=collection,
+            manifest=manifest,
+            text_splitter=text_splitter,
+            parsing_pool=ParsingPool(workers=args.workers, timeout=args.timeout),
+            embedding_engine_factory=embedding_engine_factory,
+            journal_path=journal_path,
+            batch_size=args.batch_size,
+            deduplicator=deduplicator,
         )
+        if pipeline.journal.committed:
+            print("♻️ 检测到上次中断的摄取，已提交的块将被跳过。")
+        print(f"💾 将块流式写入 ChromaDB 集合: {args.collection}...")
+        try:
+            result = pipeline.run(diff)
+        except Exception as e:
+            print(f"❌ 摄取过程中出错: {e}")
+            raise
+
+        if result.chunks_written or result.chunks_deleted or lexical_index_missing:
+            build_lexical(collection, chroma_data_path)
+        if build_vector_index_enabled and (result.chunks_written or result.chunks_deleted or result.metadata_updated or vector_index_missing):
+            build_vector(collection, chroma_data_path)
+
+        if diff.to_ingest:
+            print(f"📚 解析统计: {pipeline.parsing_pool.stats.format()}")
+        if result.embedding_stats is not None:
+            print(f"⚡ 嵌入吞吐: {result.embedding_stats.format()}")
 
         # 获取集合的实际文档数量进行确认
-        document_count = vector_store._collection.count()
-        print(f"✅ 摄取完成! 集合中的总文档数量: {document_count}")
-        
+        document_count = collection.count()
+        expected_count = sum(len(record.chunk_ids) for record in manifest.records.values())
+        print("✅ 摄取完成!")
+        print(f"   新增文件: {len(diff.added)}, 修改文件: {len(diff.modified)}, 删除文件: {len(diff.removed)}, "
+              f"未变化: {len(diff.unchanged) + len(diff.touched)}")
+        print(f"   写入块: {result.chunks_written} ({result.batches} 批), 恢复跳过: {result.chunks_resumed}, "
+              f"删除块: {result.chunks_deleted}, 集合中的总文档数量: {document_count}")
+        if deduplicator is not None:
+            print(f"🧬 近重复去重: 移除 {result.chunks_deduplicated} 个块 (去重耗时 {result.dedup_seconds:.2f} 秒, "
+                  f"估计节省嵌入 {result.embedding_seconds_saved:.2f} 秒), 更新 {result.metadata_updated} 个代表块的来源, "
+                  f"代表块总数 {len(deduplicator)}")
+        if result.failed_files:
+            print(f"⚠️ {len(result.failed_files)} 个文件解析失败或超时，已隔离 (修改文件或使用 --retry-quarantined 重试): "
+                  f"{', '.join(result.failed_files)}")
+        if diff.quarantined:
+            print(f"ℹ️ 跳过 {len(diff.quarantined)} 个内容未变的隔离文件")
+        print(f"⏱️ 耗时 {time.perf_counter() - start_time:.2f} 秒")
+
         # 验证数据完整性
-        if document_count != len(chunks):
-            print(f"⚠️ 警告: 预期 {len(chunks)} 个文档但找到 {document_count} 个")
-        
-    except Exception as e:
-        print(f"❌ 摄取过程中出错: {e}")
-        raise
+        if document_count != expected_count:
+            print(f"⚠️ 警告: 预期 {expected_count} 个文档但找到 {document_count} 个")
+        return result
+    finally:
+        release_persistent_client(client, chroma_data_path)
+
+def main():
+    run_ingest(parse_args())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# 与 scripts/ 相同: 将项目根目录添加到 sys.path，以 backend.app.* 导入
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Settings 要求提供 GEMINI_API_KEY；测试不调用 LLM，给一个占位值即可导入 backend.app.core.config
+os.environ.setdefault("GEMINI_API_KEY", "test")
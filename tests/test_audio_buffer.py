@@ -0,0 +1,58 @@
+import numpy as np
+
+from desktop_app.audio_buffer import AudioRingBuffer
+
+
+def _frames(start: int, count: int, channels: int = 1) -> np.ndarray:
+    return np.arange(start, start + count, dtype=np.float32).repeat(channels).reshape(-1, channels)
+
+
+def test_write_view_consume():
+    buf = AudioRingBuffer(8)
+    buf.write(_frames(0, 5))
+    assert len(buf) == 5
+    np.testing.assert_array_equal(buf.view(3)[:, 0], [0, 1, 2])
+    buf.consume(3)
+    np.testing.assert_array_equal(buf.view()[:, 0], [3, 4])
+    buf.clear()
+    assert len(buf) == 0 and buf.view().shape == (0, 1)
+
+
+def test_wraparound_view_is_contiguous_slice():
+    buf = AudioRingBuffer(8)
+    buf.write(_frames(0, 6))
+    buf.consume(5)
+    # 写入跨过底层数组末尾
+    buf.write(_frames(6, 6))
+    view = buf.view()
+    np.testing.assert_array_equal(view[:, 0], np.arange(5, 12))
+    assert np.shares_memory(view, buf._data)
+
+
+def test_overflow_drops_oldest_frames():
+    buf = AudioRingBuffer(8, channels=2)
+    buf.write(_frames(0, 6, 2))
+    buf.write(_frames(6, 5, 2))
+    assert len(buf) == 8 and buf.dropped == 3
+    np.testing.assert_array_equal(buf.view()[:, 1], np.arange(3, 11))
+
+    # 单次写入超过容量时只保留最新的 capacity 帧
+    buf.write(_frames(100, 20, 2))
+    assert len(buf) == 8 and buf.dropped == 3 + 8 + 12
+    np.testing.assert_array_equal(buf.view()[:, 0], np.arange(112, 120))
+
+
+def test_many_wraps_match_reference():
+    rng = np.random.default_rng(0)
+    buf = AudioRingBuffer(16)
+    expected = []
+    for step in range(200):
+        chunk = rng.standard_normal((int(rng.integers(1, 10)), 1)).astype(np.float32)
+        buf.write(chunk)
+        expected.extend(chunk[:, 0])
+        expected = expected[-16:]
+        if step % 3 == 0:
+            taken = int(rng.integers(0, len(buf) + 1))
+            buf.consume(taken)
+            expected = expected[taken:]
+        np.testing.assert_array_equal(buf.view()[:, 0], expected)
@@ -0,0 +1,138 @@
+import io
+import time
+import wave
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.app.api import interview
+from backend.app.core.config import settings
+from backend.app.main import app
+from backend.app.services.audio_service import AudioService, TranscriptionQueueFull, decode_audio_bytes
+
+
+class _Loader:
+    def __init__(self, service):
+        self.service = service
+
+    async def aget(self):
+        return self.service
+
+
+def _service(monkeypatch, window_ms=0, max_batch_size=8, max_queue=4, models=1):
+    """不加载 whisper 的 AudioService: 每个 "模型" 记录它处理过的批次，转录结果为样本数。"""
+    monkeypatch.setattr(settings, "stt_batch_window_ms", window_ms)
+    monkeypatch.setattr(settings, "stt_max_batch_size", max_batch_size)
+    monkeypatch.setattr(settings, "stt_max_queue", max_queue)
+    service = AudioService.__new__(AudioService)
+    service.use_fp16 = False
+    service.batches = []
+    service._transcribe_batch = lambda model, audios: (
+        service.batches.append(len(audios)) or [f"{len(audio)} samples" for audio in audios]
+    )
+    service._start_scheduler([object() for _ in range(models)])
+    return service
+
+
+def _wav(samples: int, rate: int = 16000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.zeros(samples, np.int16).tobytes())
+    return buf.getvalue()
+
+
+class _Upload:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def read(self):
+        return self.data
+
+
+def test_decodes_16k_mono_wav_in_memory():
+    samples = np.array([0, 16384, -32768, 32767], np.int16)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(samples.tobytes())
+    audio = decode_audio_bytes(buf.getvalue())
+    assert audio.dtype == np.float32
+    np.testing.assert_allclose(audio, samples / 32768.0)
+
+
+def test_upload_transcription_does_not_block_the_event_loop(monkeypatch):
+    service = _service(monkeypatch)
+    release = threading.Event()
+    transcribe = service._transcribe_batch
+
+    def slow_transcribe(model, audios):
+        release.wait(5)
+        return transcribe(model, audios)
+
+    service._transcribe_batch = slow_transcribe
+
+    async def main():
+        task = asyncio.create_task(service.transcribe_upload(_Upload(_wav(1600))))
+        # 转录在批处理线程中进行，事件循环仍然可以调度其他协程
+        ticks = 0
+        started = time.monotonic()
+        while time.monotonic() - started < 0.2:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert not task.done() and service.queue_stats()["pending"] == 1
+        release.set()
+        return ticks, await task
+
+    ticks, text = asyncio.run(main())
+    assert ticks >= 5
+    assert text == "1600 samples"
+    assert service.queue_stats()["pending"] == 0
+
+
+def test_requests_within_the_window_share_a_batch(monkeypatch):
+    service = _service(monkeypatch, window_ms=300, max_batch_size=3)
+    futures = [service.submit(np.zeros(100 + i, np.float32)) for i in range(5)]
+    # 每个请求拿到自己的结果，而不是同批中其他请求的
+    assert [future.result(timeout=5) for future in futures] == [f"{100 + i} samples" for i in range(5)]
+    # 窗口内到达的 5 个请求按 max_batch_size 切成 3 + 2
+    assert service.batches == [3, 2]
+    stats = service.queue_stats()
+    assert stats["batch_size_distribution"] == {2: 1, 3: 1}
+    assert stats["queue_delay_ms"]["count"] == 5
+
+
+def test_lone_request_is_not_held_past_the_window(monkeypatch):
+    service = _service(monkeypatch, window_ms=20)
+    assert service.transcribe_array(np.zeros(10, np.float32)) == "10 samples"
+    assert service.batches == [1]
+
+
+def test_admission_limit_raises_when_full(monkeypatch):
+    service = _service(monkeypatch, max_queue=1)
+    with service.admit(), service.admit():
+        with pytest.raises(TranscriptionQueueFull):
+            with service.admit():
+                pass
+        assert service.queue_stats()["pending"] == 2
+    assert service.queue_stats()["pending"] == 0
+
+
+def test_full_queue_returns_429(monkeypatch):
+    service = _service(monkeypatch, max_queue=0)
+    monkeypatch.setattr(interview, "audio_service_loader", _Loader(service))
+    client = TestClient(app)
+    with service.admit():
+        response = client.post(
+            "/api/v1/chat/audio", files={"audio_file": ("q.wav", _wav(1600), "audio/wav")}, data={"model_provider": "gemini"},
+        )
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+    assert service.batches == []
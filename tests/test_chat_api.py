@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.language_models import FakeStreamingListLLM
+
+from backend.app.api import interview
+from backend.app.core.config import settings
+from backend.app.main import app
+from backend.app.services.llm_service import llm_registry
+from backend.app.services.rag_service import RAGService
+
+STUB_PROVIDER = "stub"
+
+
+class _Embedding:
+    """固定维度的假嵌入，不加载模型。"""
+    device = "cpu"
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0, 0.0]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class _CollectionCache:
+    def __init__(self, service):
+        self.service = service
+
+    async def aget(self, collection, record=True):
+        return self.service
+
+
+def _parse_sse(text: str) -> list:
+    """按 SSE 规范拆分事件: 事件之间以空行分隔，每个事件是 event 行和 JSON 编码的 data 行。"""
+    events = []
+    for block in text.split("\n\n"):
+        if not block:
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        assert set(fields) == {"event", "data"}
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "semantic_cache_enabled", False)
+    monkeypatch.setattr(settings, "prefetch_enabled", False)
+    service = RAGService(str(tmp_path), embedding_function=_Embedding(), collection_name="test_kb")
+    monkeypatch.setattr(interview, "collection_cache", _CollectionCache(service))
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def client():
+    # 不进入 with 块: 不触发 lifespan (模型预热、快照轮询)
+    return TestClient(app)
+
+
+def test_text_stream_frames_sources_tokens_and_done(service, client, monkeypatch):
+    llm_registry.register(STUB_PROVIDER, FakeStreamingListLLM(responses=["<think>plan</think>RRF merges\nrankings."]))
+    monkeypatch.setattr(service, "_retrieve_context", lambda *args: ("context", "notes/rrf.md", None))
+
+    response = client.post("/api/v1/chat/text/stream", data={"question": "what is rrf?", "model_provider": STUB_PROVIDER})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+
+    events = _parse_sse(response.text)
+    assert events[0] == ("sources", "notes/rrf.md")
+    assert events[-1] == ("done", "")
+    tokens = [data for event, data in events[1:-1]]
+    assert {event for event, _ in events[1:-1]} == {"token"}
+    # <think> 块被过滤，换行符经 JSON 编码后不会打断 SSE 帧
+    assert "".join(tokens) == "RRF merges\nrankings."
+
+
+def test_text_stream_reports_errors_as_an_event(service, client, monkeypatch):
+    def failing_retrieval(*_args):
+        raise RuntimeError("Chroma is unavailable")
+
+    monkeypatch.setattr(service, "_retrieve_context", failing_retrieval)
+    response = client.post("/api/v1/chat/text/stream", data={"question": "what is bm25?", "model_provider": STUB_PROVIDER})
+    events = _parse_sse(response.text)
+    assert [event for event, _ in events] == ["error"]
+    assert "Chroma is unavailable" in events[0][1]
+
+
+def test_batch_results_arrive_in_completion_order_with_their_index(service, client, monkeypatch):
+    questions = ["slow question", "no context", "fast question", "medium question"]
+    delays = {"slow question": 0.3, "fast question": 0.0, "medium question": 0.15}
+    running = {"now": 0, "peak": 0}
+
+    def retrieve_contexts(batch, vectors, model_provider=None):
+        assert batch == ["slow question", "no context", "fast question", "medium question"]
+        return [
+            (None, None, {"answer": "no context found", "sources": "No sources found."}) if q == "no context"
+            else (f"context for {q}", f"{q}.md", None)
+            for q in batch
+        ]
+
+    async def generate(question, model_provider, formatted_context, sources_text, question_vector=None):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(delays[question])
+        running["now"] -= 1
+        return {"answer": f"answer to {question} from {formatted_context}", "sources": sources_text}
+
+    monkeypatch.setattr(service, "_retrieve_contexts", retrieve_contexts)
+    monkeypatch.setattr(service, "_generate", generate)
+    response = client.post("/api/v1/chat/batch", json={
+        "questions": questions, "model_provider": STUB_PROVIDER, "max_concurrency": 2,
+    })
+    assert response.status_code == 200
+    events = _parse_sse(response.text)
+    results = [data for event, data in events if event == "result"]
+
+    # 无需生成的回退结果最先返回，其余按完成顺序返回，每个结果携带原问题的下标
+    assert [result["index"] for result in results] == [1, 2, 3, 0]
+    for result in results:
+        assert result["question"] == questions[result["index"]]
+        assert result["cached"] is False
+    assert results[1]["answer"] == "answer to fast question from context for fast question"
+    assert results[1]["sources"] == "fast question.md"
+    assert running["peak"] == 2
+    assert events[-1][0] == "done" and events[-1][1]["questions"] == 4
+
+
+def test_batch_rejects_empty_questions(client):
+    response = client.post("/api/v1/chat/batch", json={"questions": ["ok", " "]})
+    assert response.status_code == 400
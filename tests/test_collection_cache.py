@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from backend.app.services import collection_cache as collection_cache_module
+from backend.app.services.collection_cache import CollectionCache
+from backend.app.services.knowledge_bases import UnknownCollection, collection_data_root
+
+_MB = 1024 * 1024
+
+
+class _RAGService:
+    """只提供缓存用到的接口，不打开 Chroma、不加载嵌入模型。"""
+
+    def __init__(self, data_root, collection_name):
+        self.data_root = data_root
+        self.collection_name = collection_name
+
+    def estimate_memory_bytes(self):
+        return 40 * _MB
+
+
+class _SnapshotSwitcher:
+    def watch(self, collection, loader, data_root):
+        pass
+
+
+@pytest.fixture
+def closed(monkeypatch):
+    closed = []
+    monkeypatch.setattr(collection_cache_module, "RAGService", _RAGService)
+    monkeypatch.setattr(collection_cache_module, "snapshot_switcher", _SnapshotSwitcher())
+    monkeypatch.setattr(collection_cache_module, "close_later", lambda service, delay_sec: closed.append(service))
+    return closed
+
+
+def _cache(tmp_path, names, max_mb=1000, max_loaded=2):
+    for name in names:
+        os.makedirs(collection_data_root(name, str(tmp_path)))
+    return CollectionCache(str(tmp_path), max_bytes=max_mb * _MB, max_loaded=max_loaded, grace_sec=0)
+
+
+def _loaded(cache):
+    return sorted(name for name, entry in cache.stats()["collections"].items() if entry["state"] == "ready")
+
+
+def test_evicts_least_recently_used_by_count(tmp_path, closed):
+    cache = _cache(tmp_path, ["alpha", "beta", "gamma"])
+    alpha = cache.get("alpha")
+    beta = cache.get("beta")
+    assert cache.get("alpha") is alpha  # 命中，alpha 成为最近使用
+    cache.get("gamma")
+
+    assert _loaded(cache) == ["alpha", "gamma"]
+    assert closed == [beta]
+    stats = cache.stats()["collections"]
+    assert stats["beta"]["state"] == "evicted" and stats["beta"]["evictions"] == 1
+    assert stats["alpha"]["hits"] == 1 and stats["alpha"]["misses"] == 1
+
+    # 再次访问被淘汰的集合时重新打开新实例，并淘汰此时最久未使用的 alpha
+    reopened = cache.get("beta")
+    assert reopened is not beta
+    assert _loaded(cache) == ["beta", "gamma"]
+    assert closed == [beta, alpha]
+
+
+def test_evicts_by_memory_budget_but_keeps_the_new_collection(tmp_path, closed):
+    cache = _cache(tmp_path, ["alpha", "beta", "gamma"], max_mb=100, max_loaded=10)
+    cache.get("alpha")
+    cache.get("beta")
+    assert _loaded(cache) == ["alpha", "beta"] and cache.stats()["loaded_mb"] == 80
+
+    cache.get("gamma")
+    assert _loaded(cache) == ["beta", "gamma"]
+    assert cache.stats()["loaded_mb"] == 80
+
+    # 单个集合超过预算时也不会淘汰刚打开的集合
+    cache.max_bytes = 10 * _MB
+    cache.get("alpha")
+    assert _loaded(cache) == ["alpha"]
+
+
+def test_unknown_collection(tmp_path, closed):
+    cache = _cache(tmp_path, [])
+    with pytest.raises(UnknownCollection):
+        cache.get("missing")
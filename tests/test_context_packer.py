@@ -0,0 +1,66 @@
+import json
+
+from langchain_core.documents import Document
+
+from backend.app.services.context_packer import pack_context, estimate_tokens, _overlap, MIN_OVERLAP_CHARS
+
+# 40 个字符的重叠，足以超过 MIN_OVERLAP_CHARS
+OVERLAP = "shared overlap text between two chunks.."
+FIRST = "The first chunk introduces the topic. " + OVERLAP
+SECOND = OVERLAP + " The second chunk continues the explanation."
+
+
+def _doc(text, chunk_id, source="/kb/guide.pdf", page=1, **metadata):
+    return Document(page_content=text, metadata=dict(metadata, source=source, page=page), id=chunk_id)
+
+
+def test_overlap_detection():
+    assert _overlap(FIRST, SECOND) == len(OVERLAP)
+    assert _overlap(SECOND, FIRST) == 0
+    # 太短的偶然重合不算重叠
+    assert _overlap("abc" + "x" * (MIN_OVERLAP_CHARS - 1), "x" * (MIN_OVERLAP_CHARS - 1) + "def") == 0
+
+
+def test_adjacent_chunks_merge_without_duplicated_overlap():
+    # 检索排名与原文顺序相反: 合并时按块序号排列
+    packed = pack_context([_doc(SECOND, "abc-00002"), _doc(FIRST, "abc-00001")], budget_tokens=1000)
+    assert packed.chunks == 2
+    assert packed.segments == 1
+    assert packed.context.count(OVERLAP) == 1
+    assert FIRST.replace(OVERLAP, "") in packed.context.split(OVERLAP)[0]
+    assert packed.context.endswith(SECOND[len(OVERLAP):])
+    assert packed.tokens_saved > 0
+
+
+def test_contained_and_identical_chunks_are_skipped():
+    docs = [_doc(FIRST, "abc-00001"), _doc(FIRST, "abc-00001"), _doc(OVERLAP, "abc-00003")]
+    packed = pack_context(docs, budget_tokens=1000)
+    assert packed.chunks == 1
+    assert packed.context.count(OVERLAP) == 1
+
+
+def test_different_pages_stay_separate_and_ordered_by_rank():
+    docs = [_doc("Page two content " * 5, "abc-00007", page=2), _doc("Page one content " * 5, "abc-00001", page=1)]
+    packed = pack_context(docs, budget_tokens=1000)
+    assert packed.segments == 2
+    assert packed.context.index("Page: 2") < packed.context.index("Page: 1")
+    assert packed.sources == "- guide.pdf, Page: 1\n- guide.pdf, Page: 2"
+
+
+def test_budget_keeps_top_chunk_and_skips_the_rest():
+    big = "word " * 400
+    docs = [_doc(big, "a-00001", source="/kb/a.txt"), _doc("small relevant chunk", "b-00001", source="/kb/b.txt")]
+    packed = pack_context(docs, budget_tokens=10)
+    # 排名第一的块即使超出预算也保留
+    assert packed.chunks == 1
+    assert "a.txt" in packed.sources and "b.txt" not in packed.sources
+
+    roomy = pack_context(docs, budget_tokens=estimate_tokens(big) + 100)
+    assert roomy.chunks == 2
+
+
+def test_duplicate_sources_are_cited():
+    doc = _doc(FIRST, "abc-00001", duplicate_sources=json.dumps([["/kb/copy.pdf", 3]]))
+    packed = pack_context([doc], budget_tokens=1000)
+    assert "- copy.pdf, Page: 3" in packed.sources
+    assert "- guide.pdf, Page: 1" in packed.sources
@@ -0,0 +1,95 @@
+import json
+import random
+
+import pytest
+
+from backend.app.ingestion.dedup import DedupIndex, MinHasher, _shingle_hashes
+from backend.app.ingestion.manifest import ManifestDiff
+
+# 与默认配置一致 (INGEST_DEDUP_*)
+THRESHOLD, NUM_PERM, BANDS = 0.85, 128, 16
+
+random.seed(0)
+WORDS = [f"w{i}" for i in range(500)]
+BASE = " ".join(random.choice(WORDS) for _ in range(300))
+
+
+def _jaccard(a: str, b: str) -> float:
+    sa, sb = set(_shingle_hashes(a).tolist()), set(_shingle_hashes(b).tolist())
+    return len(sa & sb) / len(sa | sb)
+
+
+def _edit(text: str, fraction: float) -> str:
+    words = text.split()
+    rng = random.Random(1)
+    for i in rng.sample(range(len(words)), int(len(words) * fraction)):
+        words[i] = "x" + words[i]
+    return " ".join(words)
+
+
+def _index(tmp_path, threshold=THRESHOLD):
+    return DedupIndex(str(tmp_path / "dedup_index.npz"), threshold, NUM_PERM, BANDS)
+
+
+def test_signature_estimates_jaccard():
+    hasher = MinHasher(NUM_PERM)
+    other = _edit(BASE, 0.1)
+    estimate = float((hasher.signature(BASE) == hasher.signature(other)).mean())
+    assert estimate == pytest.approx(_jaccard(BASE, other), abs=0.1)
+    assert hasher.signature("   ") is None
+    # 大小写和空白不影响签名
+    assert (hasher.signature("Hello   World") == hasher.signature("hello world")).all()
+
+
+def test_near_duplicate_is_merged_above_threshold(tmp_path):
+    index = _index(tmp_path)
+    assert index.match_or_add("a-00000", "a.txt", BASE, {"source": "/kb/a.txt", "page": 1}) is None
+    near = _edit(BASE, 0.01)
+    assert _jaccard(BASE, near) > THRESHOLD
+    assert index.match_or_add("b-00000", "b.txt", near, {"source": "/kb/b.txt", "page": 2}) == "a-00000"
+    assert len(index) == 1
+    metadata = index.duplicate_metadata("a-00000")
+    assert json.loads(metadata["duplicate_sources"]) == [["/kb/b.txt", "2"]]
+    assert metadata["duplicate_count"] == 1
+    assert index.take_dirty() == ["a-00000"]
+
+
+def test_dissimilar_chunk_below_threshold_is_kept(tmp_path):
+    index = _index(tmp_path)
+    index.match_or_add("a-00000", "a.txt", BASE, {})
+    edited = _edit(BASE, 0.4)
+    assert _jaccard(BASE, edited) < 0.6
+    assert index.match_or_add("b-00000", "b.txt", edited, {}) is None
+    assert index.match_or_add("c-00000", "c.txt", "completely unrelated text about databases", {}) is None
+    assert len(index) == 3
+
+    # 低于阈值的块保留, 降低阈值后才会被合并 (留出签名估计误差的余量)
+    close = _edit(BASE, 0.15)
+    assert 0.7 < _jaccard(BASE, close) < THRESHOLD - 0.05
+    assert index.match_or_add("d-00000", "d.txt", close, {}) is None
+    lenient = _index(tmp_path, threshold=0.7)
+    lenient.match_or_add("a-00000", "a.txt", BASE, {})
+    assert lenient.match_or_add("d-00000", "d.txt", close, {}) == "a-00000"
+
+
+def test_save_load_and_expand_diff(tmp_path):
+    index = _index(tmp_path)
+    index.match_or_add("a-00000", "a.txt", BASE, {"source": "/kb/a.txt", "page": 1})
+    index.match_or_add("b-00000", "b.txt", BASE, {"source": "/kb/b.txt", "page": 1})
+    index.save()
+
+    loaded = DedupIndex.load(index.path, THRESHOLD, NUM_PERM, BANDS)
+    assert len(loaded) == 1
+    assert loaded.dependents({"a.txt"}) == {"b.txt"}
+
+    # a.txt 被删除: 被它吸收的 b.txt 需要重新摄取
+    class _Manifest:
+        records = {"a.txt": None, "b.txt": None}
+
+    diff = ManifestDiff(removed=["a.txt"], unchanged=["b.txt"], file_stats={"b.txt": (1, 1.0, "sha")})
+    assert loaded.expand_diff(diff, _Manifest()) == ["b.txt"]
+    assert diff.modified == ["b.txt"] and diff.unchanged == []
+    assert len(loaded) == 0
+
+    # 签名参数变化时不复用旧索引
+    assert len(DedupIndex.load(index.path, THRESHOLD, 64, BANDS)) == 0
@@ -0,0 +1,118 @@
+import math
+
+import pytest
+
+from backend.app.services.lexical_index import LexicalIndex, LexicalIndexBuilder, tokenize, BM25_K1, BM25_B
+from backend.app.services.hybrid_retriever import reciprocal_rank_fusion
+
+DOCS = {
+    "d1": "Node.js uses an event loop for asynchronous I/O.",
+    "d2": "Python uses a global interpreter lock; the event loop lives in asyncio.",
+    "d3": "C++ templates and C# generics compared.",
+    "d4": "事件循环是异步编程的核心。",
+}
+
+
+def _build(tmp_path, docs=DOCS):
+    builder = LexicalIndexBuilder()
+    for chunk_id, text in docs.items():
+        builder.add(chunk_id, text)
+    builder.write(str(tmp_path))
+    return LexicalIndex.open(str(tmp_path))
+
+
+def _reference_bm25(docs, query):
+    """按 BM25 公式逐项计算的参考得分。"""
+    tokenized = {chunk_id: tokenize(text) for chunk_id, text in docs.items()}
+    avg_len = sum(len(tokens) for tokens in tokenized.values()) / len(tokenized)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for tokens in tokenized.values() if term in tokens)
+        if not df:
+            continue
+        idf = math.log1p((len(docs) - df + 0.5) / (df + 0.5))
+        for chunk_id, tokens in tokenized.items():
+            tf = tokens.count(term)
+            if tf:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores
+
+
+def test_tokenize_keeps_technical_terms():
+    tokens = tokenize("Node.js vs C++ and C# on GPT-4")
+    for term in ("node.js", "node", "js", "c++", "c#", "gpt-4", "gpt", "4"):
+        assert term in tokens
+    assert tokenize("事件循环") == ["事件", "件循", "循环"]
+
+
+@pytest.mark.parametrize("query", ["event loop", "node.js asyncio", "c++ generics", "事件循环"])
+def test_bm25_scores_match_reference(tmp_path, query):
+    index = _build(tmp_path)
+    expected = _reference_bm25(DOCS, query)
+    results = index.search(query, k=10)
+    assert {chunk_id for chunk_id, _ in results} == set(expected)
+    for chunk_id, score in results:
+        assert score == pytest.approx(expected[chunk_id], rel=1e-5)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_bm25_top_k_and_unknown_terms(tmp_path):
+    index = _build(tmp_path)
+    assert len(index.search("event loop uses", k=1)) == 1
+    assert index.search("kubernetes", k=5) == []
+
+
+def test_reopen_after_rebuild_picks_new_version(tmp_path):
+    first = _build(tmp_path)
+    second = _build(tmp_path, {"x": "kubernetes operators"})
+    assert second.version != first.version
+    assert LexicalIndex.open(str(tmp_path)).search("kubernetes", k=5)[0][0] == "x"
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]], rrf_k=60)
+    scores = dict(fused)
+    assert [item for item, _ in fused][:2] == ["a", "c"]
+    assert scores["a"] == pytest.approx(1 / 61 + 1 / 62)
+    assert scores["c"] == pytest.approx(1 / 63 + 1 / 61)
+    assert scores["d"] == pytest.approx(1 / 63)
+    assert scores["b"] > scores["d"]
+    assert reciprocal_rank_fusion([]) == []
+
+
+class _Collection:
+    """按固定顺序返回稠密检索结果的最小集合实现。"""
+
+    def __init__(self, docs, dense_order):
+        self.docs = docs
+        self.dense_order = dense_order
+        self.fetched = []
+
+    def query(self, query_embeddings, n_results, include):
+        ids = self.dense_order[:n_results]
+        return {
+            "ids": [ids for _ in query_embeddings],
+            "documents": [[self.docs[i] for i in ids] for _ in query_embeddings],
+            "metadatas": [[{"source": i} for i in ids] for _ in query_embeddings],
+        }
+
+    def get(self, ids, include):
+        self.fetched.extend(ids)
+        return {"ids": ids, "documents": [self.docs[i] for i in ids], "metadatas": [{"source": i} for i in ids]}
+
+
+def test_hybrid_search_fuses_dense_and_lexical(tmp_path):
+    from backend.app.services.hybrid_retriever import HybridRetriever
+
+    collection = _Collection(DOCS, dense_order=["d4", "d2"])
+    retriever = HybridRetriever(
+        collection=collection, embedding_function=None, lexical_index=_build(tmp_path), k=3, candidate_k=2,
+    )
+    docs = retriever.search("node.js event loop", query_vector=[0.0])
+    ids = [doc.id for doc in docs]
+    # d2 同时出现在两路结果中排在最前；d1 只由 BM25 命中，需要另外取回
+    assert ids[0] == "d2"
+    assert set(ids) == {"d1", "d2", "d4"}
+    assert collection.fetched == ["d1"]
+    assert all("rrf_score" in doc.metadata for doc in docs)
@@ -0,0 +1,32 @@
+import asyncio
+
+from backend.app.core.config import settings
+from backend.app.services.llm_service import LLMRegistry
+
+
+class _LLM:
+    def __init__(self):
+        self.calls = []
+
+    async def ainvoke(self, prompt):
+        self.calls.append(prompt)
+        return "pong"
+
+
+def test_gemini_warm_up_does_not_call_the_api_by_default(monkeypatch):
+    monkeypatch.setattr(settings, "llm_warmup_ping", False)
+    registry = LLMRegistry()
+    llm = _LLM()
+    registry.register("gemini", llm)
+    asyncio.run(registry.warm_up("gemini"))
+    assert llm.calls == []
+    assert registry.get_llm("gemini") is llm
+
+
+def test_gemini_warm_up_pings_when_enabled(monkeypatch):
+    monkeypatch.setattr(settings, "llm_warmup_ping", True)
+    registry = LLMRegistry()
+    llm = _LLM()
+    registry.register("gemini", llm)
+    asyncio.run(registry.warm_up("gemini"))
+    assert llm.calls == ["ping"]
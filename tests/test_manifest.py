@@ -0,0 +1,84 @@
+import os
+
+from backend.app.ingestion.manifest import IngestManifest, file_sha256
+
+
+def _manifest(tmp_path):
+    kb = tmp_path / "kb"
+    kb.mkdir(exist_ok=True)
+    return IngestManifest(str(tmp_path / "manifest.json"), str(kb), "model", "collection"), kb
+
+
+def _record_all(manifest, diff):
+    for rel_path in diff.to_ingest:
+        size, mtime, sha = diff.file_stats[rel_path]
+        manifest.update(rel_path, size, mtime, sha, [f"{rel_path}-0"])
+
+
+def test_scan_classifies_changes(tmp_path):
+    manifest, kb = _manifest(tmp_path)
+    (kb / "a.txt").write_text("alpha", encoding="utf-8")
+    (kb / "b.txt").write_text("beta", encoding="utf-8")
+    (kb / "c.txt").write_text("gamma", encoding="utf-8")
+    (kb / "sub").mkdir()
+    (kb / "sub" / "d.txt").write_text("delta", encoding="utf-8")
+    (kb / "ignored.md").write_text("not supported", encoding="utf-8")
+
+    diff = manifest.scan()
+    assert sorted(diff.added) == ["a.txt", "b.txt", "c.txt", "sub/d.txt"]
+    _record_all(manifest, diff)
+
+    # a: 内容修改；b: 只改修改时间；c: 删除；e: 新增；d: 未变化
+    (kb / "a.txt").write_text("alpha v2", encoding="utf-8")
+    stat = os.stat(kb / "b.txt")
+    os.utime(kb / "b.txt", (stat.st_atime, stat.st_mtime + 10))
+    (kb / "c.txt").unlink()
+    (kb / "e.txt").write_text("epsilon", encoding="utf-8")
+
+    diff = manifest.scan()
+    assert diff.modified == ["a.txt"]
+    assert diff.touched == ["b.txt"]
+    assert diff.removed == ["c.txt"]
+    assert diff.added == ["e.txt"]
+    assert diff.unchanged == ["sub/d.txt"]
+    assert diff.to_ingest == ["a.txt", "e.txt"]
+    assert diff.has_changes
+
+
+def test_unchanged_scan_has_no_changes(tmp_path):
+    manifest, kb = _manifest(tmp_path)
+    (kb / "a.txt").write_text("alpha", encoding="utf-8")
+    _record_all(manifest, manifest.scan())
+    diff = manifest.scan()
+    assert not diff.has_changes
+    assert diff.unchanged == ["a.txt"]
+
+
+def test_quarantined_file_is_skipped_until_it_changes(tmp_path):
+    manifest, kb = _manifest(tmp_path)
+    path = kb / "broken.txt"
+    path.write_text("broken", encoding="utf-8")
+    manifest.add_quarantine("broken.txt", file_sha256(str(path)), "timeout")
+
+    diff = manifest.scan()
+    assert diff.quarantined == ["broken.txt"] and not diff.added
+    assert manifest.scan(retry_quarantined=True).added == ["broken.txt"]
+
+    path.write_text("fixed", encoding="utf-8")
+    assert manifest.scan().added == ["broken.txt"]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    manifest, kb = _manifest(tmp_path)
+    (kb / "a.txt").write_text("alpha", encoding="utf-8")
+    _record_all(manifest, manifest.scan())
+    manifest.save()
+
+    loaded, valid = IngestManifest.load(manifest.manifest_path, str(kb), "model", "collection")
+    assert valid
+    assert loaded.records["a.txt"].chunk_ids == ["a.txt-0"]
+    assert not loaded.scan().has_changes
+
+    # 嵌入模型变化时清单失效，需要完整重建
+    _, valid = IngestManifest.load(manifest.manifest_path, str(kb), "other-model", "collection")
+    assert not valid
@@ -0,0 +1,69 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.core import metrics
+from backend.app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    # 不进入 with 块: 不触发 lifespan (模型预热、快照轮询)
+    return TestClient(app)
+
+
+def _series(text: str, name: str, **labels) -> float:
+    wanted = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    for line in text.splitlines():
+        if line.startswith(name + "{") and wanted in line:
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_api_route_is_labelled_with_its_template(client):
+    before = _series(client.get("/metrics").text, "interview_http_requests_total", endpoint="/api/v1/status/live", status="200")
+    response = client.get("/api/v1/status/live")
+    assert response.status_code == 200 and response.json() == {"status": "ok"}
+
+    text = client.get("/metrics").text
+    assert _series(text, "interview_http_requests_total", endpoint="/api/v1/status/live", status="200") == before + 1
+    assert _series(text, "interview_http_request_duration_seconds_count", endpoint="/api/v1/status/live") >= 1
+    assert _series(text, "interview_http_requests_in_flight", endpoint="/api/v1/status/live") == 0
+
+
+def test_metrics_exposition_format(client):
+    client.get("/api/v1/status/live")
+    response = client.get("/metrics")
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    lines = response.text.splitlines()
+    assert "# TYPE interview_http_requests_total counter" in lines
+    assert "# TYPE interview_http_request_duration_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith("interview_http_request_duration_seconds_bucket{")
+               and 'endpoint="/api/v1/status/live"' in line]
+    # 每个桶一行，le 累计递增，最后是 +Inf
+    assert len(buckets) == len(metrics.DEFAULT_BUCKETS) + 1
+    assert 'le="+Inf"' in buckets[-1]
+    counts = [float(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts)
+    # /metrics 自身不计数
+    assert 'endpoint="/metrics"' not in response.text
+
+
+def test_path_parameters_and_unknown_paths():
+    inner = FastAPI()
+
+    @inner.get("/items/{item_id}")
+    def get_item(item_id: int):
+        metrics.observe_stage("lookup", 0.01)
+        return {"item_id": item_id}
+
+    inner.add_middleware(metrics.MetricsMiddleware, routes=[("", inner.routes)])
+    client = TestClient(inner)
+    assert client.get("/items/1").status_code == 200
+    assert client.get("/items/2").status_code == 200
+    assert client.get("/nope").status_code == 404
+
+    text = metrics.registry.render()
+    assert _series(text, "interview_http_requests_total", endpoint="/items/{item_id}", status="200") == 2
+    assert _series(text, "interview_http_requests_total", endpoint="unmatched", status="404") >= 1
+    assert _series(text, "interview_stage_duration_seconds_count", stage="lookup", endpoint="/items/{item_id}") == 2
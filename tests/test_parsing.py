@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from backend.app.ingestion.parsing import ParsingPool
+
+
+# 工作进程通过 spawn 启动，加载函数必须是模块级函数
+def _slow_load(file_path):
+    time.sleep(30)
+
+
+def _crash_load(file_path):
+    os._exit(1)
+
+
+def _write_files(tmp_path, count):
+    tasks = []
+    for i in range(count):
+        path = tmp_path / f"doc{i}.txt"
+        path.write_text(f"document {i}", encoding="utf-8")
+        tasks.append((path.name, str(path)))
+    return tasks
+
+
+def test_parses_all_files(tmp_path):
+    pool = ParsingPool(workers=2, timeout=30)
+    results = list(pool.imap(_write_files(tmp_path, 5)))
+    assert sorted(r.rel_path for r in results) == [f"doc{i}.txt" for i in range(5)]
+    assert all(r.ok and len(r.documents) == 1 for r in results)
+    assert pool.stats.files == 5 and pool.stats.failed == 0 and pool.stats.timed_out == 0
+
+
+def test_slow_consumer_does_not_time_out_finished_files(tmp_path):
+    # 解析很快，但下游每个结果都阻塞超过超时时间: 已完成的文件不能被当成超时
+    # (超时时间要覆盖工作进程的启动和导入)
+    pool = ParsingPool(workers=2, timeout=3)
+    results = []
+    for result in pool.imap(_write_files(tmp_path, 3)):
+        results.append(result)
+        time.sleep(3.5)
+    assert len(results) == 3
+    assert not any(r.timed_out for r in results)
+    assert all(r.ok for r in results)
+
+
+def test_timeout_quarantines_file(tmp_path):
+    pool = ParsingPool(workers=1, timeout=0.5, load=_slow_load)
+    results = list(pool.imap(_write_files(tmp_path, 2)))
+    assert len(results) == 2
+    assert all(r.timed_out and not r.ok for r in results)
+    assert pool.stats.timed_out == 2
+
+
+def test_crashed_worker_is_replaced(tmp_path):
+    pool = ParsingPool(workers=1, timeout=30, load=_crash_load)
+    results = list(pool.imap(_write_files(tmp_path, 3)))
+    assert len(results) == 3
+    assert all(r.error == "解析进程意外退出" and not r.timed_out for r in results)
+    assert pool.stats.failed == 3
@@ -0,0 +1,99 @@
+import time
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.app.services.prefetch import ContextPrefetcher, extract_candidates
+
+
+class _Service:
+    """RAGService 中预取用到的部分: 检索线程池、嵌入和批量检索。"""
+
+    def __init__(self, tmp_path, stage_sec: float = 0.0):
+        self.chroma_data_path = str(tmp_path)
+        self.stage_sec = stage_sec
+        self.embedding_function = self
+        self.searches = 0
+        self._executor = ThreadPoolExecutor(max_workers=4)
+
+    def embed_documents(self, texts):
+        time.sleep(self.stage_sec)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def _search_batch(self, questions, vectors):
+        self.searches += 1
+        return [[f"doc for {question}"] for question in questions]
+
+    @contextlib.asynccontextmanager
+    async def in_use(self):
+        yield self
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+
+def _prefetcher(service, **kwargs):
+    return ContextPrefetcher(service, min_interval_sec=0.0, max_concurrency=1, min_chars=3, **kwargs)
+
+
+def test_extract_candidates_newest_first():
+    text = "Tell me about yourself. What is BM25? what is bm25 ?\nHow does RRF work"
+    assert extract_candidates(text, 3, 3) == ["How does RRF work", "what is bm25", "Tell me about yourself"]
+
+
+def test_completed_prefetch_is_reused(tmp_path):
+    service = _Service(tmp_path)
+    prefetcher = _prefetcher(service)
+
+    async def main():
+        result = prefetcher.submit("s1", "What is BM25?")
+        await asyncio.sleep(0.1)
+        return result
+
+    result = asyncio.run(main())
+    assert result["accepted"] and result["candidates"] == 1
+    entry = prefetcher.lookup("what is bm25")
+    assert entry is not None and entry.docs == ["doc for What is BM25"]
+    assert prefetcher.lookup("unrelated question") is None
+
+
+def test_admission_counts_tasks_accepted_in_the_same_tick(tmp_path):
+    service = _Service(tmp_path, stage_sec=0.05)
+    prefetcher = _prefetcher(service)
+
+    async def main():
+        # 同一轮事件循环中提交: 任务尚未开始运行，名额也必须已被占用
+        first = prefetcher.submit("s1", "What is BM25?")
+        second = prefetcher.submit("s2", "How does RRF work?")
+        active = prefetcher.stats()["active"]
+        await asyncio.sleep(0.2)
+        third = prefetcher.submit("s2", "How does RRF work?")
+        await asyncio.sleep(0.2)
+        return first, second, active, third
+
+    first, second, active, third = asyncio.run(main())
+    assert first["accepted"] and active == 1
+    assert not second["accepted"] and second["reason"] == "busy"
+    assert third["accepted"]
+    assert prefetcher.stats()["active"] == 0 and prefetcher.counts["busy"] == 1
+
+
+def test_cancelled_prefetch_holds_slot_until_its_stage_finishes(tmp_path):
+    service = _Service(tmp_path, stage_sec=0.2)
+    prefetcher = _prefetcher(service)
+
+    async def main():
+        prefetcher.submit("s1", "What is BM25?")
+        await asyncio.sleep(0.05)
+        # 新窗口取消旧任务，但旧任务的嵌入仍在线程中运行
+        replaced = prefetcher.submit("s1", "How does RRF work?")
+        active_while_running = prefetcher.stats()["active"]
+        await asyncio.sleep(0.3)
+        return replaced, active_while_running
+
+    replaced, active_while_running = asyncio.run(main())
+    assert not replaced["accepted"] and replaced["reason"] == "busy"
+    assert active_while_running == 1
+    assert prefetcher.stats()["active"] == 0 and prefetcher.counts["cancelled"] == 1
+    # 被取消的任务在嵌入完成后不再检索
+    assert service.searches == 0
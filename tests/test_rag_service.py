@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+from backend.app.core.config import settings
+from backend.app.ingestion.manifest import bump_index_version
+from backend.app.services.rag_service import RAGService
+
+
+class _Embedding:
+    """固定维度的假嵌入，不加载模型。"""
+    device = "cpu"
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0, 0.0]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_index_version_change_invalidates_semantic_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "semantic_cache_enabled", True)
+    monkeypatch.setattr(settings, "index_version_poll_sec", 0.02)
+    service = RAGService(str(tmp_path), embedding_function=_Embedding(), collection_name="test_kb")
+    try:
+        vector = service.embedding_function.embed_query("what is rrf?")
+        service.answer_cache.store("gemini", "what is rrf?", vector, "answer", "sources")
+        assert service.answer_cache.lookup("gemini", vector)[0] is not None
+
+        # 另一个进程 (ingest.py --in-place) 提交了一批: 不必等到 COLLECTION_COUNT_REFRESH_SEC
+        bump_index_version(service.chroma_data_path)
+        assert _wait(lambda: service.answer_cache.lookup("gemini", vector)[0] is None, timeout=2.0)
+    finally:
+        service.close()
+
+
+def test_retrieval_failure_is_reported_not_raised(tmp_path, monkeypatch):
+    service = RAGService(str(tmp_path), embedding_function=_Embedding(), collection_name="test_kb")
+
+    def failing_retrieval(*_args):
+        raise RuntimeError("Chroma is unavailable")
+
+    monkeypatch.setattr(service, "_retrieve_context", failing_retrieval)
+
+    async def main():
+        answer = await service.invoke_chain("what is rrf?", "gemini")
+        events = [event async for event in service.stream_chain("what is bm25?", "gemini")]
+        return answer, events
+
+    try:
+        answer, events = asyncio.run(main())
+    finally:
+        service.close()
+    assert "Chroma is unavailable" in answer["answer"] and answer["sources"] == "N/A"
+    assert [event["event"] for event in events] == ["error"]
+    assert "Chroma is unavailable" in events[0]["data"]
+
+
+def test_retrieval_runs_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "semantic_cache_enabled", False)
+    service = RAGService(str(tmp_path), embedding_function=_Embedding(), collection_name="test_kb")
+    fallback = {"answer": "no context", "sources": "No sources found."}
+
+    def slow_retrieval(*_args):
+        # 同步检索 (Chroma / 嵌入) 阻塞 0.3 秒
+        time.sleep(0.3)
+        return None, None, fallback
+
+    monkeypatch.setattr(service, "_retrieve_context", slow_retrieval)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        answers = await asyncio.gather(*(service.invoke_chain(f"question {i}", "gemini") for i in range(2)))
+        ticking.cancel()
+        return ticks, answers
+
+    try:
+        started = time.perf_counter()
+        ticks, answers = asyncio.run(main())
+        elapsed = time.perf_counter() - started
+    finally:
+        service.close()
+    assert answers == [fallback, fallback]
+    # 检索期间事件循环照常调度，两个请求在检索线程池中并行
+    assert ticks >= 10
+    assert elapsed < 0.55
@@ -0,0 +1,175 @@
+import asyncio
+
+
+from backend.app.services.single_flight import SingleFlight, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  What is  a\tGIL? ") == normalize_question("what is a gil?")
+
+
+def test_do_coalesces_concurrent_calls():
+    async def main():
+        flight = SingleFlight("test")
+        calls = 0
+        release = asyncio.Event()
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return {"answer": 42}
+
+        waiters = [asyncio.create_task(flight.do("key", work)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters)
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(main())
+    assert calls == 1
+    assert all(result == {"answer": 42} for result in results)
+    assert (flight.leaders, flight.coalesced) == (1, 4)
+    assert flight.stats()["in_flight_calls"] == 0
+
+
+def test_do_runs_again_after_completion_and_shares_errors():
+    async def main():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        first = await asyncio.gather(flight.do("key", work), flight.do("key", work), return_exceptions=True)
+        second = await asyncio.gather(flight.do("key", work), return_exceptions=True)
+        return calls, first, second
+
+    calls, first, second = asyncio.run(main())
+    assert calls == 2
+    assert all(isinstance(result, ValueError) for result in first + second)
+
+
+def test_cancelled_caller_does_not_abort_shared_call():
+    async def main():
+        flight = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first
+
+    result, first = asyncio.run(main())
+    assert result == "done"
+    assert first.cancelled()
+
+
+def test_stream_fans_out_and_replays_to_late_subscribers():
+    async def main():
+        flight = SingleFlight("test")
+        produced = 0
+        gate = asyncio.Event()
+
+        async def events():
+            nonlocal produced
+            produced += 1
+            yield "a"
+            await gate.wait()
+            yield "b"
+            yield "c"
+
+        async def consume():
+            return [event async for event in flight.stream("key", events)]
+
+        early = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        # 加入时 "a" 已经产生，应先补发
+        late = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        gate.set()
+        return produced, await early, await late, flight
+
+    produced, early, late, flight = asyncio.run(main())
+    assert produced == 1
+    assert early == late == ["a", "b", "c"]
+    assert flight.stats()["in_flight_streams"] == 0
+
+
+def test_stream_cancels_producer_when_all_subscribers_leave():
+    async def main():
+        flight = SingleFlight("test")
+        cancelled = asyncio.Event()
+
+        async def events():
+            try:
+                yield "a"
+                await asyncio.sleep(10)
+                yield "b"
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        stream = flight.stream("key", events)
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        await asyncio.sleep(0)
+        return flight
+
+    flight = asyncio.run(main())
+    assert flight.stats()["in_flight_streams"] == 0
+
+
+def test_stream_broadcasts_producer_error():
+    async def main():
+        flight = SingleFlight("test")
+
+        async def failing():
+            yield {"event": "sources", "data": "s"}
+            await asyncio.sleep(0.02)
+            raise RuntimeError("retrieval failed")
+
+        async def consume():
+            return [event async for event in flight.stream("key", failing)]
+
+        results = await asyncio.gather(consume(), consume())
+        return results, flight.stats()
+
+    (first, second), stats = asyncio.run(main())
+    expected = [{"event": "sources", "data": "s"}, {"event": "error", "data": "retrieval failed"}]
+    assert first == expected and second == expected
+    assert stats["in_flight_streams"] == 0
+
+
+def test_do_cancels_shared_call_when_all_callers_leave():
+    async def main():
+        flight = SingleFlight("test")
+        state = {"cancelled": False}
+
+        async def work():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+            return "done"
+
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return state, flight.stats()
+
+    state, stats = asyncio.run(main())
+    assert state["cancelled"]
+    assert stats["in_flight_calls"] == 0
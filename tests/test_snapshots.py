@@ -0,0 +1,139 @@
+import os
+import time
+
+import pytest
+
+from backend.app.services.snapshots import (
+    activate_snapshot, apply_retention, create_snapshot, current_snapshot, list_snapshots, resolve_data_path,
+)
+from backend.app.services.lazy_service import LazyService
+from backend.app.services.rag_service import (
+    RAGService, SnapshotSwitcher, open_persistent_client, release_persistent_client,
+)
+
+COLLECTION = "test_kb"
+
+
+class _Embedding:
+    """固定维度的假嵌入，不加载模型。"""
+    device = "cpu"
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0, 0.0]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def _snapshot(data_root: str, texts: list) -> str:
+    """像 ingest.py 一样在新快照目录中写入 ChromaDB 集合，返回版本号 (不激活)。"""
+    version, path = create_snapshot(data_root)
+    if texts:
+        client = open_persistent_client(path)
+        try:
+            client.get_or_create_collection(COLLECTION).add(
+                ids=[f"c{i}" for i in range(len(texts))],
+                documents=texts,
+                embeddings=_Embedding().embed_documents(texts),
+            )
+        finally:
+            release_persistent_client(client, path)
+    # 版本号精确到毫秒，保证连续创建的快照按顺序排列
+    time.sleep(0.002)
+    return version
+
+
+def test_release_keeps_shared_client_alive(tmp_path):
+    path = str(tmp_path)
+    first = open_persistent_client(path)
+    second = open_persistent_client(path)
+    first.get_or_create_collection(COLLECTION).add(ids=["a"], documents=["alpha"], embeddings=[[1.0, 0.0, 0.0]])
+    # 同一路径的客户端共享 System: 释放其中一个后另一个仍然可用
+    release_persistent_client(first, path)
+    assert second.get_collection(COLLECTION).count() == 1
+    release_persistent_client(second, path)
+    # 最后一个客户端释放后可以重新打开
+    reopened = open_persistent_client(path)
+    try:
+        assert reopened.get_collection(COLLECTION).count() == 1
+    finally:
+        release_persistent_client(reopened, path)
+
+
+def test_legacy_layout_and_activation(tmp_path):
+    root = str(tmp_path)
+    assert current_snapshot(root) == ""
+    assert resolve_data_path(root) == root
+
+    version = _snapshot(root, [])
+    assert list_snapshots(root) == [version]
+    # 创建后尚未激活，仍然使用旧布局
+    assert resolve_data_path(root) == root
+    activate_snapshot(root, version)
+    assert current_snapshot(root) == version
+    assert resolve_data_path(root) == os.path.join(root, "snapshots", version)
+
+    with pytest.raises(FileNotFoundError):
+        activate_snapshot(root, "missing")
+    assert current_snapshot(root) == version
+
+
+def test_create_snapshot_copies_previous_data(tmp_path):
+    root = str(tmp_path)
+    with open(os.path.join(root, "manifest.json"), "w") as f:
+        f.write("{}")
+    version, path = create_snapshot(root, copy_from=root)
+    assert os.listdir(path) == ["manifest.json"]
+
+
+def test_retention_keeps_current_and_protected(tmp_path):
+    root = str(tmp_path)
+    versions = [_snapshot(root, []) for _ in range(5)]
+    activate_snapshot(root, versions[0])
+    removed = apply_retention(root, keep=2, protect=[versions[1]])
+    assert removed == versions[2:3]
+    assert list_snapshots(root) == [versions[0], versions[1], versions[3], versions[4]]
+
+
+def test_switch_and_rollback(tmp_path):
+    root = str(tmp_path)
+    old = _snapshot(root, ["alpha", "beta"])
+    activate_snapshot(root, old)
+    new = _snapshot(root, ["alpha", "beta", "gamma"])
+    empty = _snapshot(root, [])
+
+    loader = LazyService(COLLECTION, lambda: RAGService(root, embedding_function=_Embedding(), collection_name=COLLECTION))
+    switcher = SnapshotSwitcher(poll_sec=60, grace_sec=0)
+    switcher.watch(COLLECTION, loader, root)
+    first = loader.get()
+    assert first.snapshot_version == old and first._collection_count == 2
+
+    try:
+        # 切换到新快照: CURRENT 同时更新，旧实例在宽限期后关闭
+        status = switcher.switch(new, activate=True, collection=COLLECTION)
+        second = loader.get()
+        assert second is not first
+        assert second.snapshot_version == new and second._collection_count == 3
+        assert status["current"] == new and status["loaded"] == new
+        assert status["last_switch"]["from"] == old and status["last_switch"]["to"] == new
+        deadline = time.time() + 5
+        while not first._closed and time.time() < deadline:
+            time.sleep(0.01)
+        assert first._closed and first.collection is None
+
+        # 空快照校验失败: 不切换，CURRENT 保持不变
+        with pytest.raises(ValueError):
+            switcher.switch(empty, activate=True, collection=COLLECTION)
+        assert loader.get() is second
+        assert current_snapshot(root) == new
+        assert switcher.status(COLLECTION)["last_error"]
+
+        with pytest.raises(FileNotFoundError):
+            switcher.switch("missing", collection=COLLECTION)
+
+        # 回滚到保留的旧快照
+        status = switcher.switch(old, activate=True, collection=COLLECTION)
+        assert loader.get().snapshot_version == old and loader.get()._collection_count == 2
+        assert status["current"] == old and status["last_error"] is None
+    finally:
+        loader.get().close()
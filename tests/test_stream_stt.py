@@ -0,0 +1,139 @@
+import asyncio
+
+import numpy as np
+
+from backend.app.services.audio_service import SAMPLE_RATE
+from backend.app.services.stream_stt import StreamingTranscriber, PcmDecoder
+
+
+class _AudioService:
+    """转录结果为样本数，记录每次转录的音频长度。"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def transcribe_async(self, audio):
+        self.calls.append(len(audio))
+        await asyncio.sleep(0)
+        return f" {len(audio)} samples "
+
+
+def _speech(seconds: float) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def _silence(seconds: float) -> np.ndarray:
+    return np.zeros(int(seconds * SAMPLE_RATE), np.float32)
+
+
+def _transcriber(audio_service, messages, window_sec=5.0):
+    async def send(message):
+        messages.append(message)
+
+    return StreamingTranscriber(audio_service, send, step_sec=0.5, window_sec=window_sec, silence_sec=0.3, silence_rms=0.01)
+
+
+async def _feed(transcriber, audio, chunk_sec=0.1):
+    chunk = int(chunk_sec * SAMPLE_RATE)
+    for start in range(0, len(audio), chunk):
+        await transcriber.feed(audio[start:start + chunk])
+        # 让后台的 partial 转录有机会完成
+        await asyncio.sleep(0.001)
+
+
+def test_partials_while_speaking_then_final_on_silence():
+    audio_service, messages = _AudioService(), []
+    transcriber = _transcriber(audio_service, messages)
+
+    async def main():
+        await _feed(transcriber, _speech(1.2))
+        partials = list(messages)
+        await _feed(transcriber, _silence(0.5))
+        return partials
+
+    partials = asyncio.run(main())
+    # 每新增 0.5 秒语音推送一次 partial，内容是片段开头到当前的音频
+    assert [m["type"] for m in partials] == ["partial", "partial"]
+    assert [m["text"] for m in partials] == [f"{int(0.5 * SAMPLE_RATE)} samples", f"{int(1.0 * SAMPLE_RATE)} samples"]
+    assert all(m["segment_id"] == 0 for m in partials)
+
+    finals = [m for m in messages if m["type"] == "final"]
+    # 末尾静音达到 0.3 秒即结束片段，final 包含全部语音和该段静音
+    assert finals == [{"type": "final", "segment_id": 0, "text": f"{int(1.5 * SAMPLE_RATE)} samples"}]
+    assert transcriber.text_for() == f"{int(1.5 * SAMPLE_RATE)} samples"
+    assert transcriber.segment_id == 1 and not transcriber.pending_audio()
+
+
+def test_leading_silence_is_not_transcribed():
+    audio_service, messages = _AudioService(), []
+    transcriber = _transcriber(audio_service, messages)
+
+    async def main():
+        await _feed(transcriber, _silence(3.0))
+        return await transcriber.finalize()
+
+    assert asyncio.run(main()) is None
+    assert audio_service.calls == [] and messages == []
+    # 片段开始前的静音只保留最后一小段
+    assert len(transcriber._buffer) == 0
+
+
+def test_segment_is_cut_at_the_window():
+    audio_service, messages = _AudioService(), []
+    transcriber = _transcriber(audio_service, messages, window_sec=1.0)
+
+    asyncio.run(_feed(transcriber, _speech(2.0)))
+    finals = [m for m in messages if m["type"] == "final"]
+    assert [m["segment_id"] for m in finals] == [0, 1]
+    assert all(m["text"] == f"{SAMPLE_RATE} samples" for m in finals)
+
+
+def test_partial_finishing_after_the_segment_ended_is_dropped():
+    messages = []
+
+    class _SlowPartials(_AudioService):
+        def __init__(self):
+            super().__init__()
+            self.release = asyncio.Event()
+
+        async def transcribe_async(self, audio):
+            if not self.calls:
+                # 第一次 (partial) 转录在片段结束之后才返回
+                self.calls.append(len(audio))
+                await self.release.wait()
+                return "stale"
+            return await super().transcribe_async(audio)
+
+    async def main():
+        audio_service = _SlowPartials()
+        transcriber = _transcriber(audio_service, messages)
+        await _feed(transcriber, _speech(0.6))
+        await _feed(transcriber, _silence(0.4))
+        audio_service.release.set()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert [m["type"] for m in messages] == ["final"]
+    assert "stale" not in [m.get("text") for m in messages]
+
+
+def test_pcm_decoder_keeps_split_samples_and_resamples():
+    async def main():
+        inbox = asyncio.Queue()
+        decoder = PcmDecoder(inbox, "pcm_s16le", sample_rate=8000, channels=1)
+        frames = np.full(800, 16384, np.int16).tobytes()
+        # 在一个采样中间拆开
+        await decoder.feed(frames[:801])
+        await decoder.feed(frames[801:])
+        await decoder.close()
+        chunks = []
+        while (item := await inbox.get()) is not None:
+            chunks.append(item)
+        return chunks
+
+    chunks = asyncio.run(main())
+    audio = np.concatenate(chunks)
+    # 8 kHz 的 0.1 秒 -> 16 kHz 的 1600 个采样
+    assert len(audio) == 1600
+    np.testing.assert_allclose(audio, 0.5)
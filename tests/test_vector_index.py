@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from backend.app.services import vector_index
+from backend.app.services.vector_index import VectorIndex, VectorIndexBuilder
+from backend.app.services.versioned_dir import current_version
+
+
+def _build(tmp_path, num_docs=50, dimension=8, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(num_docs, dimension)).astype(np.float32)
+    builder = VectorIndexBuilder()
+    ids = [f"chunk-{i}" for i in range(num_docs)]
+    builder.add_batch(ids[:20], vectors[:20], [f"doc {i}" for i in range(20)], [{"row": i} for i in range(20)])
+    builder.add_batch(ids[20:], vectors[20:], [f"doc {i}" for i in range(20, num_docs)],
+                      [{"row": i} for i in range(20, num_docs)])
+    builder.write(str(tmp_path), embedding_model="test-model")
+    return VectorIndex.open(str(tmp_path)), vectors
+
+
+def _reference_top_k(index, vectors, queries, k):
+    # 与索引相同的 float16 精度下的暴力检索
+    stored = np.asarray(index.embeddings, dtype=np.float32)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ stored.T
+    return [list(np.argsort(-row, kind="stable")[:k]) for row in scores], scores
+
+
+def test_round_trip_records_and_ids(tmp_path):
+    index, _ = _build(tmp_path)
+    assert index.num_docs == 50 and index.dimension == 8
+    assert index.meta["embedding_model"] == "test-model"
+    assert index.chunk_id(21) == "chunk-21"
+    assert index.record(21) == ("doc 21", {"row": 21})
+    assert index.rows_for(["chunk-3", "missing", "chunk-42"]) == {"chunk-3": 3, "chunk-42": 42}
+
+
+@pytest.mark.parametrize("block_rows", [7, 16, 16384])
+def test_search_matches_brute_force_across_blocks(tmp_path, monkeypatch, block_rows):
+    monkeypatch.setattr(vector_index, "SEARCH_BLOCK_ROWS", block_rows)
+    index, vectors = _build(tmp_path)
+    queries = np.random.default_rng(1).normal(size=(3, 8)).astype(np.float32)
+    results = index.search_batch(queries, k=5)
+    expected, scores = _reference_top_k(index, vectors, queries, 5)
+    for query_idx, hits in enumerate(results):
+        assert [row for row, _ in hits] == expected[query_idx]
+        assert [score for _, score in hits] == pytest.approx([scores[query_idx][row] for row in expected[query_idx]], abs=1e-5)
+
+
+def test_search_with_k_above_num_docs_returns_all_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "SEARCH_BLOCK_ROWS", 4)
+    index, _ = _build(tmp_path, num_docs=10)
+    hits = index.search_batch([index.embeddings[2]], k=50)[0]
+    assert len(hits) == 10
+    assert hits[0][0] == 2
+    assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+
+
+def test_rebuild_switches_current_and_removes_old_version(tmp_path):
+    first, _ = _build(tmp_path)
+    second, _ = _build(tmp_path, num_docs=5, seed=2)
+    assert current_version(str(tmp_path)) == second.version != first.version
+    assert VectorIndex.open(str(tmp_path)).num_docs == 5
+    assert not (tmp_path / first.version).exists()
+
+
+def test_dimension_mismatch_raises(tmp_path):
+    index, _ = _build(tmp_path)
+    with pytest.raises(ValueError):
+        index.search_batch([[1.0, 0.0]], k=3)
@@ -0,0 +1,72 @@
+import os
+import time
+
+import numpy as np
+
+from backend.app.ingestion.manifest import MANIFEST_FILENAME
+from backend.app.ingestion.watcher import KnowledgeBaseWatcher
+from backend.app.services.lazy_service import LazyService
+from backend.app.services.rag_service import RAGService, SnapshotSwitcher
+from backend.app.services.snapshots import activate_snapshot, create_snapshot, current_snapshot, snapshot_path
+
+COLLECTION = "test_kb"
+
+
+class _Embedding:
+    """固定维度的假嵌入，不加载模型。"""
+    device = "cpu"
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0, 0.0]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_array(self, texts):
+        return np.asarray(self.embed_documents(texts), dtype=np.float32)
+
+
+def _wait_closed(service, timeout=5.0):
+    deadline = time.time() + timeout
+    while not service._closed and time.time() < deadline:
+        time.sleep(0.01)
+    return service._closed
+
+
+def test_live_ingest_writes_through_new_snapshot(tmp_path):
+    kb_dir, root = tmp_path / "kb", str(tmp_path / "data")
+    kb_dir.mkdir()
+    (kb_dir / "a.txt").write_text("The quick brown fox jumps over the lazy dog.", encoding="utf-8")
+    initial, _ = create_snapshot(root)
+    activate_snapshot(root, initial)
+
+    embedding = _Embedding()
+    loader = LazyService(COLLECTION, lambda: RAGService(root, embedding_function=embedding, collection_name=COLLECTION))
+    switcher = SnapshotSwitcher(poll_sec=60, grace_sec=0)
+    switcher.watch(COLLECTION, loader, root)
+    watcher = KnowledgeBaseWatcher(loader, switcher, collection_name=COLLECTION, knowledge_base_dir=str(kb_dir), parse_workers=1)
+
+    first = loader.get()
+    try:
+        summary = watcher._ingest()
+        assert summary["applied"] and summary["added"] == 1 and summary["chunks_written"] >= 1
+        second = loader.get()
+        assert second.snapshot_version == summary["snapshot"] == current_snapshot(root)
+        assert second._collection_count == summary["chunks_written"]
+        # 生效中的快照没有被修改，作为回滚目标保留
+        assert not os.path.exists(os.path.join(snapshot_path(root, initial), MANIFEST_FILENAME))
+        # 旧实例在摄取期间被持有，结束后按宽限期关闭
+        assert _wait_closed(first)
+
+        # 没有变化时不创建快照
+        assert watcher._ingest() == {"applied": False, "reason": "no_changes"}
+        assert loader.get() is second
+
+        (kb_dir / "b.txt").write_text("Pack my box with five dozen liquor jugs.", encoding="utf-8")
+        summary = watcher._ingest()
+        third = loader.get()
+        assert summary["added"] == 1 and third.snapshot_version == summary["snapshot"] != second.snapshot_version
+        assert third._collection_count == second._collection_count + summary["chunks_written"]
+        assert _wait_closed(second)
+    finally:
+        loader.get().close()